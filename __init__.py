@@ -4,11 +4,24 @@ from aqt.qt import *
 from aqt.editor import Editor
 from anki.hooks import addHook
 from aqt.browser import Browser
-import re
+import time
+import logging
+import threading
 
 # 导入依赖模块
 from .config_ui import setup_config_ui
-from .ai_service import generate_explanations_batch, ExplanationTask, generate_batch_explanation
+from .ai_service import (
+    generate_explanations_batch, ExplanationTask, generate_batch_explanation, generate_split_explanation, effective_max_workers,
+    task_dedup_key, TaskFeed, GenerationCancelled, BatchStopped, resolve_field_prompt, resolve_system_prompt
+)
+from .concurrency import get_concurrency_controller
+from .job_journal import JobJournal, list_unfinished_jobs, restore_tasks
+from .logger import configure_logging, log_event
+from .token_estimator import RunEstimate, token_prices
+from .metrics import RunMetrics, activate, deactivate, format_report_html
+from .progress_ui import BatchProgressDialog
+from .prescan import chunk_note_ids, is_field_visually_empty, new_scan_stats, scan_notes_chunk
+from . import async_engine
 
 # --- 辅助函数：用于配置加载和字段检查 ---
 
@@ -18,43 +31,311 @@ def load_config():
 def open_settings():
     setup_config_ui(mw)
 
-def is_field_visually_empty(text):
-    """检测字段是否视觉上为空（忽略HTML标签和空格）"""
-    if not text: return True
-    text = text.replace("&nbsp;", " ")
-    text = re.sub(r'<[^>]+>', '', text)
-    return not bool(text.strip())
+def target_fields(item, is_overwrite_mode):
+    """更新模式只写空字段；覆盖模式合并空字段和非空字段"""
+    target_map = dict(item["empty_map"])
+    if is_overwrite_mode:
+        target_map.update(item["non_empty_map"])
+    return target_map
+
+# 用户选择模式之前最多暂存的预扫描条目；超出后只累计统计，开始生成时从未暂存的笔记起重新扫描
+PRESCAN_BUFFER_ITEMS = 1000
+
+class PreScanSummary:
+    """
+    累计后台预扫描的统计供确认弹窗实时显示，并暂存用户选择模式之前扫描到的条目。
+    暂存按扫描块整块进行：buffered_notes 为已暂存条目覆盖的选中笔记数，truncated 表示之后的条目未暂存。
+    """
+    def __init__(self, total_notes, config):
+        self.config = config
+        self.stats = new_scan_stats(total_notes)
+        self.items = []
+        self.buffered_notes = 0
+        self.truncated = False
+        self.finished = False
+        self.item_count = 0
+        self.update_notes = 0
+        # 去重统计：共享牌组重复笔记、句子卡等内容相同的笔记只需请求一次
+        self.update_keys = set()
+        self.overwrite_keys = set()
+        # 预估 Token：只累计去重后实际会发出的请求（未计入本地缓存命中）
+        system_prompt = resolve_system_prompt(config)
+        notes_per_request = config.get("packSize", 5) if config.get("enablePackedRequests", False) else 1
+        self.update_estimate = RunEstimate(system_prompt, notes_per_request)
+        self.overwrite_estimate = RunEstimate(system_prompt, notes_per_request)
+
+    def _count(self, keys, estimate, item, fields):
+        key = task_dedup_key(item["word"], item["context"], fields)
+        if key in keys: return
+        keys.add(key)
+        estimate.add(item["word"], item["context"], {field: resolve_field_prompt(prompt) for field, prompt in fields.items()})
+
+    def add(self, items, stats):
+        self.stats = stats
+        for item in items:
+            if item["empty_map"]:
+                self.update_notes += 1
+                self._count(self.update_keys, self.update_estimate, item, item["empty_map"])
+            self._count(self.overwrite_keys, self.overwrite_estimate, item, target_fields(item, True))
+        if not self.truncated and len(self.items) < PRESCAN_BUFFER_ITEMS:
+            self.items.extend(items)
+            self.buffered_notes = stats["scanned_notes"]
+        else:
+            self.truncated = True
+        self.item_count += len(items)
+
+    def text(self):
+        stats = self.stats
+        if self.finished:
+            status = f"选中笔记数: {stats['total_notes']}"
+        else:
+            status = f"扫描中... {stats['scanned_notes']}/{stats['total_notes']}（可随时开始，剩余笔记边扫描边处理）"
+        update_requests, overwrite_requests = len(self.update_keys), len(self.overwrite_keys)
+        return (
+            f"准备执行生成任务：\n"
+            f"{status}\n"
+            f"未配置笔记类型: {stats['skipped_not_configured']}\n"
+            f"----------------------------------\n"
+            f"包含字段总数: {stats['total_configured_fields']}\n"
+            f"  ├─ 将更新字段数 (为空): {stats['ready_to_update']}\n"
+            f"  └─ 将跳过字段数 (已有内容): {stats['skipped_not_empty']}\n"
+            f"----------------------------------\n"
+            f"去重后请求数: 更新 {update_requests}（节省 {self.update_notes - update_requests}）"
+            f" / 覆盖 {overwrite_requests}（节省 {self.item_count - overwrite_requests}）\n"
+            f"----------------------------------\n"
+            f"{self.estimate_text()}\n\n"
+            f"提示：如需写入“将跳过字段”，请点击【覆盖】。"
+        )
+
+    def estimate_text(self):
+        """预估 Token 与各服务（已填写 API Key 的）按单价折算的费用；扫描未结束时为已扫描部分的预估"""
+        update, overwrite = self.update_estimate, self.overwrite_estimate
+        lines = [
+            f"预估 Token（离线近似，未计入本地缓存命中）:",
+            f"  ├─ 更新: 输入 ~{update.input_tokens:,} / 输出 ~{update.output_tokens:,}",
+            f"  └─ 覆盖: 输入 ~{overwrite.input_tokens:,} / 输出 ~{overwrite.output_tokens:,}",
+        ]
+        current = self.config.get("aiService", "openai")
+        for service, api_config in self.config.get("apiConfig", {}).items():
+            if not api_config.get("apiKey"): continue
+            marker = "（当前）" if service == current else ""
+            if any(token_prices(api_config)):
+                lines.append(f"预估费用 {service}/{api_config.get('model', '')}{marker}: "
+                             f"更新 ${update.cost(api_config):.4f} / 覆盖 ${overwrite.cost(api_config):.4f}")
+            elif service == current:
+                lines.append(f"预估费用 {service}/{api_config.get('model', '')}{marker}: 未配置单价")
+        budget = self.config.get("tokenBudget", 0)
+        if budget:
+            warning = "，预估已超出，达到后将停止派发新任务" if update.total_tokens > budget or overwrite.total_tokens > budget else ""
+            lines.append(f"Token 预算上限: {budget:,}{warning}")
+        return "\n".join(lines)
 
 # --- Worker Thread (后台线程)：用于后台批量生成释义，避免界面卡顿 ---
 
 class BatchGenerationWorker(QThread):
-    progress_signal = pyqtSignal(int, int, str)
-    finished_signal = pyqtSignal(list)
+    chunk_signal = pyqtSignal(list)
+    finished_signal = pyqtSignal()
+    cancelled_signal = pyqtSignal()
+    stopped_signal = pyqtSignal(str)
     error_signal = pyqtSignal(str)
 
-    def __init__(self, tasks, config):
+    def __init__(self, tasks, config, journal=None, metrics=None):
         super().__init__()
         self.tasks = tasks
         self.config = config
-        self.is_cancelled = False
+        self.journal = journal
+        self.metrics = metrics or RunMetrics()
+        self.cancel_event = threading.Event()
+        self.pending_chunk = []
+        self.last_chunk_time = time.monotonic()
+        # 最新进度 (已完成, 总数, 当前单词)：由进度面板定时读取，不再逐任务发信号
+        self.progress = (0, len(tasks) if isinstance(tasks, list) else 0, "")
 
     def run(self):
+        # 在本线程激活指标，引擎提交任务时随上下文传递到工作线程和协程
+        token = activate(self.metrics)
+        self.metrics.mark_started()
         try:
+            configure_logging(self.config)
+
             def service_callback(completed, total, word):
-                if self.is_cancelled: return
-                self.progress_signal.emit(completed, total, word)
+                self.progress = (completed, total, word)
 
-            max_workers = self.config.get("maxConcurrentRequests", 3) if self.config.get("enableMultiThreading", True) else 1
-            results = generate_explanations_batch(self.tasks, max_workers, service_callback)
-            
-            if not self.is_cancelled:
-                self.finished_signal.emit(results)
+            # 异步引擎需要 aiohttp；不可用时回退到线程池引擎
+            if self.config.get("generationEngine", "thread") == "asyncio" and async_engine.is_available():
+                max_in_flight = self.config.get("asyncMaxInFlight", 50)
+                async_engine.generate_explanations_batch_async(self.tasks, self.config, max_in_flight, service_callback, self.on_task_finished, self.cancel_event)
+            else:
+                max_workers = effective_max_workers(self.config)
+                generate_explanations_batch(self.tasks, self.config, max_workers, service_callback, self.on_task_finished, self.cancel_event)
+
+            # 取消时已完成的结果同样交给主线程写入
+            self.flush_chunk()
+            if self.is_cancelled:
+                self.cancelled_signal.emit()
+            else:
+                self.finished_signal.emit()
+        except BatchStopped as e:
+            # 达到 Token 预算或批量截止时间前完成的结果照常写入；未派发的任务保留在任务日志中，可以恢复
+            self.flush_chunk()
+            self.stopped_signal.emit(str(e))
         except Exception as e:
+            self.flush_chunk()
             self.error_signal.emit(str(e))
+        finally:
+            self.metrics.mark_finished()
+            deactivate(token)
+
+    def on_task_finished(self, task):
+        """每完成一个任务：先写入任务日志，再攒成小批次交给主线程写入集合"""
+        if self.journal: self.journal.record_result(task)
+        self.metrics.incr("notes" if task.success else "failed_notes", 1 + len(task.duplicate_note_ids))
+        self.metrics.incr("tokens", task.tokens)
+        if task.cache_hit: self.metrics.incr("cache_hits")
+        self.pending_chunk.append(task)
+        chunk_size = self.config.get("saveChunkSize", 50)
+        chunk_seconds = self.config.get("saveChunkSeconds", 5)
+        if len(self.pending_chunk) >= chunk_size or time.monotonic() - self.last_chunk_time >= chunk_seconds:
+            self.flush_chunk()
+
+    def flush_chunk(self):
+        if self.pending_chunk:
+            self.chunk_signal.emit(self.pending_chunk)
+            self.pending_chunk = []
+        self.last_chunk_time = time.monotonic()
+
+    @property
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
 
     def cancel(self): 
+        """取消未开始的任务并中止进行中的请求；任务源为 TaskFeed 时同时停止接收新任务"""
+        self.cancel_event.set()
+        if isinstance(self.tasks, TaskFeed): self.tasks.close()
+
+    def progress_snapshot(self):
+        """返回 (已完成, 总数, 当前单词, 总数是否已确定)；任务源仍在接收新任务时总数还会增长"""
+        completed, total, word = self.progress
+        total_known = not isinstance(self.tasks, TaskFeed) or self.tasks.closed
+        return completed, max(total, len(self.tasks) if isinstance(self.tasks, list) else self.tasks.count), word, total_known
+
+    def current_concurrency(self):
+        """自适应并发启用时返回当前并发数，否则返回 None"""
+        controller = get_concurrency_controller(self.config.get("aiService", "openai"), self.config)
+        return controller.current_limit if controller else None
+
+# --- 预扫描线程：后台分块扫描选中笔记，每块完成后把条目和累计统计发回主线程 ---
+
+class PreScanWorker(QThread):
+    chunk_signal = pyqtSignal(list, dict)
+    finished_signal = pyqtSignal(dict)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, nids, note_type_configs, metrics=None):
+        super().__init__()
+        self.nids = list(nids)
+        self.note_type_configs = note_type_configs
+        self.metrics = metrics
+        self.is_cancelled = False
+        self.feed = None  # 开始生成后设置：扫描前等待任务队列有空位，扫描速度跟随生成速度
+
+    def run(self):
+        try:
+            stats = new_scan_stats(len(self.nids))
+            plans = {}
+            for chunk in chunk_note_ids(self.nids):
+                if self.feed is not None: self.feed.wait_for_space()
+                if self.is_cancelled: return
+                started = time.perf_counter()
+                items = scan_notes_chunk(mw.col, chunk, self.note_type_configs, plans, stats)
+                if self.metrics: self.metrics.observe("prescan", time.perf_counter() - started)
+                self.chunk_signal.emit(items, dict(stats))
+            if not self.is_cancelled:
+                self.finished_signal.emit(dict(stats))
+        except Exception as e:
+            self.error_signal.emit(str(e))
+
+    def cancel(self):
         self.is_cancelled = True
 
+# --- 任务生产：按用户选择的模式把预扫描条目转换为任务，边扫描边放入 Worker 的任务队列 ---
+
+class BatchTaskProducer:
+    """
+    在主线程中运行，与 ResultWriter 串行执行，因此可以安全地修改尚未写入的任务。
+    内容相同的笔记合并为一个任务（结果在 ResultWriter 中分发）；
+    若相同任务的结果已经写入集合，后到的笔记直接复用结果写入，不再请求。
+    只有尚未写入的任务留在内存中；已写入的任务只保留去重摘要到笔记 ID 的映射。
+    """
+    def __init__(self, is_overwrite_mode, use_cache, journal, writer, allow_split=False):
+        self.is_overwrite_mode = is_overwrite_mode
+        self.allow_split = allow_split
+        self.use_cache = use_cache
+        self.journal = journal
+        self.writer = writer
+        self.feed = TaskFeed()
+        # 去重摘要 -> 主笔记 ID；主笔记 ID -> 尚未写入的任务
+        self.primary_by_key = {}
+        self.pending = {}
+        # 结果缺少部分字段的已写入任务：主笔记 ID -> 实际写入的字段名（通常为空）
+        self.partial_fields = {}
+        writer.on_tasks_done = self.on_tasks_done
+
+    def _new_task(self, item, target_map):
+        return ExplanationTask(
+            note_id=item["nid"],
+            word=item["word"],
+            context=item["context"],
+            field_prompts_map=target_map,
+            use_cache=self.use_cache,
+            split_fields=self.allow_split and item["split"]
+        )
+
+    def add_items(self, items):
+        if self.feed.closed: return
+        reused = []
+        for item in items:
+            target_map = target_fields(item, self.is_overwrite_mode)
+            # 如果当前笔记没有需要处理的字段，则跳过
+            if not target_map: continue
+            key = task_dedup_key(item["word"], item["context"], target_map)
+            primary_nid = self.primary_by_key.get(key)
+            if primary_nid is None:
+                task = self._new_task(item, target_map)
+                self.primary_by_key[key] = task.note_id
+                self.pending[task.note_id] = task
+                self.journal.record_task(task)
+                self.feed.put(task)
+            elif primary_nid in self.pending:
+                self.pending[primary_nid].duplicate_note_ids.append(item["nid"])
+                self.journal.record_duplicate(primary_nid, item["nid"])
+            else:
+                # 写入后任务已释放，从已写入的笔记复制相同字段
+                task = self._new_task(item, target_map)
+                source = mw.col.get_note(primary_nid)
+                fields = self.partial_fields.get(primary_nid, target_map)
+                task.results_map = {field: source[field] for field in fields if field in source}
+                task.success = True
+                self.journal.record_task(task)
+                reused.append(task)
+        if reused:
+            self.writer.write_chunk(reused)
+
+    def on_tasks_done(self, written_tasks, failed_tasks):
+        """ResultWriter 处理完一个小批次后调用：释放任务；失败任务的去重记录一并删除，后到的相同笔记重新请求"""
+        for task in written_tasks:
+            if self.pending.pop(task.note_id, None) is None: continue
+            if set(task.results_map) != set(task.field_prompts_map):
+                self.partial_fields[task.note_id] = tuple(task.results_map)
+        for task in failed_tasks:
+            if self.pending.pop(task.note_id, None) is None: continue
+            key = task_dedup_key(task.word, task.context, task.field_prompts_map)
+            if self.primary_by_key.get(key) == task.note_id:
+                del self.primary_by_key[key]
+
+    def close(self):
+        self.feed.close()
+
 # --- 浏览器批量逻辑：在浏览器中为选中的笔记批量生成释义 ---
 
 def setup_browser_menu(browser):
@@ -63,6 +344,9 @@ def setup_browser_menu(browser):
     action = QAction("批量生成释义", browser)
     action.triggered.connect(lambda: on_browser_batch_generate(browser))
     menu.addAction(action)
+    resume_action = QAction("恢复未完成的 LexiSage 任务...", browser)
+    resume_action.triggered.connect(lambda: on_browser_resume_job(browser))
+    menu.addAction(resume_action)
     menu.addSeparator()
     menu.addAction(QAction("设置...", browser, triggered=open_settings))
 
@@ -71,89 +355,24 @@ def on_browser_batch_generate(browser):
     selected_nids = browser.selectedNotes()
     if not selected_nids: return showInfo("请先选择笔记。")
 
-    mw.app.setOverrideCursor(QCursor(Qt.CursorShape.WaitCursor))
-    
-    # --- 1. 预计算阶段：扫描所有选中笔记，统计状态 ---
-    # 我们暂时不创建 Task 对象，而是存储元数据，以便用户决定后生成
-    pre_scan_data = [] 
-    
-    stats = {
-        "total_notes": len(selected_nids),
-        "total_configured_fields": 0, # 总共涉及的配置字段数 (Update + Skip)
-        "ready_to_update": 0,         # 当前为空，准备写入
-        "skipped_not_empty": 0,       # 当前非空，默认跳过
-        "skipped_not_configured": 0   # 笔记类型未配置
-    }
-
-    try:
-        configs_cache = config.get("noteTypeConfigs", {})
-        
-        for nid in selected_nids:
-            note = mw.col.get_note(nid)
-            nt_name = note.note_type()["name"]
-            
-            if nt_name not in configs_cache:
-                stats["skipped_not_configured"] += 1
-                continue
-                
-            conf = configs_cache[nt_name]
-            src = conf.get("fieldToExplain")
-            ctx_field = conf.get("contextField")
-            field_prompts = conf.get("fieldPrompts", {}) 
-            
-            # 检查源字段
-            if not src or src not in note or is_field_visually_empty(note[src]):
-                continue
+    # --- 1. 预扫描阶段：后台线程分块扫描，统计实时显示在确认弹窗中，主窗口不被阻塞 ---
+    # 用户选择模式之前只暂存元数据；选择之后扫描到的条目直接转换为任务
+    summary = PreScanSummary(len(selected_nids), config)
+    metrics = RunMetrics(f"{len(selected_nids)} 条选中笔记")
+    scanner = PreScanWorker(selected_nids, config.get("noteTypeConfigs", {}), metrics)
+    producer = None
 
-            # 分类目标字段
-            empty_fields_map = {}      # 准备更新 (空)
-            non_empty_fields_map = {}  # 准备跳过 (非空)
-
-            for target_field, prompt_tmpl in field_prompts.items():
-                if target_field not in note: continue
-                
-                stats["total_configured_fields"] += 1
-                
-                if is_field_visually_empty(note[target_field]):
-                    empty_fields_map[target_field] = prompt_tmpl
-                    stats["ready_to_update"] += 1
-                else:
-                    non_empty_fields_map[target_field] = prompt_tmpl
-                    stats["skipped_not_empty"] += 1
-            
-            # 只有当该笔记至少有一个配置的目标字段（无论空或非空）时，才记录
-            if empty_fields_map or non_empty_fields_map:
-                context_val = note[ctx_field] if ctx_field and ctx_field in note else ""
-                
-                pre_scan_data.append({
-                    "nid": nid,
-                    "word": note[src],
-                    "context": context_val,
-                    "empty_map": empty_fields_map,
-                    "non_empty_map": non_empty_fields_map
-                })
-
-    finally:
-        mw.app.restoreOverrideCursor()
-
-    if not pre_scan_data:
-        return showInfo(f"未找到可处理的任务。\n选中: {stats['total_notes']}\n未配置: {stats['skipped_not_configured']}")
-
-    # --- 2. 构造高级确认弹窗 ---
+    # --- 2. 构造高级确认弹窗（非模态，扫描过程中持续刷新） ---
     msg_box = QMessageBox(browser.window())
     msg_box.setWindowTitle("LexiSage 任务确认")
     msg_box.setIcon(QMessageBox.Icon.Question)
-    
-    text = (
-        f"准备执行生成任务：\n"
-        f"选中笔记数: {stats['total_notes']}\n"
-        f"----------------------------------\n"
-        f"包含字段总数: {stats['total_configured_fields']}\n"
-        f"  ├─ 将更新字段数 (为空): {stats['ready_to_update']}\n"
-        f"  └─ 将跳过字段数 (已有内容): {stats['skipped_not_empty']}\n\n"
-        f"提示：如需写入“将跳过字段”，请点击【覆盖】。"
-    )
-    msg_box.setText(text)
+    msg_box.setModal(False)
+    msg_box.setText(summary.text())
+
+    # 跳过缓存选项：勾选后强制重新请求 AI（新结果仍会写回缓存）
+    bypass_cache_checkbox = QCheckBox("跳过本地缓存，强制重新请求 AI")
+    bypass_cache_checkbox.setEnabled(config.get("enableResponseCache", True))
+    msg_box.setCheckBox(bypass_cache_checkbox)
     
     # 自定义按钮：提供覆盖、更新和取消三个选项，布局上使Update和Cancel靠近，Overwrite独立
     # 1. 添加覆盖按钮（独立放置）
@@ -167,132 +386,358 @@ def on_browser_batch_generate(browser):
     
     msg_box.setDefaultButton(btn_update)
     msg_box.setEscapeButton(btn_cancel)
-    
-    msg_box.exec()
-    
-    clicked_button = msg_box.clickedButton()
 
-    # --- 3. 根据用户选择构建最终任务列表 ---
-    final_tasks = []
-    
-    if clicked_button == btn_cancel:
-        return # 用户取消
-        
-    is_overwrite_mode = (clicked_button == btn_overwrite)
-    
-    for item in pre_scan_data:
-        target_map = {}
-        
-        if is_overwrite_mode:
-            # 覆盖模式：合并空字段和非空字段
-            target_map.update(item["empty_map"])
-            target_map.update(item["non_empty_map"])
+    def on_scan_chunk(items, stats):
+        if producer:
+            producer.add_items(items)
+            return
+        summary.add(items, stats)
+        msg_box.setText(summary.text())
+
+    def on_scan_finished(stats):
+        summary.finished = True
+        summary.stats = stats
+        if producer:
+            producer.close()
+            return
+        if not summary.item_count:
+            msg_box.close()
+            return showInfo(f"未找到可处理的任务。\n选中: {stats['total_notes']}\n未配置: {stats['skipped_not_configured']}")
+        msg_box.setText(summary.text())
+
+    def on_scan_error(err):
+        summary.finished = True
+        if producer:
+            # 已扫描部分照常处理
+            producer.close()
         else:
-            # 更新模式：只使用空字段
-            target_map.update(item["empty_map"])
-            
-        # 如果当前笔记有需要处理的字段，则创建任务
-        if target_map:
-            task = ExplanationTask(
-                note_id=item["nid"],
-                word=item["word"],
-                context=item["context"],
-                config=config,
-                field_prompts_map=target_map
-            )
-            final_tasks.append(task)
-
-    if not final_tasks:
-        return showInfo("没有需要更新的字段 (所有字段均已有内容，且未选择覆盖)。")
-
-    # --- 4. 启动 Worker ---
-    # 此时 final_tasks 里的字段就是我们确定要写的，save_results 不需要再做空检查
-    browser._lexisage_worker = BatchGenerationWorker(final_tasks, config)
+            msg_box.close()
+        showInfo(f"预扫描出错: {err}")
+
+    def hold_scanner(worker):
+        # 持有扫描线程的引用直到其结束，避免线程对象在运行中被回收
+        scanners = getattr(browser, "_lexisage_scanners", set())
+        scanners.add(worker)
+        browser._lexisage_scanners = scanners
+        worker.finished.connect(lambda: scanners.discard(worker))
+
+    def on_rescan_error(err):
+        producer.close()
+        showInfo(f"预扫描出错: {err}")
+
+    def on_button_clicked(button):
+        nonlocal producer, scanner
+        if button == btn_cancel:
+            scanner.cancel()
+            return
+
+        # --- 3. 根据用户选择生成任务：已扫描的条目立即转换，其余条目随扫描进度放入任务队列 ---
+        # 此时任务里的字段就是我们确定要写的，ResultWriter 不需要再做空检查
+        is_overwrite_mode = (button == btn_overwrite)
+        mode_text = "覆盖" if is_overwrite_mode else "更新"
+        journal = JobJournal.create(description=f"{mode_text} {summary.stats['total_notes']} 条选中笔记")
+        writer = ResultWriter(browser, journal, metrics)
+        # 按字段拆分只用于小批量：交互式等待时低延迟优先，大批量时 Token 效率优先
+        allow_split = summary.stats["total_notes"] <= config.get("splitMaxBatchSize", 20)
+        producer = BatchTaskProducer(is_overwrite_mode, not bypass_cache_checkbox.isChecked(), journal, writer, allow_split)
+        producer.add_items(summary.items)
+        summary.items = []
+        if summary.truncated:
+            # 暂存已满后扫描到的条目没有保留：停止统计扫描，从第一个未暂存的笔记起重新扫描，条目直接转换为任务
+            scanner.cancel()
+            for signal in (scanner.chunk_signal, scanner.finished_signal, scanner.error_signal):
+                signal.disconnect()
+            scanner = PreScanWorker(selected_nids[summary.buffered_notes:], config.get("noteTypeConfigs", {}), metrics)
+            scanner.feed = producer.feed
+            scanner.chunk_signal.connect(lambda items, stats: producer.add_items(items))
+            scanner.finished_signal.connect(lambda stats: producer.close())
+            scanner.error_signal.connect(on_rescan_error)
+            hold_scanner(scanner)
+            scanner.start()
+        else:
+            scanner.feed = producer.feed
+            if summary.finished:
+                producer.close()
+                if not producer.feed.count:
+                    journal.complete()
+                    return showInfo("没有需要更新的字段 (所有字段均已有内容，且未选择覆盖)。")
+
+        # --- 4. 启动 Worker ---
+        def on_cancel():
+            scanner.cancel()
+            producer.close()
+        start_batch_worker(browser, producer.feed, config, journal, writer, on_cancel, metrics)
+
+    scanner.chunk_signal.connect(on_scan_chunk)
+    scanner.finished_signal.connect(on_scan_finished)
+    scanner.error_signal.connect(on_scan_error)
+    msg_box.buttonClicked.connect(on_button_clicked)
+    hold_scanner(scanner)
+
+    scanner.start()
+    msg_box.show()
+
+def start_batch_worker(browser, tasks, config, journal, writer=None, cancel_callback=None, metrics=None):
+    """
+    启动后台 Worker 并显示进度；结果按小批次边生成边写入集合。
+    tasks 为 TaskFeed 时总数随预扫描增长；cancel_callback 用于取消时同时停止任务生产。
+    metrics 与 writer 共用同一个 RunMetrics，运行结束时附在报告中。
+    """
+    metrics = metrics or (writer.metrics if writer else None) or RunMetrics(f"任务 {journal.job_id}")
+    browser._lexisage_worker = BatchGenerationWorker(tasks, config, journal, metrics)
+    writer = writer or ResultWriter(browser, journal, metrics)
     
-    progress = QProgressDialog("启动引擎...", "取消", 0, len(final_tasks), browser.window())
-    progress.setWindowTitle("LexiSage 执行中")
-    progress.setMinimumDuration(0)
-    progress.setAutoClose(False)
-
-    def on_progress(c, t, w):
-        progress.setValue(c)
-        progress.setLabelText(f"处理中 ({c}/{t}): {w}")
-        QApplication.processEvents()
-
-    def on_finished(results):
-        progress.close()
-        save_results(results, browser)
+    progress = BatchProgressDialog(browser._lexisage_worker, metrics, config, browser.window())
+
+    def on_finished():
+        progress.finish()
+        journal.close()
+        # 有失败的任务时保留日志，失败的任务可以恢复重试
+        if writer.finish() and not writer.error_count:
+            journal.complete()
         browser._lexisage_worker = None
 
     def on_error(err):
-        progress.close()
-        showInfo(f"错误: {err}")
+        progress.finish()
+        journal.close()
+        writer.finish(show_report=False)
+        showInfo(f"错误: {err}\n已完成的结果已写入集合或保存在任务日志中，可通过「恢复未完成的 LexiSage 任务」继续。")
         browser._lexisage_worker = None
 
     def on_cancel():
+        if cancel_callback: cancel_callback()
         if browser._lexisage_worker: browser._lexisage_worker.cancel()
-        progress.close()
+        progress.finish()
+        tooltip("正在取消，等待进行中的请求结束...", parent=browser.window())
+
+    def on_cancelled():
+        # 取消前已完成的结果已写入集合；未完成的任务保留在任务日志中，可以恢复
+        journal.close()
+        writer.finish(cancelled=True)
+        browser._lexisage_worker = None
+
+    def on_stopped_early(message):
+        # 停止任务生产（预扫描可能仍在等待任务队列的空位）
+        if cancel_callback: cancel_callback()
+        if isinstance(tasks, TaskFeed): tasks.close()
+        progress.finish()
+        journal.close()
+        writer.finish(cancelled=True, reason=message)
+        browser._lexisage_worker = None
 
-    browser._lexisage_worker.progress_signal.connect(on_progress)
+    browser._lexisage_worker.chunk_signal.connect(writer.write_chunk)
     browser._lexisage_worker.finished_signal.connect(on_finished)
+    browser._lexisage_worker.cancelled_signal.connect(on_cancelled)
+    browser._lexisage_worker.stopped_signal.connect(on_stopped_early)
     browser._lexisage_worker.error_signal.connect(on_error)
+    # 线程结束时总是关闭任务日志
+    browser._lexisage_worker.finished.connect(journal.close)
     progress.canceled.connect(on_cancel)
     
     browser._lexisage_worker.start()
     progress.show()
 
-def save_results(completed_tasks, browser):
+def on_browser_resume_job(browser):
+    """从任务日志恢复：已完成的结果直接写入，只为未完成的任务重新请求"""
+    if getattr(browser, "_lexisage_worker", None):
+        return showInfo("已有 LexiSage 任务正在运行。")
+
+    jobs = list_unfinished_jobs()
+    if not jobs:
+        return showInfo("没有未完成的 LexiSage 任务。")
+
+    labels = [
+        f"{header['job_id']}  {header.get('description', '')}  (已完成 {done}/{len(header['tasks'])})"
+        for _, header, done in jobs
+    ]
+    label, ok = QInputDialog.getItem(browser.window(), "恢复 LexiSage 任务", "选择要恢复的任务:", labels, 0, False)
+    if not ok: return
+    path, header, _ = jobs[labels.index(label)]
+
+    config = load_config()
+    finished_tasks, pending_tasks = restore_tasks(path)
+
+    journal = JobJournal(path)
+    # 日志中已付费但尚未写入集合的结果先落库
+    if finished_tasks:
+        writer = ResultWriter(browser, journal)
+        writer.write_chunk(finished_tasks)
+        if not writer.finish(show_report=not pending_tasks):
+            journal.close()
+            return
+    if not pending_tasks:
+        journal.complete()
+        return
+    start_batch_worker(browser, pending_tasks, config, journal)
+
+# --- 结果写入：按小批次把结果批量写回集合，并累计最终报告 ---
+
+class ResultWriter:
     """
     将 Worker 返回的结果写回数据库。
     重要变更：不再检查 is_field_visually_empty。
     原因：任务生成前已经由用户确认了（更新模式只发了空字段，覆盖模式发了所有字段）。
     只要任务里有结果，就代表用户想写。
     """
-    saved_fields = 0
-    error_count = 0
-    total_tokens = 0
-    
-    mw.col.db.execute("begin")
-    try:
+    def __init__(self, browser, journal=None, metrics=None):
+        self.browser = browser
+        self.journal = journal
+        self.metrics = metrics
+        self.saved_fields = 0
+        self.error_count = 0
+        self.total_tokens = 0
+        self.cache_hits = 0
+        # 内容来源（服务/模型）-> 笔记数，多服务路由时可在报告中看到各服务实际承担的份额
+        self.sources = {}
+        self.write_failed = False
+        # on_tasks_done(已写入的任务, 失败的任务)：每个小批次处理完后通知任务生产者释放任务
+        self.on_tasks_done = None
+
+    def write_chunk(self, completed_tasks):
+        """在主线程中写入一个小批次：一次 update_notes 批量提交，写入后在任务日志中标记"""
+        notes = []
+        saved_tasks = []
+        failed_tasks = []
         for task in completed_tasks:
-            if task.success and task.results_map:
-                try:
-                    note = mw.col.get_note(task.note_id)
-                    total_tokens += task.tokens
-                    
+            if not (task.success and task.results_map):
+                self.error_count += 1
+                failed_tasks.append(task)
+                continue
+            try:
+                # 去重任务的结果同时写入所有内容相同的笔记
+                task_notes = []
+                for nid in [task.note_id] + task.duplicate_note_ids:
+                    note = mw.col.get_note(nid)
                     # 遍历返回的 JSON 字典，直接写入
                     for field, content in task.results_map.items():
                         if field in note:
                             note[field] = content
-                            saved_fields += 1
-                    note.flush()
-                except Exception as e:
-                    error_count += 1
-                    # 记录具体错误以便调试
-                    print(f"Error saving note {task.note_id}: {e}")
+                            self.saved_fields += 1
+                    task_notes.append(note)
+            except Exception as e:
+                self.error_count += 1
+                failed_tasks.append(task)
+                log_event(logging.ERROR, "note_save_error", nid=task.note_id, error=str(e))
+                continue
+            notes.extend(task_notes)
+            saved_tasks.append(task)
+            self.total_tokens += task.tokens
+            if task.cache_hit: self.cache_hits += 1
+            source = task.source or "未知"
+            self.sources[source] = self.sources.get(source, 0) + 1 + len(task.duplicate_note_ids)
+
+        if notes:
+            started = time.perf_counter()
+            try:
+                mw.col.update_notes(notes)
+            except Exception as e:
+                self.write_failed = True
+                self.error_count += len(saved_tasks)
+                log_event(logging.ERROR, "collection_write_error", notes=len(notes), error=str(e))
+                failed_tasks.extend(saved_tasks)
+                saved_tasks = []
+            finally:
+                if self.metrics: self.metrics.observe("db_write", time.perf_counter() - started)
+        if self.on_tasks_done: self.on_tasks_done(saved_tasks, failed_tasks)
+        # 写入后释放结果，后到的重复笔记从集合中复制
+        for task in saved_tasks:
+            task.results_map = None
+        if self.journal: self.journal.mark_saved([task.note_id for task in saved_tasks])
+
+    def finish(self, show_report=True, cancelled=False, reason=None):
+        """
+        刷新浏览器并显示报告；返回是否全部写入成功，调用方据此决定是否清理任务日志。
+        reason 为提前停止的原因（如达到 Token 预算），显示在报告标题处。
+        """
+        self.browser.model.reset()
+        if self.write_failed:
+            showInfo("部分结果写入集合失败，已保留在任务日志中，可通过「恢复未完成的 LexiSage 任务」重试。", parent=self.browser.window())
+            return False
+        if show_report:
+            heading = reason or ("已取消" if cancelled else "处理完成")
+            if cancelled:
+                note = "<p>未完成的任务可通过「恢复未完成的 LexiSage 任务」继续。</p>"
+            elif self.error_count:
+                note = "<p>失败的任务已保留在任务日志中，可通过「恢复未完成的 LexiSage 任务」重试。</p>"
             else:
-                error_count += 1
-    except Exception as e:
-        # 如果发生异常，回滚事务
-        mw.col.db.execute("rollback")
-        showInfo(f"保存数据时发生错误，事务已回滚: {e}", parent=browser.window())
-        browser.model.reset()
-        return
-    else:
-        # 如果没有异常，提交事务
-        mw.col.db.execute("commit")
-        
-    browser.model.reset()
-    showInfo(f"<h3>处理完成</h3><ul><li>填充/更新字段数: {saved_fields}</li><li>失败任务: {error_count}</li><li><b>Total Tokens: {total_tokens}</b></li></ul>", parent=browser.window(), title="LexiSage 报告", textFormat="rich")
+                note = ""
+            showInfo(f"<h3>{heading}</h3><ul><li>填充/更新字段数: {self.saved_fields}</li><li>失败任务: {self.error_count}</li><li>缓存命中: {self.cache_hits}</li><li><b>Total Tokens: {self.total_tokens}</b></li>{self.sources_report()}</ul>{note}{self.metrics_report()}", parent=self.browser.window(), title="LexiSage 报告", textFormat="rich")
+        return True
+
+    def sources_report(self):
+        if not self.sources: return ""
+        items = "，".join(f"{source}: {count}" for source, count in sorted(self.sources.items(), key=lambda item: -item[1]))
+        return f"<li>内容来源: {items}</li>"
+
+    def metrics_report(self):
+        """阶段耗时与延迟分位数；同时导出到 user_files/metrics 供不同并发设置之间对比"""
+        if not self.metrics or self.metrics.run_started is None: return ""
+        summary = self.metrics.summary()
+        try:
+            name = self.journal.job_id if self.journal else time.strftime("%Y%m%d-%H%M%S")
+            path_note = f"<p>详细指标: {self.metrics.export(name)}</p>"
+        except OSError as e:
+            path_note = f"<p>指标导出失败: {e}</p>"
+        return "<h4>性能指标</h4>" + format_report_html(summary) + path_note
 
 # --- 编辑器单卡生成：在编辑单个卡片时生成释义 ---
 
+# 正在运行的编辑器生成线程；线程结束后移除
+_editor_workers = set()
+
+class EditorGenerationWorker(QThread):
+    field_signal = pyqtSignal(str, str)
+    result_signal = pyqtSignal(object, int, bool, object)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, note_key, word, context, config, field_prompts_map, split_fields=False):
+        super().__init__()
+        self.note_key = note_key
+        self.split_fields = split_fields
+        self.word = word
+        self.context = context
+        self.config = config
+        self.field_prompts_map = field_prompts_map
+        self.cancel_event = threading.Event()
+
+    @property
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def run(self):
+        try:
+            # 按字段拆分时每个字段完成即回调；否则在开启流式输出时逐字段回调
+            generate = generate_split_explanation if self.split_fields else generate_batch_explanation
+            generated_results, tokens, cache_hit, source = generate(
+                word=self.word,
+                context=self.context,
+                config=self.config,
+                field_prompts_map=self.field_prompts_map,
+                cancel_event=self.cancel_event,
+                on_field=self.on_field
+            )
+        except GenerationCancelled:
+            return
+        except Exception as e:
+            if not self.is_cancelled: self.error_signal.emit(str(e))
+            return
+        if not self.is_cancelled:
+            self.result_signal.emit(generated_results, tokens, cache_hit, source)
+
+    def on_field(self, field, content):
+        """流式模式下每个字段生成完毕立即交给主线程填入"""
+        if not self.is_cancelled: self.field_signal.emit(field, content)
+
+    def cancel(self):
+        self.cancel_event.set()
+
 def add_editor_button(buttons, editor):
     buttons.append(editor.addButton(icon=None, cmd="lexiSage", func=lambda e=editor: on_editor_gen(e), tip="LexiSage: 立即生成", label="LexiSage"))
     return buttons
 
 def on_editor_gen(editor):
     config = load_config()
+    configure_logging(config)
     note = editor.note
     nt_name = note.note_type()["name"]
     configs = config.get("noteTypeConfigs", {})
@@ -318,40 +763,101 @@ def on_editor_gen(editor):
         showInfo("没有检测到空的配置字段。如需重新生成，请先清空目标字段内容。")
         return
 
-    progress_dialog = QProgressDialog("AI 思考中...", "取消", 0, 0, editor.parentWindow)
-    progress_dialog.setWindowModality(Qt.WindowModality.WindowModal)
-    progress_dialog.setCancelButton(None) 
-    progress_dialog.show()
-    QApplication.processEvents()
-
-    try:
-        ctx_field_name = conf.get("contextField")
-        context_val = ""
-        if ctx_field_name and ctx_field_name in note:
-            context_val = note[ctx_field_name]
-
-        generated_results, tokens = generate_batch_explanation(
-            word=note[src], 
-            context=context_val,
-            config=config,
-            field_prompts_map=batch_fields
-        )
-        
-        if generated_results:
-            for field_name, field_content in generated_results.items():
-                if field_name in note: 
-                    note[field_name] = field_content
-            note.flush()
-            editor.loadNote() 
-            tooltip(f"生成完成! 消耗 Tokens: {tokens}")
-        else:
+    ctx_field_name = conf.get("contextField")
+    context_val = ""
+    if ctx_field_name and ctx_field_name in note:
+        context_val = note[ctx_field_name]
+
+    note_key = editor_note_key(note)
+    if any(w.note_key == note_key and not w.is_cancelled for w in _editor_workers):
+        tooltip("该笔记正在生成中...", parent=editor.parentWindow)
+        return
+
+    # 后台生成：进度框非模态，等待期间编辑器和其他笔记可以正常使用
+    worker = EditorGenerationWorker(note_key, note[src], context_val, config, batch_fields, conf.get("splitFields", False))
+    progress_dialog = QProgressDialog(f"AI 思考中... {note[src]}", "取消", 0, 0, editor.parentWindow)
+    progress_dialog.setWindowTitle("LexiSage")
+    progress_dialog.setWindowModality(Qt.WindowModality.NonModal)
+    progress_dialog.setMinimumDuration(0)
+    progress_dialog.setAutoClose(False)
+
+    # 流式模式下已经逐个填入的字段
+    streamed_fields = set()
+
+    def on_field(field, content):
+        if field not in batch_fields or field in streamed_fields: return
+        streamed_fields.add(field)
+        apply_editor_results(editor, note, {field: content})
+        progress_dialog.setLabelText(f"AI 思考中... {note[src]}\n已完成 {len(streamed_fields)}/{len(batch_fields)} 个字段")
+
+    def on_result(generated_results, tokens, cache_hit, source):
+        progress_dialog.close()
+        if not generated_results:
             showInfo("API 请求失败或解析错误，请检查日志。")
-    except Exception as e:
-        # 捕获所有异常，确保对话框关闭，并显示错误信息
-        showInfo(f"生成释义时发生错误: {str(e)}")
-    finally:
+            return
+        remaining = {k: v for k, v in generated_results.items() if k not in streamed_fields}
+        if not apply_editor_results(editor, note, remaining) and not streamed_fields:
+            tooltip("目标字段在生成期间已被填写，未写入结果。")
+            return
+        tooltip("生成完成! (命中本地缓存)" if cache_hit else f"生成完成! 消耗 Tokens: {tokens}（{source}）")
+
+    def on_error(err):
+        progress_dialog.close()
+        showInfo(f"生成释义时发生错误: {err}")
+
+    def on_cancel():
+        # 取消后不再应用结果；正在进行的请求返回后仍会写入缓存
+        worker.cancel()
         progress_dialog.close()
 
+    def on_thread_finished():
+        _editor_workers.discard(worker)
+        progress_dialog.close()
+
+    worker.field_signal.connect(on_field)
+    worker.result_signal.connect(on_result)
+    worker.error_signal.connect(on_error)
+    worker.finished.connect(on_thread_finished)
+    progress_dialog.canceled.connect(on_cancel)
+    # 持有线程引用直到其结束，避免线程对象在运行中被回收
+    _editor_workers.add(worker)
+    worker.start()
+    progress_dialog.show()
+
+def editor_note_key(note):
+    """已保存的笔记按 ID 区分；添加窗口中尚未保存的新笔记按对象区分"""
+    return note.id or id(note)
+
+def apply_editor_results(editor, note, results):
+    """
+    把结果写入发起生成时的笔记，返回写入的字段数。
+    编辑器仍显示该笔记时写入编辑器中的笔记对象并刷新；否则写回集合中的笔记。
+    只填写仍为空的字段，不覆盖等待期间用户手动输入的内容。
+    """
+    current = getattr(editor, "note", None)
+    showing = getattr(editor, "web", None) is not None and current is not None and (
+        current is note or (note.id and current.id == note.id)
+    )
+    if showing:
+        target = current
+    elif note.id:
+        target = mw.col.get_note(note.id)
+    else:
+        # 新笔记未添加就被关闭或切换，结果无处可写
+        return 0
+
+    filled = 0
+    for field_name, field_content in results.items():
+        if field_name in target and is_field_visually_empty(target[field_name]):
+            target[field_name] = field_content
+            filled += 1
+    if not filled: return 0
+    if target.id:
+        mw.col.update_note(target)
+    if showing:
+        editor.loadNote()
+    return filled
+
 # --- 注册入口：将功能添加到Anki的菜单和编辑器中 ---
 
 # 1. 注册到 Tools 菜单
@@ -1,41 +1,35 @@
 import json
+import heapq
+import hashlib
+import itertools
+import contextvars
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import re
-import os
-import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
-from urllib.error import URLError, HTTPError
-from .prompts import DEFAULT_GLOBAL_SYSTEM_PROMPT, DEFAULT_FIELD_PROMPT_TEMPLATE
-
-# --- 日志记录功能：记录API请求和响应以便调试 ---
-def _write_log(service_name, url, request_payload, response_content=None, error_msg=None):
-    try:
-        addon_dir = os.path.dirname(os.path.abspath(__file__))
-        log_path = os.path.join(addon_dir, "lexisage.log")
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        safe_payload = request_payload.copy() if isinstance(request_payload, dict) else str(request_payload)
-        
-        log_entry = [
-            f"{'='*60}",
-            f"TIME: {timestamp}",
-            f"SERVICE: {service_name}",
-            f"URL: {url}",
-            f"{'-'*20} REQUEST PAYLOAD {'-'*20}",
-            json.dumps(safe_payload, ensure_ascii=False, indent=2),
-            f"{'-'*20} RESPONSE / ERROR {'-'*20}"
-        ]
-        if error_msg:
-            log_entry.append(f"ERROR: {error_msg}")
-        else:
-            log_entry.append(str(response_content))
-        log_entry.append(f"{'='*60}\n")
-
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write("\n".join(log_entry))
-    except Exception as e:
-        print(f"Logging Failed: {e}")
+import logging
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from threading import Barrier, BoundedSemaphore, Condition, Event, Lock, Thread
+from queue import Empty, Queue
+from collections import deque
+from types import MappingProxyType
+from .prompts import DEFAULT_GLOBAL_SYSTEM_PROMPT, DEFAULT_FIELD_PROMPT_TEMPLATE, PACKED_PROTOCOL_ADDENDUM, PROMPT_CACHE_LAYOUT_ADDENDUM
+from .response_cache import get_response_cache, build_cache_key, normalize_word
+from .concurrency import (
+    get_concurrency_controller, concurrency_bounds, classify_status,
+    OUTCOME_OVERLOAD, OUTCOME_ERROR
+)
+from .rate_limiter import get_rate_limiter, retry_after_seconds, MAX_PENALTY_SECONDS
+from .router import get_router
+from .hedging import get_hedge_policy, HEDGE_MAX_IN_FLIGHT
+from .retry_policy import (
+    RetryPolicy, DeadlineExceeded, error_category, request_timeout, deadline_expired, set_deadline, reset_deadline,
+    deadline_scope, ERROR_BAD_RESPONSE
+)
+from .token_estimator import estimate_request_tokens, estimate_task_tokens, token_cost, token_prices
+from .logger import log_event, log_request, debug_enabled
+from .json_stream import IncrementalJsonParser
+from .metrics import incr, observe, timed
 
 # --- HTML/Text 清洗功能：将AI返回的文本转换为HTML格式并清理标记 ---
 def format_text_to_html(text):
@@ -51,50 +45,336 @@ def format_text_to_html(text):
     
     return text.strip()
 
-# --- API 底层调用功能：执行HTTP请求并处理重试和错误 ---
-def _execute_request(url, headers, data, service_name):
-    max_retries = 2
-    retry_count = 0
-    while retry_count <= max_retries:
-        try:
-            time.sleep(0.05) 
-            response = requests.post(url, headers=headers, json=data, timeout=60)
-            
-            # 记录原始响应以便 Debug
-            try:
-                _write_log(service_name, url, data, response_content=json.dumps(response.json(), ensure_ascii=False, indent=2))
-            except:
-                _write_log(service_name, url, data, response_content=response.text)
+# --- 连接池：按服务复用 HTTP Keep-Alive 连接，避免每个请求都重新进行 DNS/TCP/TLS 握手 ---
 
-            response.raise_for_status()
-            result = response.json()
-            
-            usage = result.get("usage", {})
-            total_tokens = usage.get("total_tokens", 0)
+# 预连接只发送不产生费用的 HEAD 请求；超过该时间仍未完成则放弃，由正式请求自行建立连接
+PRECONNECT_TIMEOUT_SECONDS = 3
 
-            content = ""
+class SessionPool:
+    def __init__(self):
+        self.lock = Lock()
+        self.sessions = {}  # service -> (requests.Session, pool_size)
+
+    def get_session(self, service, pool_size):
+        """
+        返回该服务的共享 Session；连接池容量不足时换用一个更大的。
+        旧 Session 不主动关闭：仍在使用它的请求正常完成，之后没有引用时由 urllib3 在回收连接池时关闭其连接。
+        """
+        pool_size = max(1, int(pool_size))
+        with self.lock:
+            entry = self.sessions.get(service)
+            if entry and entry[1] >= pool_size:
+                return entry[0]
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self.sessions[service] = (session, pool_size)
+            return session
+
+    def preconnect(self, service, url, pool_size, count):
+        """
+        在后台线程中同时发出 count 个 HEAD 请求，预先建立连接（含 TLS 握手）并留在连接池中，让首批请求直接复用；
+        只使用 Session 的公开接口，不关心响应状态（服务商通常返回 404/405），不阻塞批量开始，失败时忽略。
+        """
+        session = self.get_session(service, pool_size)
+        count = max(1, min(count, pool_size))
+        # 所有 HEAD 请求在屏障处一起出发，各自占用一条新连接，而不是依次复用同一条
+        barrier = Barrier(count)
+
+        def _head():
             try:
-                content = result["choices"][0]["message"]["content"].strip()
-            except KeyError:
-                if "choices" in result and len(result["choices"]) > 0:
-                    choice = result["choices"][0]
-                    content = choice.get("text", "") or choice.get("content", "")
+                barrier.wait(PRECONNECT_TIMEOUT_SECONDS)
+                session.head(url, timeout=PRECONNECT_TIMEOUT_SECONDS, allow_redirects=False)
+            except Exception:
+                pass  # 预连接失败不影响后续正常请求
+
+        def _warm():
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                for _ in range(count):
+                    executor.submit(_head)
+
+        Thread(target=_warm, daemon=True, name="lexisage-preconnect").start()
+
+    def connection_stats(self, service, url):
+        """读取 urllib3 连接池计数：新建连接数、请求数与复用次数"""
+        with self.lock:
+            entry = self.sessions.get(service)
+        if not entry: return None
+        opened = sent = 0
+        try:
+            pools = entry[0].get_adapter(url).poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None: continue
+                opened += pool.num_connections
+                sent += pool.num_requests
+        except Exception:
+            return None
+        return {
+            "connections_opened": opened,
+            "requests_sent": sent,
+            "connections_reused": max(0, sent - opened),
+            "pool_size": entry[1],
+        }
+
+_session_pool = SessionPool()
+
+def effective_max_workers(config):
+    """线程池引擎的线程数：启用自适应并发时按当前服务的并发上限开线程，由控制器决定实际并发"""
+    if not config.get("enableMultiThreading", True): return 1
+    max_workers = config.get("maxConcurrentRequests", 3)
+    if config.get("enableAdaptiveConcurrency", False):
+        max_workers = max(max_workers, concurrency_bounds(config.get("aiService", "openai"), config)[1])
+    return max_workers
+
+def _pool_size_for(config):
+    """连接池容量：批量并发数，加上同时在途的对冲请求和按字段拆分的并行请求（字段线程池大小），额外请求不必每次新建连接"""
+    workers = effective_max_workers(config)
+    return workers + HEDGE_MAX_IN_FLIGHT + workers
+
+def preconnect_service(config, count):
+    service = config.get("aiService", "openai")
+    api_config = config.get("apiConfig", {}).get(service, {})
+    if not api_config.get("baseUrl"): return
+    _session_pool.preconnect(service, api_config["baseUrl"], _pool_size_for(config), count)
+
+def log_connection_stats(config):
+    service = config.get("aiService", "openai")
+    url = config.get("apiConfig", {}).get(service, {}).get("baseUrl")
+    if not url: return
+    stats = _session_pool.connection_stats(service, url)
+    if stats:
+        log_event(logging.INFO, "connection_pool", url=url, **stats)
+
+# --- 响应解析：从 Chat Completions 响应中提取文本内容和 Token 用量 ---
+def extract_completion(result):
+    usage = result.get("usage") or {}
+    total_tokens = usage.get("total_tokens", 0)
+
+    content = ""
+    try:
+        content = result["choices"][0]["message"]["content"].strip()
+    except (KeyError, IndexError, TypeError, AttributeError):
+        if result.get("choices"):
+            choice = result["choices"][0]
+            content = choice.get("text", "") or choice.get("content", "")
+    return content, total_tokens
+
+def record_usage(usage, provider, pricing=None):
+    """把响应中的输入/输出 Token 用量计入当前运行指标，配置了单价时同时累计费用"""
+    if not usage: return
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    # 服务商前缀缓存命中的输入 Token：DeepSeek 为 prompt_cache_hit_tokens，OpenAI 为 prompt_tokens_details.cached_tokens
+    details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = usage.get("prompt_cache_hit_tokens", details.get("cached_tokens")) or 0
+    incr("prompt_tokens", prompt_tokens, provider)
+    incr("completion_tokens", completion_tokens, provider)
+    budget = _current_budget.get()
+    if budget is not None: budget.charge(usage.get("total_tokens") or prompt_tokens + completion_tokens)
+    if cached_tokens: incr("cached_tokens", cached_tokens, provider)
+    if pricing and any(pricing):
+        incr("cost", token_cost(pricing, prompt_tokens, completion_tokens, cached_tokens), provider)
+
+# --- 取消：用户取消批量或编辑器生成时，在等待名额、限流和重试退避处尽快退出 ---
+
+class GenerationCancelled(Exception):
+    """生成已被取消；被取消的任务不计为失败，也不会交给结果回调"""
+
+def _is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+def _check_cancelled(cancel_event):
+    if _is_cancelled(cancel_event): raise GenerationCancelled()
+
+def _wait(seconds, cancel_event):
+    """可被取消打断的 sleep"""
+    if cancel_event is not None:
+        cancel_event.wait(seconds)
+    else:
+        time.sleep(seconds)
+
+# --- Token 预算：批量运行的实际用量达到上限后停止派发新任务 ---
+
+class BatchStopped(Exception):
+    """批量提前停止：已派发的任务照常完成并交给回调，未派发的任务保留在任务日志中"""
+
+class BudgetExhausted(BatchStopped):
+    """已达到 tokenBudget"""
+    def __init__(self, spent, limit):
+        super().__init__(f"已达到 Token 预算上限（已用 {spent} / 上限 {limit}），已停止派发新任务")
+        self.spent = spent
+        self.limit = limit
+
+class TokenBudget:
+    """按每个 HTTP 响应的实际 usage 累计（含重试、无效响应和落败的对冲请求）；limit 为 0 时不限制"""
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.spent = 0
+        self.stopped = False  # 是否因预算而有任务未被派发
+        self.lock = Lock()
+
+    def charge(self, tokens):
+        with self.lock:
+            self.spent += tokens
+
+    @property
+    def exhausted(self):
+        return bool(self.limit) and self.spent >= self.limit
+
+    def check(self):
+        if self.stopped: raise BudgetExhausted(self.spent, self.limit)
+
+# 当前批量的 Token 预算：与截止时间一样随上下文传入工作线程、对冲和拆分请求，由 record_usage 计入
+_current_budget = contextvars.ContextVar("lexisage_budget", default=None)
+
+def activate_budget(budget):
+    """在当前线程（或协程）中激活预算，返回用于 deactivate_budget 的令牌"""
+    return _current_budget.set(budget)
+
+def deactivate_budget(token):
+    _current_budget.reset(token)
+
+class BatchDeadlineExceeded(BatchStopped):
+    """已超过 batchDeadlineSeconds：进行中请求的重试和超时都不会越过截止时间"""
+    def __init__(self, seconds):
+        super().__init__(f"已达到批量截止时间（{seconds} 秒），已停止派发新任务")
+        self.seconds = seconds
+
+# --- 并发受控的 POST：从自适应控制器申请名额，并把延迟和结果反馈给控制器 ---
+def _post(http, url, headers, data, controller=None, cancel_event=None, stream=False, provider=None, timeout=60):
+    if controller is not None:
+        with timed("throttle_wait"):
+            acquired = controller.acquire(cancel_event)
+        if not acquired: raise GenerationCancelled()
+    started = time.monotonic()
+    outcome = OUTCOME_ERROR
+    incr("in_flight", 1)
+    try:
+        response = http.post(url, headers=headers, json=data, timeout=timeout, stream=stream)
+        outcome = classify_status(response.status_code)
+        return response
+    except (requests.Timeout, requests.ConnectionError):
+        outcome = OUTCOME_OVERLOAD
+        raise
+    finally:
+        latency = time.monotonic() - started
+        incr("in_flight", -1)
+        observe("network", latency, provider)
+        if controller is not None:
+            controller.release(latency, outcome)
+
+# --- 流式响应：逐行读取 SSE，边接收边增量解析 JSON，每个字段完整后立即回调 ---
+def _read_stream(response, on_field, cancel_event=None):
+    """读取 SSE 流并返回 (content, usage)；Token 用量来自 include_usage 的最后一个数据块"""
+    parser = IncrementalJsonParser()
+    parts, usage = [], {}
+    try:
+        for line in response.iter_lines():
+            _check_cancelled(cancel_event)
+            if not line.startswith(b"data:"): continue
+            payload = line[5:].strip()
+            if payload == b"[DONE]": break
+            chunk = json.loads(payload)
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if not delta: continue
+                parts.append(delta)
+                for field, value in parser.feed(delta):
+                    on_field(field, value)
+    finally:
+        response.close()
+    return "".join(parts).strip(), usage
+
+# --- API 底层调用功能：执行HTTP请求并处理重试和错误 ---
+def _execute_request(url, headers, data, service_name, session=None, controller=None, limiter=None, cancel_event=None, on_field=None, pricing=None, retry_policy=None):
+    """
+    on_field 不为空时以流式（SSE）请求，每个顶层字段完整后调用 on_field(field, value)。
+    pricing 为 (输入, 输出) 每百万 Token 单价，用于在运行指标中累计费用。
+    失败时按 retry_policy 分类决定是否重试；返回 (content, tokens)，放弃时返回 (None, 0)。
+    截止时间（见 retry_policy.deadline_scope）已过时不再发出请求，抛出 DeadlineExceeded。
+    """
+    policy = retry_policy or RetryPolicy()
+    http = session or requests
+    estimated_tokens = estimate_request_tokens(data)
+    if on_field is not None:
+        data = dict(data, stream=True, stream_options={"include_usage": True})
+    attempt, retries_by_category = 0, {}
+    while True:
+        _check_cancelled(cancel_event)
+        if deadline_expired():
+            incr("deadline_exceeded", provider=service_name)
+            raise DeadlineExceeded()
+        content, total_tokens, retry_after = None, 0, None
+        try:
+            # 先从共享限流器预约 RPM/TPM 额度，再占用并发名额
+            if limiter:
+                with timed("throttle_wait"):
+                    limiter.acquire(estimated_tokens, cancel_event)
+            _check_cancelled(cancel_event)
+            incr("requests", provider=service_name)
+            response = _post(http, url, headers, data, controller, cancel_event, stream=on_field is not None,
+                             provider=service_name, timeout=request_timeout())
+            if limiter: limiter.update_from_headers(response.headers)
+            
+            if on_field is None:
+                # 记录原始响应以便 Debug（仅调试模式，由后台线程写入）
+                if debug_enabled():
+                    log_request(service_name, url, data, response_content=response.text)
+                response.raise_for_status()
+                result = response.json()
+                content, total_tokens = extract_completion(result)
+                record_usage(result.get("usage"), service_name, pricing)
+            else:
+                response.raise_for_status()
+                content, usage = _read_stream(response, on_field, cancel_event)
+                total_tokens = usage.get("total_tokens", 0)
+                record_usage(usage, service_name, pricing)
+                if debug_enabled():
+                    log_request(service_name, url, data, response_content=content)
+            if limiter: limiter.correct(estimated_tokens, total_tokens)
             
-            if content:
+            # 空内容和无法解析的 JSON 按无效响应处理，是否重试由策略决定
+            if content and _load_json_object(content) is not None:
                 return content, total_tokens
-            retry_count += 1
+            category = ERROR_BAD_RESPONSE
+            log_request(service_name, url, data, response_content=content, error_msg="无效响应：内容为空或不是 JSON 对象")
+        except GenerationCancelled:
+            raise
         except Exception as e:
-            _write_log(service_name, url, data, error_msg=str(e))
-            if retry_count == max_retries: return None, 0
-            retry_count += 1
-            time.sleep(1)
-    return None, 0
+            log_request(service_name, url, data, response_content=getattr(getattr(e, "response", None), "text", None), error_msg=str(e))
+            category = error_category(e)
+            retry_after = retry_after_seconds(getattr(getattr(e, "response", None), "headers", None))
+        incr("errors", provider=service_name)
+        incr(f"errors_{category}")
+        if retry_after is not None: retry_after = min(retry_after, MAX_PENALTY_SECONDS)
+        delay = policy.next_delay(category, attempt, retries_by_category, retry_after)
+        if delay is None:
+            # 放弃时无法解析的内容仍交给调用方，由解析环节记为“解析失败”
+            return (content, total_tokens) if content else (None, 0)
+        attempt += 1
+        retries_by_category[category] = retries_by_category.get(category, 0) + 1
+        incr("retries", provider=service_name)
+        incr(f"retries_{category}")
+        # 服务端给出 Retry-After 时通过共享限流器让其他请求一起等待，下次 acquire 时即会等待
+        if retry_after is not None and limiter:
+            limiter.penalize(delay)
+        else:
+            _wait(delay, cancel_event)
 
-def call_ai_service(user_content, config, system_content):
-    service = config.get("aiService", "openai")
+SERVICE_NAMES = {"openai": "OpenAI", "xai": "XAI", "deepseek": "DeepSeek"}
+
+def build_request(user_content, config, system_content, service=None):
+    """
+    根据当前配置构造一次 Chat Completions 请求；service 为空时使用当前选择的服务。
+    返回包含 service/url/headers/data/service_name 的字典；未配置 API Key 时返回 None。
+    """
+    service = service or config.get("aiService", "openai")
     api_config = config["apiConfig"].get(service, {})
     
-    if not api_config.get("apiKey"): return None, 0
+    if not api_config.get("apiKey"): return None
 
     temperature = api_config.get("temperature", 0.1)
 
@@ -105,84 +385,655 @@ def call_ai_service(user_content, config, system_content):
     
     data = {"model": api_config["model"], "messages": messages, "temperature": temperature}
     
-    svc_name_map = {"openai": "OpenAI", "xai": "XAI", "deepseek": "DeepSeek"}
-    return _execute_request(api_config['baseUrl'], headers, data, svc_name_map.get(service, "Unknown"))
+    return {
+        "service": service,
+        "url": api_config['baseUrl'],
+        "headers": headers,
+        "data": data,
+        "service_name": SERVICE_NAMES.get(service, "Unknown"),
+        "pricing": token_prices(api_config),
+    }
+
+def request_source(request):
+    """写入任务记录的内容来源：服务/模型"""
+    return f"{request['service_name']}/{request['data']['model']}"
+
+def throttled_services(router, config):
+    """当前正处于 Retry-After 退避中的服务，路由时优先避开"""
+    return {service for service in router.weights if get_rate_limiter(service, config).penalty_remaining() > 0}
+
+def _call_service(service, user_content, config, system_content, cancel_event=None, on_field=None):
+    request = build_request(user_content, config, system_content, service)
+    if request is None: return None, 0, None
+
+    session = _session_pool.get_session(request["service"], _pool_size_for(config))
+    controller = get_concurrency_controller(request["service"], config)
+    limiter = get_rate_limiter(request["service"], config)
+    content, tokens = _execute_request(request["url"], request["headers"], request["data"], request["service_name"],
+                                       session=session, controller=controller, limiter=limiter, cancel_event=cancel_event,
+                                       on_field=on_field, pricing=request["pricing"], retry_policy=RetryPolicy.from_config(config))
+    return content, tokens, request_source(request)
+
+def hedge_target(service, router, policy, config):
+    """对冲请求发往的服务：开启多服务路由时优先选择另一个可用服务，否则仍发往原服务"""
+    if router is not None and policy.other_provider:
+        alternative = router.choose({service}, throttled_services(router, config))
+        if alternative is not None: return alternative
+    return service
+
+def raise_attempt_error(primary_error, hedge_error):
+    """
+    对冲的两次尝试都没有拿到内容时与不对冲一致：原请求的异常照常抛出；
+    对冲请求的其他异常只算作失败，但截止时间已过时同样抛出 DeadlineExceeded，不再尝试其他服务。
+    """
+    if primary_error is not None: raise primary_error
+    if isinstance(hedge_error, DeadlineExceeded): raise hedge_error
+
+def settle_hedge_target(router, service, target, success, abandoned):
+    """
+    对冲请求由 hedge_target 经路由器派发到其他服务时，其结果同样计入该服务的熔断器，
+    否则半开状态下的试探标记永远不会清除；被放弃的请求只结束试探，不计入成败。
+    """
+    if router is None or target == service: return
+    if abandoned:
+        router.release(target)
+    else:
+        router.record(target, success)
+
+class _AnyEvent:
+    """把多个取消事件合成一个：任一被设置即视为取消（对冲中的单次尝试同时响应批量取消和对方胜出）"""
+    def __init__(self, *events):
+        self.events = [event for event in events if event is not None]
+
+    def is_set(self):
+        return any(event.is_set() for event in self.events)
+
+    def wait(self, timeout=None):
+        end = None if timeout is None else time.monotonic() + timeout
+        while not self.is_set():
+            remaining = 0.2 if end is None else min(0.2, end - time.monotonic())
+            if remaining <= 0: return False
+            self.events[0].wait(remaining)
+        return True
+
+class _HedgeTimer:
+    """所有工作线程共用一个定时线程：原请求耗时到达对冲阈值时调用回调，由回调决定是否发出对冲请求"""
+    def __init__(self):
+        self.cond = Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.thread = None
+
+    def schedule(self, at, callback):
+        entry = [at, next(self.counter), callback]
+        with self.cond:
+            heapq.heappush(self.heap, entry)
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True, name="lexisage-hedge-timer")
+                self.thread.start()
+            self.cond.notify()
+        return entry
+
+    def cancel(self, entry):
+        with self.cond:
+            entry[2] = None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.cond.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                callback = heapq.heappop(self.heap)[2]
+            if callback is not None: callback()
+
+_hedge_timer = _HedgeTimer()
+
+class _SharedExecutor:
+    """
+    按配置大小共享的线程池。大小改变时换用新的线程池，旧线程池不主动关闭：
+    正在向它提交的调用照常完成，之后没有引用时其线程随线程池回收退出。
+    """
+    def __init__(self, thread_name_prefix):
+        self.thread_name_prefix = thread_name_prefix
+        self.lock = Lock()
+        self.executor = None
+        self.size = 0
+
+    def get(self, size):
+        with self.lock:
+            if self.size != size:
+                self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=self.thread_name_prefix)
+                self.size = size
+            return self.executor
+
+_hedge_executor = _SharedExecutor("lexisage-hedge")
+
+def _get_hedge_executor(config):
+    """
+    开启对冲时原请求和对冲请求都在这个线程池中运行：批量工作线程与拆分线程各 effective_max_workers 个调用方，
+    另加在途对冲请求（受 HEDGE_MAX_IN_FLIGHT 限制）和对冲胜出后仍在等待响应的原请求；线程按需创建，
+    用尽时新的尝试排队等待。
+    """
+    return _hedge_executor.get(2 * effective_max_workers(config) + 2 * HEDGE_MAX_IN_FLIGHT)
+
+def _call_service_hedged(service, policy, router, user_content, config, system_content, cancel_event=None):
+    """
+    带对冲的 _call_service：原请求在对冲线程池中执行，当前工作线程只等待结果；耗时超过阈值且未超过对冲比例和
+    在途上限时，向 hedge_target 再发一份相同请求，返回先拿到内容的一方，不等待落败的请求。
+    requests 无法中断已发出的 HTTP 请求：落败方放弃重试与等待，但直到响应返回前仍占用对冲线程池的线程
+    （和并发控制器名额），结果丢弃，Token 仍计入运行指标。对冲请求落败时直到返回前仍占用对冲名额；
+    原请求落败时只占用线程，其数量受对冲线程池大小限制。
+    """
+    delay = policy.delay(service)
+    if delay is None:
+        started = time.monotonic()
+        result = _call_service(service, user_content, config, system_content, cancel_event)
+        if result[0]: policy.observe(service, time.monotonic() - started)
+        policy.record(False)
+        return result
+
+    executor = _get_hedge_executor(config)
+    lock = Lock()
+    state = {"primary_done": False, "settled": False, "hedged": False}
+    primary_cancel, hedge_cancel = Event(), Event()
+    outcomes = Queue()
+    # 每次尝试在各自的上下文副本中运行（同一个 Context 不能同时在两个线程中进入），指标与截止时间随之传入
+    primary_context, hedge_context = contextvars.copy_context(), contextvars.copy_context()
+
+    def run(target, own_cancel, is_hedge):
+        started = time.monotonic()
+        error = None
+        if is_hedge: incr("hedges", provider=SERVICE_NAMES.get(target, "Unknown"))
+        try:
+            result = _call_service(target, user_content, config, system_content, _AnyEvent(own_cancel, cancel_event))
+        except Exception as e:
+            result, error = (None, 0, None), e
+        if is_hedge:
+            policy.finish()
+            abandoned = isinstance(error, (GenerationCancelled, DeadlineExceeded)) or (not result[0] and own_cancel.is_set())
+            settle_hedge_target(router, service, target, bool(result[0]), abandoned)
+        else:
+            with lock:
+                state["primary_done"] = True
+        if result[0]: policy.observe(target, time.monotonic() - started)
+        outcomes.put((is_hedge, result, error))
+
+    def fire():
+        with lock:
+            if state["primary_done"] or state["settled"] or _is_cancelled(cancel_event) or not policy.try_start(): return
+            state["hedged"] = True
+        target = hedge_target(service, router, policy, config)
+        executor.submit(hedge_context.run, run, target, hedge_cancel, True)
+
+    timer = _hedge_timer.schedule(time.monotonic() + delay, fire)
+    executor.submit(primary_context.run, run, service, primary_cancel, False)
+    result, errors, received = (None, 0, None), {}, 0
+    try:
+        while True:
+            try:
+                is_hedge, outcome, error = outcomes.get(timeout=0.2)
+            except Empty:
+                _check_cancelled(cancel_event)
+                continue
+            received += 1
+            if outcome[0]:
+                if is_hedge: incr("hedge_wins")
+                return outcome
+            _check_cancelled(cancel_event)
+            if not is_hedge: result = outcome
+            if error is not None: errors[is_hedge] = error
+            # 原请求结束后不会再发起对冲，此时 hedged 已确定：已发出的尝试都失败时按原请求的结果返回
+            with lock:
+                if state["primary_done"] and received >= 1 + state["hedged"]: break
+        raise_attempt_error(errors.get(False), errors.get(True))
+        return result
+    finally:
+        _hedge_timer.cancel(timer)
+        with lock:
+            state["settled"] = True
+        # 当前线程已拿到结果或放弃等待：仍在进行的尝试都是落败方，不再重试
+        primary_cancel.set()
+        hedge_cancel.set()
+        policy.record(state["hedged"])
+
+def call_ai_service(user_content, config, system_content, cancel_event=None, on_field=None):
+    """
+    返回 (content, tokens, source)；source 为生成内容的“服务/模型”。
+    开启多服务路由时按权重选择服务，某个服务重试后仍失败（错误或持续限流）时自动切换到其他服务，
+    直到全部服务都尝试过。
+    开启对冲时慢请求会被复制一份（流式请求除外：字段回调不能来自两个请求）。
+    """
+    router = get_router(config)
+    policy = get_hedge_policy(config) if on_field is None else None
+
+    def attempt(service):
+        if policy is None:
+            return _call_service(service, user_content, config, system_content, cancel_event, on_field)
+        return _call_service_hedged(service, policy, router, user_content, config, system_content, cancel_event)
+
+    if router is None:
+        return attempt(config.get("aiService", "openai"))
+
+    tried = set()
+    while True:
+        service = router.choose(tried, throttled_services(router, config))
+        if service is None: return None, 0, None
+        tried.add(service)
+        content, tokens, source = attempt(service)
+        router.record(service, bool(content))
+        if content: return content, tokens, source
+        incr("failovers", provider=SERVICE_NAMES.get(service, "Unknown"))
+        log_event(logging.WARNING, "provider_failover", service=service)
 
 
 # --- 聚合生成逻辑：构建JSON payload发送给AI并解析返回结果 ---
 
-def generate_batch_explanation(word, context, config, field_prompts_map):
+# 命中本地响应缓存的任务记录的来源
+CACHE_SOURCE = "本地缓存"
+
+def resolve_system_prompt(config):
+    return config.get("globalSystemPrompt", "").strip() or DEFAULT_GLOBAL_SYSTEM_PROMPT
+
+def cache_services(config):
+    """其缓存结果可以复用的服务：当前服务；开启多服务路由时为所有参与路由的服务（当前服务优先）"""
+    primary = config.get("aiService", "openai")
+    router = get_router(config)
+    if router is None: return [primary]
+    return sorted(router.weights, key=lambda service: service != primary)
+
+def source_service(source):
+    """由内容来源“服务名/模型”反查服务；来源未知时返回 None"""
+    name = (source or "").split("/", 1)[0]
+    return next((service for service, service_name in SERVICE_NAMES.items() if service_name == name), None)
+
+def _cache_key(word, context, config, field_prompts_map, system_prompt, service):
+    """按服务及其模型、温度计算缓存键；该服务未配置 API Key 时返回 None"""
+    api_config = config.get("apiConfig", {}).get(service, {})
+    if not api_config.get("apiKey"): return None
+    resolved_prompts = {field: resolve_field_prompt(prompt) for field, prompt in field_prompts_map.items()}
+    return build_cache_key(word, context, resolved_prompts, system_prompt, service,
+                           api_config.get("model"), api_config.get("temperature", 0.1))
+
+class CacheSlot:
+    """一次缓存查询对应的写入位置：新结果按实际生成它的服务和模型写入，多服务路由时不会记在其他服务名下"""
+    __slots__ = ("cache", "keys")
+
+    def __init__(self, cache, keys):
+        self.cache = cache
+        self.keys = keys  # 服务 -> 缓存键
+
+    def put(self, source, results, tokens):
+        key = self.keys.get(source_service(source))
+        if key: self.cache.put(key, results, tokens)
+
+def lookup_cached_result(word, context, config, field_prompts_map, system_prompt, use_cache=True):
     """
-    构造 JSON Payload 发送给 AI，并解析返回的 JSON。
+    查询本地响应缓存，依次尝试 cache_services 中各服务的缓存键。
+    返回 (slot, cached)：cached 为命中的 (results, tokens) 或 None；
+    slot 为 CacheSlot（缓存被禁用时为 None），跳过缓存时仍用于把新结果写回缓存。
     """
-    # 1. 获取系统提示词（协议层）
-    system_prompt = config.get("globalSystemPrompt", "").strip() or DEFAULT_GLOBAL_SYSTEM_PROMPT
-    
-    safe_context = context if context else ""
-    
-    # 2. 构建需求字典（指令层）：遍历字段提示词映射，处理每个字段的特定提示
+    cache = get_response_cache(config)
+    if cache is None: return None, None
+    keys = {}
+    for service in cache_services(config):
+        key = _cache_key(word, context, config, field_prompts_map, system_prompt, service)
+        if key: keys[service] = key
+    slot = CacheSlot(cache, keys)
+    if use_cache:
+        for key in keys.values():
+            cached = cache.get(key)
+            if cached is not None: return slot, cached
+    return slot, None
+
+def resolve_field_prompt(prompt):
+    """如果有自定义提示词则使用自定义，否则使用默认提示词"""
+    return prompt if prompt and prompt.strip() else DEFAULT_FIELD_PROMPT_TEMPLATE
+
+def build_user_payload(word, context, field_prompts_map):
+    """构建需求字典（指令层）并组装为发送给 AI 的用户负载"""
     requirements = {}
 
     for field, prompt in field_prompts_map.items():
-        # 如果有自定义提示词则使用自定义，否则使用默认提示词
-        if prompt and prompt.strip():
-            p_text = prompt
-        else:
-            p_text = DEFAULT_FIELD_PROMPT_TEMPLATE
-        
         # 在字段提示词中替换变量 {word} 和 {context}
-        p_text = p_text.replace("{word}", word).replace("{context}", safe_context)
-        requirements[field] = p_text
+        requirements[field] = resolve_field_prompt(prompt).replace("{word}", word).replace("{context}", context)
 
-    # 3. 组装最终的用户负载数据
-    user_payload = {
+    # 组装最终的用户负载数据
+    return {
         "word": word,
-        "context": safe_context,
+        "context": context,
         "requirements": requirements
     }
 
-    # 4. 序列化为JSON字符串
-    user_content_str = json.dumps(user_payload, ensure_ascii=False)
+def build_user_content(word, context, field_prompts_map):
+    """序列化为发送给 AI 的 User Content（JSON 字符串）"""
+    return json.dumps(build_user_payload(word, context, field_prompts_map), ensure_ascii=False)
 
-    # 5. 调用AI服务
-    raw_content, tokens = call_ai_service(user_content_str, config, system_prompt)
-    
-    if not raw_content:
-        return {}, 0
+def build_cache_layout_prefix(system_prompt, field_prompts_map):
+    """缓存友好布局的固定前缀：系统提示词 + 未代入变量的字段指令，同一组字段的请求逐字节相同"""
+    templates = {field: resolve_field_prompt(prompt) for field, prompt in field_prompts_map.items()}
+    return system_prompt + PROMPT_CACHE_LAYOUT_ADDENDUM + json.dumps(templates, ensure_ascii=False, indent=2)
 
-    # 6. 解析AI返回的JSON数据
-    # 清洗可能包含的Markdown代码块标记
+def build_prompt(word, context, field_prompts_map, system_prompt, config):
+    """
+    返回一次请求的 (system_content, user_content)。
+    开启 enablePromptCacheLayout 时字段指令移入固定前缀，User Content 只包含放在最后的 word 和 context，
+    以便命中服务商的前缀缓存（DeepSeek 上下文缓存、OpenAI Prompt Caching 等）。
+    """
+    if not config.get("enablePromptCacheLayout", False):
+        return system_prompt, build_user_content(word, context, field_prompts_map)
+    user_content = json.dumps({"word": word, "context": context}, ensure_ascii=False)
+    return build_cache_layout_prefix(system_prompt, field_prompts_map), user_content
+
+def _load_json_object(raw_content):
+    """清洗 Markdown 代码块标记后解析 JSON 对象；失败时记录日志并返回 None"""
     clean_json_str = raw_content.replace("```json", "").replace("```", "").strip()
     
-    results = {}
     try:
         results = json.loads(clean_json_str)
-        
-        # 将AI生成的内容转换为HTML格式
-        for k, v in results.items():
-            results[k] = format_text_to_html(str(v))
-            
+        if not isinstance(results, dict): raise json.JSONDecodeError("not a JSON object", clean_json_str, 0)
     except json.JSONDecodeError:
-        _write_log("JSON_PARSE_ERROR", "Internal", raw_content, error_msg="AI did not return valid JSON")
-        return None, tokens
+        log_event(logging.WARNING, "json_parse_error", error="AI did not return valid JSON", response=raw_content)
+        return None
+    return results
+
+def parse_ai_response(raw_content):
+    """解析AI返回的JSON数据；不是合法 JSON 时返回 None"""
+    results = _load_json_object(raw_content)
+    if results is None: return None
+
+    # 将AI生成的内容转换为HTML格式
+    for k, v in results.items():
+        results[k] = format_text_to_html(str(v))
+    return results
+
+def generate_batch_explanation(word, context, config, field_prompts_map, use_cache=True, cancel_event=None, on_field=None):
+    """
+    构造 JSON Payload 发送给 AI，并解析返回的 JSON。
+    返回 (results, tokens, cache_hit, source)；命中本地缓存时不产生网络请求，tokens 为 0，source 为 CACHE_SOURCE。
+    cancel_event 被设置后抛出 GenerationCancelled。
+    开启 enableStreaming 且提供 on_field 时使用流式请求，每个字段完整后立即以 on_field(field, html) 回调。
+    """
+    # 1. 获取系统提示词（协议层）
+    system_prompt = resolve_system_prompt(config)
+    
+    safe_context = context if context else ""
+
+    # 2. 查询本地响应缓存（跳过缓存时仍会把新结果写回缓存）
+    cache_slot, cached = lookup_cached_result(word, safe_context, config, field_prompts_map, system_prompt, use_cache)
+    if cached is not None:
+        return cached[0], 0, True, CACHE_SOURCE
+    
+    # 3. 构建需求（指令层）并序列化
+    with timed("prompt_build"):
+        system_content, user_content_str = build_prompt(word, safe_context, field_prompts_map, system_prompt, config)
+
+    # 4. 调用AI服务
+    stream_callback = None
+    if on_field is not None and config.get("enableStreaming", False):
+        def stream_callback(field, value):
+            on_field(field, format_text_to_html(str(value)))
+    raw_content, tokens, source = call_ai_service(user_content_str, config, system_content, cancel_event, stream_callback)
+    
+    if not raw_content:
+        return {}, 0, False, None
+
+    # 5. 解析AI返回的JSON数据
+    with timed("parse"):
+        results = parse_ai_response(raw_content)
+    if results is None:
+        return None, tokens, False, source
+
+    if cache_slot and results:
+        cache_slot.put(source, results, tokens)
+
+    return results, tokens, False, source
+
+
+# --- 按字段拆分：低延迟模式下每个目标字段单独并行请求，再合并结果 ---
+
+_field_executor = _SharedExecutor("lexisage-field")
+
+def _get_field_executor(config):
+    """拆分请求共享一个线程池，大小与批量并发数一致，拆分后同时进行的请求数不会超过配置"""
+    return _field_executor.get(effective_max_workers(config))
 
-    return results, tokens
+def merge_sources(sources):
+    """多个请求的来源合并为一个记录，按出现顺序去重"""
+    return ", ".join(dict.fromkeys(source for source in sources if source)) or None
 
+def merge_field_results(parts):
+    """合并各字段请求的 (results, tokens, cache_hit, source)；全部失败时沿用单次请求的约定返回 None（解析失败）或 {}"""
+    merged, tokens = {}, 0
+    for results, part_tokens, _, _ in parts:
+        tokens += part_tokens
+        if results: merged.update(results)
+    if not merged:
+        return (None if any(results is None for results, _, _, _ in parts) else {}), tokens, False, None
+    sources = [source for results, _, _, source in parts if results]
+    return merged, tokens, all(cache_hit for _, _, cache_hit, _ in parts), merge_sources(sources)
+
+def generate_split_explanation(word, context, config, field_prompts_map, use_cache=True, cancel_event=None, on_field=None):
+    """
+    低延迟模式：每个目标字段单独请求、并行发出（共享连接池、并发控制与限流），返回值与 generate_batch_explanation 相同。
+    总耗时取决于最慢的单个字段而不是全部字段的总输出；代价是系统提示词和上下文被重复发送。
+    提供 on_field 时每个字段完成后立即回调，无需开启流式输出。
+    """
+    if len(field_prompts_map) <= 1:
+        return generate_batch_explanation(word, context, config, field_prompts_map, use_cache, cancel_event, on_field)
+    executor = _get_field_executor(config)
+    futures = [
+        executor.submit(contextvars.copy_context().run, generate_batch_explanation, word, context, config, {field: prompt}, use_cache, cancel_event)
+        for field, prompt in field_prompts_map.items()
+    ]
+    for future in as_completed(futures):
+        results = future.result()[0]
+        if on_field is not None and results:
+            for field, content in results.items():
+                on_field(field, content)
+    # 按配置中的字段顺序合并
+    return merge_field_results([future.result() for future in futures])
+
+# --- 多词打包：把多条笔记合并进一次请求，按笔记 ID 拆分返回结果 ---
+
+def plan_work_units(tasks, config):
+    """
+    将任务逐个划分为工作单元（每个单元是一个任务列表），以生成器形式产出，可直接消费边生产边到达的任务。
+    未开启打包时每个任务单独成组；开启后按打包数量和 Token 预算把相邻任务合并。
+    按字段拆分的任务追求低延迟，从不打包。
+    """
+    if not config.get("enablePackedRequests", False):
+        for task in tasks:
+            yield [task]
+        return
+
+    pack_size = max(1, config.get("packSize", 5))
+    token_budget = config.get("packTokenBudget", 6000)
+    current, current_tokens, current_ids = [], 0, set()
+    for task in tasks:
+        if task.split_fields:
+            yield [task]
+            continue
+        task_tokens = estimate_task_tokens(
+            build_user_content(task.word, task.context or "", task.field_prompts_map),
+            len(task.field_prompts_map)
+        )
+        task_id = str(task.note_id)
+        if current and (len(current) >= pack_size or current_tokens + task_tokens > token_budget or task_id in current_ids):
+            yield current
+            current, current_tokens, current_ids = [], 0, set()
+        current.append(task)
+        current_tokens += task_tokens
+        current_ids.add(task_id)
+    if current: yield current
+
+def prepare_pack(pack, config):
+    """
+    处理打包前的缓存命中：命中的任务直接完成。
+    返回 (pending, user_content, system_prompt, cache_slots)；pending 为仍需请求的任务。
+    """
+    system_prompt = resolve_system_prompt(config)
+    pending, cache_slots = [], {}
+    for task in pack:
+        cache_slot, cached = lookup_cached_result(
+            task.word, task.context or "", config, task.field_prompts_map, system_prompt, task.use_cache
+        )
+        if cached is not None:
+            task.results_map, task.tokens, task.cache_hit, task.success = cached[0], 0, True, True
+            task.source = CACHE_SOURCE
+            continue
+        pending.append(task)
+        cache_slots[task] = cache_slot
+
+    system_content = system_prompt + PACKED_PROTOCOL_ADDENDUM
+    # 缓存友好布局：包内笔记的字段相同时，字段指令只在固定前缀中出现一次
+    shared_fields = (
+        config.get("enablePromptCacheLayout", False) and pending
+        and all(task.field_prompts_map == pending[0].field_prompts_map for task in pending)
+    )
+    if shared_fields:
+        system_content = build_cache_layout_prefix(system_content, pending[0].field_prompts_map)
+        notes = {str(task.note_id): {"word": task.word, "context": task.context or ""} for task in pending}
+    else:
+        notes = {str(task.note_id): build_user_payload(task.word, task.context or "", task.field_prompts_map) for task in pending}
+    user_content = json.dumps({"notes": notes}, ensure_ascii=False)
+    return pending, user_content, system_content, cache_slots
+
+def apply_pack_response(pending, raw_content, tokens, cache_slots, source=None):
+    """把打包响应拆分回各个任务；返回 AI 遗漏或格式不对、需要单独重试的任务"""
+    packed_results = _load_json_object(raw_content) if raw_content else None
+    if packed_results is None:
+        return list(pending)
+
+    missing, answered = [], []
+    for task in pending:
+        results = packed_results.get(str(task.note_id))
+        if not isinstance(results, dict) or not results:
+            missing.append(task)
+            continue
+        task.results_map = {k: format_text_to_html(str(v)) for k, v in results.items()}
+        task.source = source
+        task.success = True
+        answered.append(task)
+
+    # 整个请求的 Token 平摊到成功拆分出结果的任务上
+    if answered:
+        share, remainder = divmod(tokens, len(answered))
+        for index, task in enumerate(answered):
+            task.tokens = share + (1 if index < remainder else 0)
+            cache_slot = cache_slots[task]
+            if cache_slot: cache_slot.put(source, task.results_map, task.tokens)
+    return missing
+
+def process_packed_tasks(pack, config, progress_tracker, cancel_event=None):
+    with timed("prompt_build"):
+        pending, user_content, system_prompt, cache_slots = prepare_pack(pack, config)
+    for task in pack:
+        if task not in pending: progress_tracker.update_progress(task.word)
+
+    if len(pending) > 1:
+        try:
+            raw_content, tokens, source = call_ai_service(user_content, config, system_prompt, cancel_event)
+            with timed("parse"):
+                fallback = apply_pack_response(pending, raw_content, tokens, cache_slots, source)
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            log_event(logging.WARNING, "packed_request_error", error=str(e), payload=user_content)
+            fallback = list(pending)
+        for task in pending:
+            if task not in fallback: progress_tracker.update_progress(task.word)
+    else:
+        fallback = pending
+
+    # 被 AI 遗漏的笔记退回逐条请求
+    for task in fallback:
+        process_single_task(task, config, progress_tracker, cancel_event)
+    return pack
 
 # --- 任务类：表示单个释义生成任务，包含任务数据和结果 ---
 
 class ExplanationTask:
-    def __init__(self, note_id, word, context, config, field_prompts_map):
+    # 超大批量时任务数量可达十万级：使用 __slots__ 且不在任务中保存配置，配置由引擎统一传入
+    __slots__ = (
+        "note_id", "word", "context", "field_prompts_map", "use_cache", "split_fields",
+        "duplicate_note_ids", "results_map", "tokens", "cache_hit", "source", "error", "success"
+    )
+
+    def __init__(self, note_id, word, context, field_prompts_map, use_cache=True, split_fields=False):
         self.note_id = note_id
         self.word = word
         self.context = context
-        self.config = config
         self.field_prompts_map = field_prompts_map 
-        self.results_map = {} 
+        self.use_cache = use_cache
+        self.split_fields = split_fields  # 低延迟模式：每个字段单独并行请求
+        self.duplicate_note_ids = []  # 与本任务内容完全相同、共享结果的其他笔记
+        self.results_map = None
         self.tokens = 0
+        self.cache_hit = False
+        self.source = None  # 生成结果的“服务/模型”，命中本地缓存时为 CACHE_SOURCE
         self.error = None
         self.success = False
 
+# --- 请求去重：单词、上下文和目标字段提示词完全相同的任务只请求一次 ---
+
+def task_dedup_key(word, context, field_prompts_map):
+    """返回 16 字节摘要：超大批量时去重表按笔记数增长，不保存单词、上下文和提示词本身"""
+    key = (normalize_word(word), context or "", tuple(sorted(field_prompts_map.items())))
+    return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).digest()
+
+def coalesce_tasks(tasks):
+    """合并重复任务：保留第一个任务发送请求，其余笔记 ID 记入 duplicate_note_ids 共享结果"""
+    primary_by_key = {}
+    unique_tasks = []
+    for task in tasks:
+        key = task_dedup_key(task.word, task.context, task.field_prompts_map)
+        primary = primary_by_key.get(key)
+        if primary is None:
+            primary_by_key[key] = task
+            unique_tasks.append(task)
+        else:
+            primary.duplicate_note_ids.append(task.note_id)
+            primary.duplicate_note_ids.extend(task.duplicate_note_ids)
+    return unique_tasks
+
+# --- 任务源：预扫描尚未结束时，任务边生成边交给批量引擎 ---
+
+_FEED_END = object()
+DEFAULT_FEED_CAPACITY = 1000
+
+class TaskFeed:
+    """
+    线程安全的任务队列：生产者 put() 放入任务、close() 表示不再有新任务；引擎按迭代器消费，取空时阻塞等待。
+    put() 从不阻塞（生产者通常在主线程），容量通过 wait_for_space() 约束：生产者所在的扫描线程在放入下一批前等待队列消化。
+    """
+    def __init__(self, capacity=DEFAULT_FEED_CAPACITY):
+        self.capacity = capacity
+        self.queue = deque()
+        self.cond = Condition()
+        self.count = 0
+        self.closed = False
+    def put(self, task):
+        with self.cond:
+            if self.closed: return
+            self.count += 1
+            self.queue.append(task)
+            self.cond.notify_all()
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+    def wait_for_space(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.closed or len(self.queue) < self.capacity)
+    def __iter__(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue or self.closed)
+                if not self.queue: return
+                task = self.queue.popleft()
+                self.cond.notify_all()
+            yield task
+
 # --- 进度跟踪器类：用于多线程环境中跟踪任务进度 ---
 
 class ProgressTracker:
@@ -199,63 +1050,179 @@ class ProgressTracker:
         with self.lock: return self.completed, self.total, self.current_word
     def set_total(self, total):
         with self.lock: self.total = total
+    def add_total(self, count):
+        with self.lock: self.total += count
 
 # --- 单个任务处理函数：在独立线程中处理单个释义生成任务 ---
 
-def process_single_task(task, progress_tracker):
+PARSE_FAILED_ERROR = "JSON解析失败"
+REQUEST_FAILED_ERROR = "API 请求失败（重试后仍未获得内容）"
+
+def generation_error(results):
+    """generate_* 返回 None 表示内容无法解析，返回 {} 表示请求失败"""
+    return PARSE_FAILED_ERROR if results is None else REQUEST_FAILED_ERROR
+
+def process_single_task(task, config, progress_tracker, cancel_event=None):
     try:
-        time.sleep(0.1)
         progress_tracker.update_progress(task.word)
         
-        results, tokens = generate_batch_explanation(
+        generate = generate_split_explanation if task.split_fields else generate_batch_explanation
+        results, tokens, cache_hit, source = generate(
             task.word, 
             task.context, 
-            task.config, 
-            task.field_prompts_map
+            config, 
+            task.field_prompts_map,
+            use_cache=task.use_cache,
+            cancel_event=cancel_event
         )
         
-        if results is not None:
+        task.tokens = tokens
+        task.source = source
+        if results:
             task.results_map = results
-            task.tokens = tokens
+            task.cache_hit = cache_hit
             task.success = True
         else:
-            task.error = "JSON解析失败或API错误"
+            # 没有任何结果的任务记为失败：任务日志不把它当作已完成，恢复时会重新请求
+            task.error = generation_error(results)
             task.success = False
             
+    except GenerationCancelled:
+        raise
     except Exception as e:
         task.error = str(e)
         task.success = False
     return task
 
+def process_work_unit(unit, config, progress_tracker, cancel_event=None, enqueued_at=None):
+    if enqueued_at is not None:
+        observe("queue_wait", time.perf_counter() - enqueued_at)
+    # 单个工作单元（含打包后退回逐条请求的部分）的请求和重试不超过 taskDeadlineSeconds
+    with deadline_scope(config.get("taskDeadlineSeconds", 0)):
+        if len(unit) == 1:
+            return [process_single_task(unit[0], config, progress_tracker, cancel_event)]
+        return process_packed_tasks(unit, config, progress_tracker, cancel_event)
+
 # --- 批量生成函数：使用线程池并发处理多个释义生成任务 ---
 
-def generate_explanations_batch(tasks, max_workers=3, progress_callback=None):
-    if not tasks: return []
-    
+def freeze_config(config):
+    """批量运行期间所有任务共享同一份只读配置"""
+    return config if isinstance(config, MappingProxyType) else MappingProxyType(dict(config))
+
+def generate_explanations_batch(tasks, config, max_workers=3, progress_callback=None, result_callback=None, cancel_event=None):
+    """
+    流式并发处理任务：从 tasks（列表或 TaskFeed 等边生产边到达的可迭代对象）逐个取任务，
+    在途的工作单元最多为 max_workers 的两倍，取任务与结果回调都不会让内存随批量大小增长。
+    所有任务共享同一份只读配置 config；进度总数随任务到达增长。
+    result_callback(task) 在每个任务完成时立即调用（在调用本函数的线程中），是结果的出口，可用于持久化；
+    提供 result_callback 时结果全部交给回调，不再累积，返回空列表；否则返回处理后的任务列表。
+    cancel_event 被设置后：尚未开始的任务立即取消，进行中的请求最多再等待 cancelGraceSeconds 秒，
+    期间完成的结果照常交给回调；超时仍未返回的请求被放弃（其结果仍会写入响应缓存）。
+    配置了 tokenBudget 时，实际用量达到上限后不再派发新任务，已派发的任务完成后抛出 BudgetExhausted；
+    配置了 batchDeadlineSeconds 时同理，超过截止时间后抛出 BatchDeadlineExceeded。
+    """
+    if isinstance(tasks, list) and not tasks: return []
+    config = freeze_config(config)
+    budget = TokenBudget(config.get("tokenBudget", 0))
     progress_tracker = ProgressTracker()
-    progress_tracker.set_total(len(tasks))
-    
     completed_task_list = []
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_task = {
-            executor.submit(process_single_task, task, progress_tracker): task
-            for task in tasks
-        }
-        
-        for future in as_completed(future_to_task):
-            time.sleep(0.01)
-            task = future_to_task[future]
+
+    # 后台预先建立连接（含 TLS 握手），首批并发请求即可直接复用
+    preconnect_service(config, max_workers)
+
+    # 提交线程从任务源取任务并提交，当前线程只负责收集完成的结果；任务源阻塞时不影响结果回调。
+    # 在途窗口：结果被当前线程取走后才释放名额，提交线程不会领先处理进度太多
+    done_queue = Queue()
+    window = BoundedSemaphore(max(1, max_workers) * 2)
+    submitted = [0]
+    deadline_stopped = [False]
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    # 批量截止时间和 Token 预算随上下文传入提交线程和每个工作线程
+    deadline_token = set_deadline(config.get("batchDeadlineSeconds", 0))
+    budget_token = activate_budget(budget)
+
+    def submit_all():
+        error = None
+        try:
+            for unit in plan_work_units(tasks, config):
+                while not window.acquire(timeout=0.2):
+                    if _is_cancelled(cancel_event): break
+                if _is_cancelled(cancel_event): break
+                if budget.exhausted:
+                    budget.stopped = True
+                    break
+                # 截止时间已过：已取出的单元照常派发（请求不会发出，任务记为失败并交给回调），之后不再取任务，与异步引擎一致
+                if deadline_expired():
+                    deadline_stopped[0] = True
+                progress_tracker.add_total(len(unit))
+                try:
+                    # 每个任务在提交时的上下文中运行，指标等 ContextVar 随之传入工作线程
+                    future = executor.submit(
+                        contextvars.copy_context().run, process_work_unit,
+                        unit, config, progress_tracker, cancel_event, time.perf_counter()
+                    )
+                except RuntimeError:
+                    # 取消后线程池已关闭
+                    break
+                submitted[0] += 1
+                future.add_done_callback(lambda f, unit=unit: done_queue.put((f, unit)))
+                if deadline_stopped[0]: break
+        except Exception as e:
+            error = e
+        done_queue.put((_FEED_END, error))
+
+    Thread(target=contextvars.copy_context().run, args=(submit_all,), daemon=True).start()
+    deactivate_budget(budget_token)
+    reset_deadline(deadline_token)
+
+    feed_done, collected, feed_error = False, 0, None
+    deadline = None
+    try:
+        while not feed_done or collected < submitted[0]:
+            if deadline is None and _is_cancelled(cancel_event):
+                executor.shutdown(wait=False, cancel_futures=True)
+                deadline = time.monotonic() + config.get("cancelGraceSeconds", 5)
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0: break
+            elif cancel_event is not None:
+                timeout = 0.2
+            try:
+                future, unit = done_queue.get(timeout=timeout)
+            except Empty:
+                continue
+            if future is _FEED_END:
+                feed_done, feed_error = True, unit
+                continue
+            collected += 1
+            window.release()
             
             try:
-                processed_task = future.result()
-                completed_task_list.append(processed_task)
+                finished_tasks = future.result()
+            except (GenerationCancelled, CancelledError):
+                # 被取消的任务不交给回调，任务日志中没有它们的结果，恢复任务时会重新处理
+                continue
             except Exception as e:
-                task.error = str(e)
-                completed_task_list.append(task)
+                for task in unit:
+                    task.error = str(e)
+                finished_tasks = unit
+            if result_callback:
+                for task in finished_tasks:
+                    result_callback(task)
+            else:
+                completed_task_list.extend(finished_tasks)
             
             if progress_callback:
                 completed_count, total_count, current_processing_word = progress_tracker.get_progress()
                 progress_callback(completed_count, total_count, current_processing_word)
-                
+    finally:
+        # 正常结束时等待线程池收尾；取消后不再等待超时仍未返回的请求
+        executor.shutdown(wait=deadline is None, cancel_futures=deadline is not None)
+
+    log_connection_stats(config)
+    if feed_error is not None: raise feed_error
+    if deadline is None:
+        budget.check()
+        if deadline_stopped[0]: raise BatchDeadlineExceeded(config.get("batchDeadlineSeconds", 0))
     return completed_task_list
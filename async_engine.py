@@ -0,0 +1,395 @@
+import json
+import time
+import asyncio
+import logging
+
+from .ai_service import (
+    ProgressTracker, build_request, build_prompt, extract_completion, _load_json_object,
+    lookup_cached_result, parse_ai_response, resolve_system_prompt,
+    plan_work_units, prepare_pack, apply_pack_response, freeze_config, GenerationCancelled,
+    ExplanationTask, merge_field_results, generation_error, PARSE_FAILED_ERROR, REQUEST_FAILED_ERROR, record_usage, TokenBudget, activate_budget, BatchDeadlineExceeded,
+    request_source, throttled_services, hedge_target, settle_hedge_target, raise_attempt_error, CACHE_SOURCE, SERVICE_NAMES
+)
+from .concurrency import get_concurrency_controller, classify_status, OUTCOME_OVERLOAD, OUTCOME_ERROR
+from .rate_limiter import get_rate_limiter, retry_after_seconds, MAX_PENALTY_SECONDS
+from .token_estimator import estimate_request_tokens
+from .logger import log_event, log_request, debug_enabled
+from .metrics import incr, observe, timed
+from .router import get_router
+from .hedging import get_hedge_policy
+from .retry_policy import (
+    RetryPolicy, DeadlineExceeded, error_category, request_timeout, deadline_expired, set_deadline, deadline_scope,
+    ERROR_BAD_RESPONSE
+)
+
+# aiohttp 为可选依赖：未安装时 is_available() 返回 False，调用方回退到线程池引擎
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# --- 异步生成引擎：单线程事件循环 + 信号量限流，可同时保持大量在途请求 ---
+
+def is_available():
+    return aiohttp is not None
+
+async def _post_async(session, request, controller):
+    """发送请求并读取响应正文；启用自适应并发时向控制器申请名额并反馈结果"""
+    timeout = aiohttp.ClientTimeout(total=request_timeout())
+    if controller is not None:
+        with timed("throttle_wait"):
+            await controller.acquire_async()
+    started = time.monotonic()
+    outcome = OUTCOME_ERROR
+    incr("in_flight", 1)
+    try:
+        async with session.post(request["url"], headers=request["headers"], json=request["data"], timeout=timeout) as response:
+            text = await response.text()
+            outcome = classify_status(response.status)
+            return response, text
+    except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+        outcome = OUTCOME_OVERLOAD
+        raise
+    finally:
+        latency = time.monotonic() - started
+        incr("in_flight", -1)
+        observe("network", latency, request["service_name"])
+        if controller is not None:
+            controller.release(latency, outcome)
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set(): raise GenerationCancelled()
+
+async def _execute_request_async(session, request, controller=None, limiter=None, cancel_event=None, retry_policy=None):
+    """与 ai_service._execute_request 相同的重试语义，使用 aiohttp 发送请求；取消后不再发起新的尝试"""
+    url, data, service_name = request["url"], request["data"], request["service_name"]
+    policy = retry_policy or RetryPolicy()
+    estimated_tokens = estimate_request_tokens(data)
+    attempt, retries_by_category = 0, {}
+    while True:
+        _check_cancelled(cancel_event)
+        if deadline_expired():
+            incr("deadline_exceeded", provider=service_name)
+            raise DeadlineExceeded()
+        content, total_tokens, retry_after = None, 0, None
+        try:
+            if limiter:
+                wait = limiter.reserve(estimated_tokens)
+                if wait > 0: await asyncio.sleep(wait)
+                observe("throttle_wait", max(wait, 0))
+            _check_cancelled(cancel_event)
+            incr("requests", provider=service_name)
+            response, text = await _post_async(session, request, controller)
+            if debug_enabled():
+                log_request(service_name, url, data, response_content=text)
+            if limiter: limiter.update_from_headers(response.headers)
+            if response.status >= 400:
+                retry_after = retry_after_seconds(response.headers)
+            response.raise_for_status()
+            result = json.loads(text)
+            content, total_tokens = extract_completion(result)
+            record_usage(result.get("usage"), service_name, request["pricing"])
+            if limiter: limiter.correct(estimated_tokens, total_tokens)
+
+            if content and _load_json_object(content) is not None:
+                return content, total_tokens
+            category = ERROR_BAD_RESPONSE
+            log_request(service_name, url, data, response_content=content, error_msg="无效响应：内容为空或不是 JSON 对象")
+        except (asyncio.CancelledError, GenerationCancelled):
+            raise
+        except Exception as e:
+            log_request(service_name, url, data, error_msg=str(e))
+            category = error_category(e)
+        incr("errors", provider=service_name)
+        incr(f"errors_{category}")
+        if retry_after is not None: retry_after = min(retry_after, MAX_PENALTY_SECONDS)
+        delay = policy.next_delay(category, attempt, retries_by_category, retry_after)
+        if delay is None:
+            return (content, total_tokens) if content else (None, 0)
+        attempt += 1
+        retries_by_category[category] = retries_by_category.get(category, 0) + 1
+        incr("retries", provider=service_name)
+        incr(f"retries_{category}")
+        # 服务端给出 Retry-After 时通过共享限流器让其他请求一起等待，下次 reserve 时即会等待
+        if retry_after is not None and limiter:
+            limiter.penalize(delay)
+        else:
+            await asyncio.sleep(delay)
+
+async def _call_service_async(session, service, user_content, config, system_prompt, cancel_event=None):
+    request = build_request(user_content, config, system_prompt, service)
+    if request is None: return None, 0, None
+    controller = get_concurrency_controller(request["service"], config)
+    limiter = get_rate_limiter(request["service"], config)
+    content, tokens = await _execute_request_async(session, request, controller, limiter, cancel_event,
+                                                   RetryPolicy.from_config(config))
+    return content, tokens, request_source(request)
+
+def _settle_hedge(task, router, service, target, policy):
+    """对冲请求结束（含被取消）时归还对冲名额，并把结果计入目标服务的熔断器"""
+    policy.finish()
+    if task.cancelled():
+        settle_hedge_target(router, service, target, False, True)
+        return
+    error = task.exception()
+    abandoned = isinstance(error, (GenerationCancelled, DeadlineExceeded))
+    settle_hedge_target(router, service, target, error is None and bool(task.result()[0]), abandoned)
+
+async def _call_service_hedged_async(session, service, policy, router, user_content, config, system_prompt, cancel_event=None):
+    """ai_service._call_service_hedged 的异步版本；落败的请求直接取消，连接随之中断，不会继续占用并发名额和对冲名额"""
+    delay = policy.delay(service)
+    loop = asyncio.get_running_loop()
+
+    def launch(target):
+        started = loop.time()
+        task = asyncio.ensure_future(_call_service_async(session, target, user_content, config, system_prompt, cancel_event))
+        attempts[task] = (len(attempts), target, started)
+        return task
+
+    attempts = {}
+    pending = {launch(service)}
+    result, errors = (None, 0, None), {}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # 只在第一次超时时决定是否对冲，之后等待任意一方完成
+                delay = None
+                if policy.try_start():
+                    target = hedge_target(service, router, policy, config)
+                    incr("hedges", provider=SERVICE_NAMES.get(target, "Unknown"))
+                    hedge = launch(target)
+                    hedge.add_done_callback(lambda task, target=target: _settle_hedge(task, router, service, target, policy))
+                    pending.add(hedge)
+                continue
+            delay = None
+            for task in done:
+                index, target, started = attempts[task]
+                error = task.exception()
+                if isinstance(error, GenerationCancelled): raise error
+                if error is not None:
+                    errors[index > 0] = error
+                    continue
+                outcome = task.result()
+                if outcome[0]:
+                    policy.observe(target, loop.time() - started)
+                    if index > 0: incr("hedge_wins")
+                    return outcome
+                if index == 0: result = outcome
+        raise_attempt_error(errors.get(False), errors.get(True))
+        return result
+    finally:
+        for task in attempts:
+            if not task.done(): task.cancel()
+        policy.record(len(attempts) > 1)
+
+async def _call_ai_service_async(session, user_content, config, system_prompt, cancel_event=None):
+    """call_ai_service 的异步版本，返回 (content, tokens, source)，多服务路由、故障切换与对冲规则相同"""
+    router = get_router(config)
+    policy = get_hedge_policy(config)
+
+    async def attempt(service):
+        if policy is None:
+            return await _call_service_async(session, service, user_content, config, system_prompt, cancel_event)
+        return await _call_service_hedged_async(session, service, policy, router, user_content, config, system_prompt, cancel_event)
+
+    if router is None:
+        return await attempt(config.get("aiService", "openai"))
+
+    tried = set()
+    while True:
+        service = router.choose(tried, throttled_services(router, config))
+        if service is None: return None, 0, None
+        tried.add(service)
+        content, tokens, source = await attempt(service)
+        router.record(service, bool(content))
+        if content: return content, tokens, source
+        incr("failovers", provider=SERVICE_NAMES.get(service, "Unknown"))
+        log_event(logging.WARNING, "provider_failover", service=service)
+
+async def _generate_async(session, task, config, cancel_event=None):
+    """generate_batch_explanation 的异步版本，结果直接写回 task"""
+    system_prompt = resolve_system_prompt(config)
+    safe_context = task.context if task.context else ""
+
+    cache_slot, cached = lookup_cached_result(
+        task.word, safe_context, config, task.field_prompts_map, system_prompt, task.use_cache
+    )
+    if cached is not None:
+        task.results_map, task.tokens, task.cache_hit, task.success = cached[0], 0, True, True
+        task.source = CACHE_SOURCE
+        return
+
+    with timed("prompt_build"):
+        system_content, user_content = build_prompt(task.word, safe_context, task.field_prompts_map, system_prompt, config)
+    raw_content, tokens, source = await _call_ai_service_async(session, user_content, config, system_content, cancel_event)
+    task.source = source
+    if not raw_content:
+        # 与线程池引擎一致：请求失败的任务记为失败，恢复任务时会重新请求
+        task.error, task.success = REQUEST_FAILED_ERROR, False
+        return
+
+    task.tokens = tokens
+    with timed("parse"):
+        results = parse_ai_response(raw_content)
+    if not results:
+        task.error = PARSE_FAILED_ERROR if results is None else REQUEST_FAILED_ERROR
+        task.success = False
+        return
+
+    if cache_slot and results:
+        cache_slot.put(source, results, tokens)
+    task.results_map, task.tokens, task.success = results, tokens, True
+
+async def _generate_split_async(session, task, config, cancel_event=None):
+    """按字段拆分的任务：每个字段单独请求，在同一事件循环中并发完成后合并"""
+    parts = [
+        ExplanationTask(task.note_id, task.word, task.context, {field: prompt}, task.use_cache)
+        for field, prompt in task.field_prompts_map.items()
+    ]
+    await asyncio.gather(*(_generate_async(session, part, config, cancel_event) for part in parts))
+    results, tokens, cache_hit, source = merge_field_results([
+        (part.results_map if part.success else None, part.tokens, part.cache_hit, part.source) for part in parts
+    ])
+    task.tokens, task.cache_hit, task.source = tokens, cache_hit, source
+    if not results:
+        task.error = generation_error(results)
+        task.success = False
+        return
+    task.results_map, task.success = results, True
+
+async def _run_batch(tasks, config, max_in_flight, progress_callback, result_callback, cancel_event):
+    progress_tracker = ProgressTracker()
+    semaphore = asyncio.Semaphore(max_in_flight)
+    budget = TokenBudget(config.get("tokenBudget", 0))
+    deadline_stopped = False
+    completed_task_list = []
+    # 批量截止时间与 Token 预算：之后创建的所有 asyncio 任务都继承该上下文（事件循环结束后上下文随之丢弃，无需恢复）
+    set_deadline(config.get("batchDeadlineSeconds", 0))
+    activate_budget(budget)
+
+    def _report(task):
+        progress_tracker.update_progress(task.word)
+        if result_callback:
+            result_callback(task)
+        else:
+            completed_task_list.append(task)
+        if progress_callback:
+            completed_count, total_count, current_processing_word = progress_tracker.get_progress()
+            progress_callback(completed_count, total_count, current_processing_word)
+
+    async def _process_task(task):
+        try:
+            if task.split_fields and len(task.field_prompts_map) > 1:
+                await _generate_split_async(session, task, config, cancel_event)
+            else:
+                await _generate_async(session, task, config, cancel_event)
+        except GenerationCancelled:
+            # 被取消的任务不交给回调，恢复任务时会重新处理
+            return
+        except Exception as e:
+            task.error = str(e)
+            task.success = False
+        _report(task)
+
+    async def _process_pack(pack):
+        with timed("prompt_build"):
+            pending, user_content, system_prompt, cache_slots = prepare_pack(pack, config)
+        for task in pack:
+            if task not in pending: _report(task)
+        fallback = pending
+        if len(pending) > 1:
+            try:
+                raw_content, tokens, source = await _call_ai_service_async(session, user_content, config, system_prompt, cancel_event)
+                with timed("parse"):
+                    fallback = apply_pack_response(pending, raw_content, tokens, cache_slots, source)
+            except GenerationCancelled:
+                return
+            except Exception as e:
+                log_event(logging.WARNING, "packed_request_error", error=str(e), payload=user_content)
+            for task in pending:
+                if task not in fallback: _report(task)
+        # 被 AI 遗漏的笔记退回逐条请求
+        for task in fallback:
+            await _process_task(task)
+
+    async def _process_unit(unit, enqueued_at):
+        observe("queue_wait", time.perf_counter() - enqueued_at)
+        try:
+            # 每个工作单元在独立的任务中运行，taskDeadlineSeconds 只作用于本单元
+            with deadline_scope(config.get("taskDeadlineSeconds", 0)):
+                if len(unit) == 1:
+                    await _process_task(unit[0])
+                else:
+                    await _process_pack(unit)
+        finally:
+            semaphore.release()
+
+    # 任务源可能是边扫描边生产的 TaskFeed：在线程池中取下一个工作单元，避免阻塞事件循环
+    loop = asyncio.get_running_loop()
+    units = plan_work_units(tasks, config)
+    in_flight = set()
+
+    async def _feed_units():
+        nonlocal deadline_stopped
+        while True:
+            await semaphore.acquire()
+            unit = await loop.run_in_executor(None, next, units, None)
+            if unit is None or budget.exhausted:
+                # 任务源取尽，或达到 Token 预算后不再派发
+                if unit is not None: budget.stopped = True
+                semaphore.release()
+                return
+            # 截止时间已过：已取出的单元照常派发（请求不会发出，任务记为失败并交给回调），之后不再取任务，与线程池引擎一致
+            deadline_stopped = deadline_expired()
+            progress_tracker.add_total(len(unit))
+            future = asyncio.ensure_future(_process_unit(unit, time.perf_counter()))
+            in_flight.add(future)
+            future.add_done_callback(in_flight.discard)
+            if deadline_stopped: return
+
+    async def _wait_cancelled():
+        while not cancel_event.is_set():
+            await asyncio.sleep(0.1)
+
+    connector = aiohttp.TCPConnector(limit=max_in_flight, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        feeder = asyncio.ensure_future(_feed_units())
+
+        async def _drain():
+            await feeder
+            while in_flight:
+                await asyncio.wait(set(in_flight))
+
+        # 正常情况下等待任务源取尽、在途请求全部完成；取消时提前返回
+        drain = asyncio.ensure_future(_drain())
+        watcher = asyncio.ensure_future(_wait_cancelled()) if cancel_event is not None else None
+        await asyncio.wait({drain, watcher} - {None}, return_when=asyncio.FIRST_COMPLETED)
+        if watcher: watcher.cancel()
+        if drain.done():
+            drain.result()
+            budget.check()
+            if deadline_stopped: raise BatchDeadlineExceeded(config.get("batchDeadlineSeconds", 0))
+        else:
+            # 取消：停止取任务，进行中的请求最多再等待宽限时间，之后直接取消（aiohttp 连接随之中断）
+            drain.cancel()
+            feeder.cancel()
+            if in_flight:
+                await asyncio.wait(set(in_flight), timeout=config.get("cancelGraceSeconds", 5))
+            for future in list(in_flight):
+                future.cancel()
+            if in_flight:
+                await asyncio.wait(set(in_flight))
+    # 与线程池引擎一致：结果已经通过 result_callback 交付时返回空列表
+    return completed_task_list
+
+def generate_explanations_batch_async(tasks, config, max_in_flight=50, progress_callback=None, result_callback=None, cancel_event=None):
+    """
+    与 generate_explanations_batch 相同的约定：流式取任务，在途请求不超过 max_in_flight，所有任务共享只读配置。
+    cancel_event 被设置后停止取任务，进行中的请求等待宽限时间后被直接取消。
+    配置了 tokenBudget 时，实际用量达到上限后停止取任务，在途任务完成后抛出 BudgetExhausted；
+    配置了 batchDeadlineSeconds 时同理，超过截止时间后抛出 BatchDeadlineExceeded。
+    在调用线程中运行独立的事件循环（通常是 BatchGenerationWorker 线程）。
+    """
+    if isinstance(tasks, list) and not tasks: return []
+    return asyncio.run(_run_batch(tasks, freeze_config(config), max(1, max_in_flight), progress_callback, result_callback, cancel_event))
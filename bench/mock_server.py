@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟的 Chat Completions 服务（OpenAI 兼容），用于离线基准测试。
+不产生任何费用：按配置的延迟分布返回请求中每个字段的占位内容，并可注入 429/5xx、
+非法 JSON、代码块包裹的 JSON 和 Token 用量，覆盖插件在真实服务上遇到的主要情况。
+
+单独运行时可作为 Anki 中插件的 Base URL 使用：
+    python bench/mock_server.py --port 8765 --latency lognormal:0.8:0.5
+"""
+
+import sys
+import json
+import math
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 与 token_estimator 相同的粗略估算：约 4 个 ASCII 字符 1 个 Token
+CHARS_PER_TOKEN = 4
+
+
+def parse_latency(spec, rng=random):
+    """
+    解析延迟分布描述，返回无参函数（每次调用返回一次延迟秒数）：
+      fixed:0.5            固定 0.5 秒
+      uniform:0.2:1.0      0.2~1.0 秒均匀分布
+      lognormal:0.8:0.5    中位数 0.8 秒、sigma 0.5 的对数正态分布（长尾）
+    """
+    kind, _, rest = spec.partition(":")
+    args = [float(x) for x in rest.split(":") if x]
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(args[0], args[1])
+    if kind == "lognormal":
+        median, sigma = args
+        return lambda: rng.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+class MockSettings:
+    def __init__(self, latency="fixed:0.2", rate_429=0.0, rate_5xx=0.0, malformed_rate=0.0,
+                 fenced_rate=0.0, tail_rate=0.0, tail_latency=30.0, seed=None):
+        self.random = random.Random(seed)
+        self.latency = parse_latency(latency, self.random)
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.malformed_rate = malformed_rate  # 返回无法解析的 JSON
+        self.fenced_rate = fenced_rate        # 用 ```json 代码块包裹返回内容
+        self.tail_rate = tail_rate            # 额外的长尾请求比例（模拟偶发的超慢请求）
+        self.tail_latency = tail_latency
+        self.lock = threading.Lock()
+        self.seen_prefixes = set()  # 模拟服务商的前缀缓存：见过的系统消息再次出现时按缓存命中计
+        self.stats = {"requests": 0, "ok": 0, "429": 0, "5xx": 0, "malformed": 0, "head": 0}
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def cached_prefix_tokens(self, messages):
+        if not messages: return 0
+        prefix = messages[0].get("content", "")
+        with self.lock:
+            if prefix in self.seen_prefixes:
+                return len(prefix) // CHARS_PER_TOKEN
+            self.seen_prefixes.add(prefix)
+        return 0
+
+    def roll(self, rate):
+        if not rate: return False
+        with self.lock:
+            return self.random.random() < rate
+
+
+# 缓存友好布局把字段指令放在系统消息末尾的这个标记之后（见 prompts.PROMPT_CACHE_LAYOUT_ADDENDUM）
+PREFIX_FIELDS_MARKER = "字段指令：\n"
+
+
+def _prefix_fields(system_content):
+    """缓存友好布局下 User Content 不含 requirements，字段名从系统消息中的字段指令读取"""
+    _, marker, fields = system_content.rpartition(PREFIX_FIELDS_MARKER)
+    if not marker: return {}
+    try:
+        return json.loads(fields)
+    except ValueError:
+        return {}
+
+
+def _answer(user, system_content):
+    """按请求协议生成回答：单词请求返回 {字段: 内容}，打包请求返回 {笔记键: {字段: 内容}}"""
+    shared_fields = _prefix_fields(system_content)
+    if "notes" in user:
+        return {
+            key: {field: f"<b>{note.get('word', '')}</b> {field} 的模拟释义" for field in note.get("requirements", shared_fields)}
+            for key, note in user["notes"].items()
+        }
+    return {field: f"<b>{user.get('word', '')}</b> {field} 的模拟释义" for field in user.get("requirements", shared_fields)}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_HEAD(self):
+        # 预连接使用 HEAD 请求建立连接，这里只需正常应答（不计入 requests）
+        self.server.settings.count("head")
+        self._send(405, "")
+
+    def do_POST(self):
+        settings = self.server.settings
+        settings.count("requests")
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with settings.lock:
+            delay = settings.latency()
+        if settings.roll(settings.tail_rate):
+            delay = settings.tail_latency
+        threading.Event().wait(delay)
+
+        if settings.roll(settings.rate_429):
+            settings.count("429")
+            return self._send(429, '{"error": {"message": "Rate limit reached"}}', headers={"Retry-After": "1"})
+        if settings.roll(settings.rate_5xx):
+            settings.count("5xx")
+            return self._send(503, '{"error": {"message": "Service unavailable"}}')
+
+        messages = body.get("messages") or [{}]
+        try:
+            user = json.loads(messages[-1]["content"])
+        except (KeyError, ValueError):
+            user = {}
+        content = json.dumps(_answer(user, messages[0].get("content", "")), ensure_ascii=False)
+        if settings.roll(settings.malformed_rate):
+            settings.count("malformed")
+            content = content[:len(content) // 2]
+        else:
+            settings.count("ok")
+        if settings.roll(settings.fenced_rate):
+            content = f"```json\n{content}\n```"
+
+        prompt_tokens = sum(len(message.get("content", "")) for message in body.get("messages", [])) // CHARS_PER_TOKEN
+        completion_tokens = len(content) // CHARS_PER_TOKEN
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": settings.cached_prefix_tokens(body.get("messages"))},
+        }
+
+        if body.get("stream"):
+            # SSE：按小块返回内容，最后一个数据块携带用量（对应 stream_options.include_usage）
+            chunks = [content[i:i + 16] for i in range(0, len(content), 16)]
+            events = [json.dumps({"choices": [{"delta": {"content": chunk}}]}, ensure_ascii=False) for chunk in chunks]
+            events.append(json.dumps({"choices": [], "usage": usage}))
+            stream = "".join(f"data: {event}\n\n" for event in events) + "data: [DONE]\n\n"
+            return self._send(200, stream, content_type="text/event-stream")
+
+        response = {
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+        self._send(200, json.dumps(response, ensure_ascii=False))
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings, host="127.0.0.1", port=0):
+        super().__init__((host, port), MockHandler)
+        self.settings = settings
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def add_settings_arguments(parser):
+    parser.add_argument("--latency", default="fixed:0.2", help="延迟分布：fixed:S / uniform:A:B / lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="返回 503 的比例")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="返回截断（非法）JSON 的比例")
+    parser.add_argument("--fenced-rate", type=float, default=0.0, help="用 ```json 代码块包裹内容的比例")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="超慢请求的比例")
+    parser.add_argument("--tail-latency", type=float, default=30.0, help="超慢请求的延迟秒数")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，便于复现")
+
+
+def settings_from_args(args):
+    return MockSettings(args.latency, args.rate_429, args.rate_5xx, args.malformed_rate,
+                        args.fenced_rate, args.tail_rate, args.tail_latency, args.seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LexiSage 基准测试用的模拟 Chat Completions 服务")
+    parser.add_argument("--port", type=int, default=8765)
+    add_settings_arguments(parser)
+    args = parser.parse_args(argv)
+    server = MockServer(settings_from_args(args), port=args.port)
+    # 第一行输出服务地址，run_bench.py 以子进程启动时从这里读取
+    print(f"模拟服务已启动: {server.url} （Ctrl+C 停止）", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.settings.stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+LexiSage 离线基准测试：在本地模拟服务上运行批量生成，报告吞吐、延迟分位数和内存峰值。
+不需要 Anki 和真实服务：插件模块以合成包的方式直接加载（跳过依赖 aqt 的 __init__.py），
+模拟服务在独立子进程中运行，不计入被测进程的 CPU 和内存。
+
+用法（在仓库根目录运行）：
+    python bench/run_bench.py                                   # quick 预设
+    python bench/run_bench.py --preset full --output bench_output.txt
+    python bench/run_bench.py --sizes 500 --concurrency 8,32 --engines thread,asyncio \\
+        --pack off,on --latency lognormal:0.5:0.6 --rate-429 0.02 --json results.json
+    python bench/run_bench.py --hedge off,on --tail-rate 0.03 --tail-latency 10     # 对冲请求对长尾的效果
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import types
+import argparse
+import itertools
+import importlib
+import subprocess
+import tempfile
+import tracemalloc
+
+from mock_server import add_settings_arguments
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCH_DIR)
+ADDON_PACKAGE = "lexisage_bench"
+
+PRESETS = {
+    "quick": {"sizes": [100], "concurrency": [4, 16], "engines": ["thread"], "pack": [False, True], "cache_layout": [False],
+              "hedge": [False]},
+    "full": {"sizes": [200, 1000], "concurrency": [4, 16, 64], "engines": ["thread", "asyncio"], "pack": [False, True],
+             "cache_layout": [False, True], "hedge": [False]},
+}
+
+# 每条笔记请求的字段，与常见的单词卡配置相当
+FIELD_PROMPTS = {
+    "释义": "用中文解释 {word} 在 {context} 中的含义",
+    "例句": "给出 {word} 的两个英文例句并附翻译",
+    "词源": "简述 {word} 的词源",
+}
+
+
+def load_addon():
+    """以合成包加载插件模块；日志写到临时目录，避免在仓库中生成 lexisage.log"""
+    package = types.ModuleType(ADDON_PACKAGE)
+    package.__path__ = [ADDON_DIR]
+    sys.modules[ADDON_PACKAGE] = package
+    logger = importlib.import_module(f"{ADDON_PACKAGE}.logger")
+    logger.LOG_PATH = os.path.join(tempfile.mkdtemp(prefix="lexisage-bench-"), logger.LOG_FILENAME)
+    return types.SimpleNamespace(
+        ai=importlib.import_module(f"{ADDON_PACKAGE}.ai_service"),
+        async_engine=importlib.import_module(f"{ADDON_PACKAGE}.async_engine"),
+        metrics=importlib.import_module(f"{ADDON_PACKAGE}.metrics"),
+        log_path=logger.LOG_PATH,
+    )
+
+
+def start_mock_server(args):
+    """在子进程中启动模拟服务，返回 (进程, URL)"""
+    command = [sys.executable, os.path.join(BENCH_DIR, "mock_server.py"), "--port", "0",
+               "--latency", args.latency, "--rate-429", str(args.rate_429), "--rate-5xx", str(args.rate_5xx),
+               "--malformed-rate", str(args.malformed_rate), "--fenced-rate", str(args.fenced_rate),
+               "--tail-rate", str(args.tail_rate), "--tail-latency", str(args.tail_latency)]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, encoding="utf-8")
+    match = re.search(r"http://\S+", process.stdout.readline())
+    if not match:
+        process.kill()
+        raise RuntimeError("模拟服务启动失败")
+    return process, match.group(0)
+
+
+def build_config(url, concurrency, packed, cache_layout=False, hedge=False):
+    return {
+        "aiService": "openai",
+        "apiConfig": {"openai": {"baseUrl": url, "apiKey": "bench", "model": "mock", "temperature": 0.1}},
+        "enableResponseCache": False,
+        "enableMultiThreading": True,
+        "maxConcurrentRequests": concurrency,
+        "asyncMaxInFlight": concurrency,
+        "enablePackedRequests": packed,
+        "packSize": 5,
+        "enablePromptCacheLayout": cache_layout,
+        "enableHedging": hedge,
+    }
+
+
+def run_scenario(addon, url, size, concurrency, engine, packed, cache_layout=False, hedge=False):
+    ai, metrics = addon.ai, addon.metrics
+    config = build_config(url, concurrency, packed, cache_layout, hedge)
+    tasks = [
+        ai.ExplanationTask(i, f"word{i}", f"This is context sentence number {i}.", FIELD_PROMPTS, use_cache=False)
+        for i in range(size)
+    ]
+    counts = {"ok": 0, "failed": 0}
+
+    def on_result(task):
+        counts["ok" if task.success and task.results_map else "failed"] += 1
+        # 与 ResultWriter 一致：写入后即释放结果，内存峰值反映引擎本身的占用
+        task.results_map = None
+
+    run_metrics = metrics.RunMetrics(f"{engine} n={size} c={concurrency} pack={packed}")
+    token = metrics.activate(run_metrics)
+    tracemalloc.start()
+    run_metrics.mark_started()
+    try:
+        if engine == "asyncio":
+            addon.async_engine.generate_explanations_batch_async(tasks, config, concurrency, None, on_result)
+        else:
+            ai.generate_explanations_batch(tasks, config, concurrency, None, on_result)
+    finally:
+        run_metrics.mark_finished()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        metrics.deactivate(token)
+
+    summary = run_metrics.summary()
+    elapsed = summary["elapsed_seconds"]
+    counters = summary["counters"]
+    network = summary["phases"].get("network", {})
+    return {
+        "engine": engine,
+        "size": size,
+        "concurrency": concurrency,
+        "packed": packed,
+        "cache_layout": cache_layout,
+        "hedge": hedge,
+        "elapsed_seconds": elapsed,
+        "notes_ok": counts["ok"],
+        "notes_failed": counts["failed"],
+        "notes_per_second": counts["ok"] / elapsed if elapsed else 0.0,
+        "requests": counters.get("requests", 0),
+        "requests_per_second": counters.get("requests", 0) / elapsed if elapsed else 0.0,
+        "retries": counters.get("retries", 0),
+        "errors": counters.get("errors", 0),
+        "hedges": counters.get("hedges", 0),
+        "prompt_tokens": counters.get("prompt_tokens", 0),
+        "cached_ratio": counters.get("cached_tokens", 0) / max(1, counters.get("prompt_tokens", 0)),
+        "latency_p50": network.get("p50", 0.0),
+        "latency_p95": network.get("p95", 0.0),
+        "latency_p99": network.get("p99", 0.0),
+        "peak_memory_mb": peak / (1024 * 1024),
+        "metrics": summary,
+    }
+
+
+COLUMNS = [
+    ("engine", "引擎", "{}"), ("size", "笔记", "{}"), ("concurrency", "并发", "{}"), ("packed", "打包", "{}"), ("cache_layout", "前缀布局", "{}"), ("hedge", "对冲", "{}"),
+    ("elapsed_seconds", "耗时s", "{:.2f}"), ("notes_per_second", "笔记/s", "{:.1f}"),
+    ("requests_per_second", "请求/s", "{:.1f}"), ("latency_p50", "p50", "{:.3f}"), ("latency_p95", "p95", "{:.3f}"),
+    ("latency_p99", "p99", "{:.3f}"), ("retries", "重试", "{}"), ("hedges", "对冲次数", "{}"), ("notes_failed", "失败", "{}"),
+    ("prompt_tokens", "输入Tokens", "{}"), ("cached_ratio", "缓存命中", "{:.0%}"),
+    ("peak_memory_mb", "内存峰值MB", "{:.2f}"),
+]
+
+
+def format_table(results):
+    rows = [[title for _, title, _ in COLUMNS]]
+    rows += [[fmt.format(result[key]) for key, _, fmt in COLUMNS] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def _parse_list(text, convert=str):
+    return [convert(item) for item in text.split(",") if item]
+
+
+def _parse_bool(text):
+    return text.lower() in ("on", "true", "1", "yes")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LexiSage 离线基准测试")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--sizes", help="笔记数，逗号分隔（覆盖预设）")
+    parser.add_argument("--concurrency", help="并发数，逗号分隔（覆盖预设）")
+    parser.add_argument("--engines", help="thread / asyncio，逗号分隔（覆盖预设）")
+    parser.add_argument("--pack", help="off / on，逗号分隔（覆盖预设）")
+    parser.add_argument("--cache-layout", help="off / on，逗号分隔：是否使用缓存友好的提示词布局（覆盖预设）")
+    parser.add_argument("--hedge", help="off / on，逗号分隔：是否启用对冲请求（覆盖预设）")
+    parser.add_argument("--output", help="同时把结果表写入该文件")
+    parser.add_argument("--json", help="把每个场景的完整指标写入该 JSON 文件")
+    add_settings_arguments(parser)
+    args = parser.parse_args(argv)
+
+    preset = PRESETS[args.preset]
+    sizes = _parse_list(args.sizes, int) if args.sizes else preset["sizes"]
+    concurrency_levels = _parse_list(args.concurrency, int) if args.concurrency else preset["concurrency"]
+    engines = _parse_list(args.engines) if args.engines else preset["engines"]
+    pack_modes = _parse_list(args.pack, _parse_bool) if args.pack else preset["pack"]
+    layouts = _parse_list(args.cache_layout, _parse_bool) if args.cache_layout else preset["cache_layout"]
+    hedge_modes = _parse_list(args.hedge, _parse_bool) if args.hedge else preset["hedge"]
+
+    addon = load_addon()
+    if "asyncio" in engines and not addon.async_engine.is_available():
+        print("未安装 aiohttp，跳过 asyncio 引擎")
+        engines = [engine for engine in engines if engine != "asyncio"]
+
+    process, url = start_mock_server(args)
+    results = []
+    try:
+        for engine, size, concurrency, packed, cache_layout, hedge in itertools.product(
+                engines, sizes, concurrency_levels, pack_modes, layouts, hedge_modes):
+            print(f"运行: engine={engine} size={size} concurrency={concurrency} pack={packed} cache_layout={cache_layout} "
+                  f"hedge={hedge} ...", flush=True)
+            results.append(run_scenario(addon, url, size, concurrency, engine, packed, cache_layout, hedge))
+    finally:
+        process.terminate()
+        process.wait()
+
+    header = (f"LexiSage 基准测试 {time.strftime('%Y-%m-%d %H:%M:%S')}  延迟={args.latency}  "
+              f"429={args.rate_429}  5xx={args.rate_5xx}  非法JSON={args.malformed_rate}  代码块={args.fenced_rate}")
+    table = header + "\n" + format_table(results)
+    print()
+    print(table)
+    print(f"\n请求失败记录在 {addon.log_path}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(table + "\n")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,6 +23,21 @@ whitelist = [
     "config_ui.py",
     "ai_service.py",
     "prompts.py",
+    "response_cache.py",
+    "async_engine.py",
+    "concurrency.py",
+    "rate_limiter.py",
+    "token_estimator.py",
+    "job_journal.py",
+    "logger.py",
+    "prescan.py",
+    "json_stream.py",
+    "metrics.py",
+    "progress_ui.py",
+    "router.py",
+    "hedging.py",
+    "retry_policy.py",
+    "paths.py",
     "manifest.json",
     "meta.json",
     "config.json",
@@ -0,0 +1,151 @@
+import time
+import asyncio
+from threading import Condition, Lock
+
+# --- 自适应并发控制：AIMD（加性增、乘性减）根据延迟和错误动态调整并发数 ---
+
+# 各服务的默认并发上下限，可在 apiConfig 中通过 minConcurrency / maxConcurrency 覆盖
+DEFAULT_CONCURRENCY_BOUNDS = {
+    "openai": (1, 10),
+    "xai": (1, 10),
+    "deepseek": (1, 50),
+}
+
+# 请求结果分类：overload 会触发降并发，error 不影响并发（如鉴权失败），success 用于加并发
+OUTCOME_SUCCESS = "success"
+OUTCOME_OVERLOAD = "overload"
+OUTCOME_ERROR = "error"
+
+
+def classify_status(status_code):
+    """HTTP 429 与 5xx 视为服务端过载，其余非 2xx 视为普通错误"""
+    if status_code == 429 or status_code >= 500: return OUTCOME_OVERLOAD
+    if status_code >= 400: return OUTCOME_ERROR
+    return OUTCOME_SUCCESS
+
+
+class AdaptiveConcurrencyController:
+    def __init__(self, initial, min_limit, max_limit, latency_tolerance=2.0, decrease_factor=0.5):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.baseline_latency = None
+        self.last_decrease = 0.0
+        self.cond = Condition()
+        self.async_waiters = []  # 等待名额的协程：(事件循环, Future)
+
+    @property
+    def current_limit(self):
+        with self.cond:
+            return int(self.limit)
+
+    def configure(self, min_limit, max_limit):
+        with self.cond:
+            self.min_limit = max(1, int(min_limit))
+            self.max_limit = max(self.min_limit, int(max_limit))
+            self.limit = float(min(max(self.limit, self.min_limit), self.max_limit))
+            self._notify_all()
+
+    def try_acquire(self):
+        with self.cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self, cancel_event=None):
+        """阻塞直到获得名额并返回 True；cancel_event 被设置时放弃等待并返回 False"""
+        with self.cond:
+            timeout = None if cancel_event is None else 0.2
+            while not self.cond.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                if cancel_event.is_set(): return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self):
+        """
+        协程版 acquire。控制器由线程与事件循环共享，不能在事件循环中阻塞等待条件变量：
+        名额不足时登记一个 Future，由 release/configure 通过 call_soon_threadsafe 唤醒后重新检查。
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.cond:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self.async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self.cond:
+                    if waiter in self.async_waiters: self.async_waiters.remove(waiter)
+
+    def release(self, latency=None, outcome=OUTCOME_SUCCESS):
+        with self.cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if outcome == OUTCOME_OVERLOAD:
+                self._on_overload()
+            elif outcome == OUTCOME_SUCCESS and latency is not None:
+                self._on_success(latency)
+            self._notify_all()
+
+    def _notify_all(self):
+        # 调用方已持有 self.cond；线程直接唤醒，协程在各自的事件循环中唤醒
+        self.cond.notify_all()
+        waiters, self.async_waiters = self.async_waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake_future, future)
+            except RuntimeError:
+                pass  # 事件循环已关闭，等待的协程不会再运行
+
+    def _on_success(self, latency):
+        # 基线延迟取观测到的较低值，并缓慢上浮以适应服务端正常波动
+        if self.baseline_latency is None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency = self.baseline_latency * 0.99 + latency * 0.01
+        # 延迟健康时加性增长：大约每完成一轮（limit 个请求）并发数 +1
+        if latency <= self.baseline_latency * self.latency_tolerance:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def _on_overload(self):
+        # 同一轮拥塞只降一次，避免一次 429 风暴把并发数连续砍到下限
+        now = time.monotonic()
+        cooldown = max(1.0, self.baseline_latency or 0)
+        if now - self.last_decrease < cooldown: return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+
+def _wake_future(future):
+    if not future.done(): future.set_result(None)
+
+
+_controllers = {}
+_controllers_lock = Lock()
+
+
+def concurrency_bounds(service, config):
+    api_config = config.get("apiConfig", {}).get(service, {})
+    default_min, default_max = DEFAULT_CONCURRENCY_BOUNDS.get(service, (1, 10))
+    return api_config.get("minConcurrency", default_min), api_config.get("maxConcurrency", default_max)
+
+
+def get_concurrency_controller(service, config):
+    """返回该服务共享的并发控制器；未启用自适应并发时返回 None"""
+    if not config.get("enableAdaptiveConcurrency", False):
+        return None
+    min_limit, max_limit = concurrency_bounds(service, config)
+    with _controllers_lock:
+        controller = _controllers.get(service)
+        if controller is None:
+            controller = AdaptiveConcurrencyController(config.get("maxConcurrentRequests", 3), min_limit, max_limit)
+            _controllers[service] = controller
+        else:
+            controller.configure(min_limit, max_limit)
+        return controller
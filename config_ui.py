@@ -5,14 +5,19 @@ import os
 import json
 import codecs
 from .prompts import DEFAULT_GLOBAL_SYSTEM_PROMPT, DEFAULT_FIELD_PROMPT_TEMPLATE, BATCH_INSTRUCTION_TEMPLATE
+from .response_cache import get_response_cache
+from . import async_engine
+from .concurrency import DEFAULT_CONCURRENCY_BOUNDS
+from .logger import configure_logging, LOG_PATH
 
 # 笔记类型配置类：存储单个笔记类型的配置信息
 class NoteTypeConfig:
-    def __init__(self, note_type="", field_to_explain="", context_field="", field_prompts=None):
+    def __init__(self, note_type="", field_to_explain="", context_field="", field_prompts=None, split_fields=False):
         self.note_type = note_type
         self.field_to_explain = field_to_explain
         self.context_field = context_field
         self.field_prompts = field_prompts if field_prompts is not None else {}
+        self.split_fields = split_fields
 
 # 配置对话框类：主配置界面，提供用户配置LexiSage的所有设置选项
 class ConfigDialog(QDialog):
@@ -69,7 +74,8 @@ class ConfigDialog(QDialog):
                     note_type=note_type,
                     field_to_explain=config_data.get("fieldToExplain", ""),
                     context_field=config_data.get("contextField", ""),
-                    field_prompts=config_data.get("fieldPrompts", {})
+                    field_prompts=config_data.get("fieldPrompts", {}),
+                    split_fields=config_data.get("splitFields", False)
                 )
                 self.note_type_configs.append(obj)
         # 系统大改，如果没有旧配置，就保持空列表
@@ -84,6 +90,7 @@ class ConfigDialog(QDialog):
         1. 笔记类型设置：配置不同笔记类型的字段映射和提示词
         2. AI系统指令：设置全局AI系统提示词
         3. AI服务设置：配置API密钥、模型参数和高级选项
+        4. 性能与缓存：配置本地响应缓存等性能相关选项
         """
         self.setWindowTitle("LexiSage设置")
         self.setFixedSize(650, 700) 
@@ -151,6 +158,11 @@ class ConfigDialog(QDialog):
         settings_layout.addRow("来源单词字段:", self.field_to_explain_combo)
         settings_layout.addRow("来源上下文字段:", self.context_field_combo)
 
+        # 低延迟模式：每个目标字段单独并行请求，等待时间取决于最慢的字段（Token 消耗更多）
+        self.split_fields_checkbox = QCheckBox("低延迟模式：每个目标字段单独并行请求")
+        self.split_fields_checkbox.setToolTip("用于编辑器和小批量生成；系统提示词和上下文会随每个字段重复发送，消耗更多 Token。")
+        settings_layout.addRow(self.split_fields_checkbox)
+
         # 释义目标字段与提示词配置区域
         self.fields_prompt_group = QGroupBox("释义目标字段与提示词")
         fp_layout = QVBoxLayout(self.fields_prompt_group)
@@ -242,6 +254,10 @@ class ConfigDialog(QDialog):
         svc_sel.addWidget(QLabel("选择AI服务:"))
         svc_sel.addWidget(self.ai_service_combo)
         ai_layout.addLayout(svc_sel)
+
+        # 多服务负载均衡：按各服务的“负载权重”分配请求，某个服务出错或被限流时自动切换
+        self.enable_multi_provider_checkbox = QCheckBox("启用多服务负载均衡与故障切换（使用所有已填写 API Key 且权重大于 0 的服务）")
+        ai_layout.addWidget(self.enable_multi_provider_checkbox)
         
         # 服务配置堆栈：根据选择的服务显示相应的配置面板
         self.service_stack = QStackedWidget()
@@ -291,6 +307,222 @@ class ConfigDialog(QDialog):
         
         ai_layout.addStretch()
 
+        # --- Tab 4: 性能与缓存 ---
+        perf_tab = QWidget()
+        perf_scroll = QScrollArea()
+        perf_scroll.setWidgetResizable(True)
+        perf_scroll.setWidget(perf_tab)
+        perf_layout = QVBoxLayout(perf_tab)
+        tabs.addTab(perf_scroll, "4. 性能与缓存")
+
+        # 响应缓存区域：相同的单词/上下文/提示词组合直接复用本地结果，不再请求 AI
+        cache_group = QGroupBox("本地响应缓存")
+        cache_layout = QFormLayout(cache_group)
+
+        self.enable_cache_checkbox = QCheckBox("启用本地响应缓存")
+        cache_layout.addRow(self.enable_cache_checkbox)
+
+        # 缓存容量上限：超出后按最近最少使用（LRU）淘汰
+        self.cache_size_spinbox = QSpinBox()
+        self.cache_size_spinbox.setRange(10, 10000)
+        self.cache_size_spinbox.setSuffix(" MB")
+        cache_layout.addRow("缓存容量上限:", self.cache_size_spinbox)
+
+        # 缓存有效期：超过天数的记录会被删除
+        self.cache_age_spinbox = QSpinBox()
+        self.cache_age_spinbox.setRange(1, 3650)
+        self.cache_age_spinbox.setSuffix(" 天")
+        cache_layout.addRow("缓存有效期:", self.cache_age_spinbox)
+
+        # 缓存统计与清空按钮
+        self.cache_stats_label = QLabel("-")
+        self.cache_stats_label.setStyleSheet("color: gray; font-size: 11px;")
+        cache_layout.addRow("缓存统计:", self.cache_stats_label)
+        clear_cache_btn = QPushButton("清空缓存")
+        clear_cache_btn.clicked.connect(self.clear_response_cache)
+        cache_layout.addRow(clear_cache_btn)
+        perf_layout.addWidget(cache_group)
+
+        # 生成引擎区域：线程池（默认）或 asyncio 异步引擎
+        engine_group = QGroupBox("批量生成引擎")
+        engine_layout = QFormLayout(engine_group)
+
+        self.engine_combo = QComboBox()
+        self.engine_combo.addItem("线程池 (ThreadPool)", "thread")
+        self.engine_combo.addItem("异步 (asyncio)", "asyncio")
+        engine_layout.addRow("引擎:", self.engine_combo)
+
+        # 异步引擎在途请求上限：不占用额外线程，可远高于线程池并发数
+        self.async_in_flight_spinbox = QSpinBox()
+        self.async_in_flight_spinbox.setRange(1, 200)
+        engine_layout.addRow("异步在途请求上限:", self.async_in_flight_spinbox)
+
+        # 取消后等待进行中请求的最长时间，超时后放弃等待（已返回的结果仍会写入缓存）
+        self.cancel_grace_spinbox = QSpinBox()
+        self.cancel_grace_spinbox.setRange(0, 60)
+        self.cancel_grace_spinbox.setSuffix(" 秒")
+        engine_layout.addRow("取消等待时间:", self.cancel_grace_spinbox)
+
+        # 单次批量的 Token 上限：按实际用量累计，达到后停止派发新任务，未完成的任务可以恢复
+        self.token_budget_spinbox = QSpinBox()
+        self.token_budget_spinbox.setRange(0, 2000000000)
+        self.token_budget_spinbox.setSingleStep(100000)
+        self.token_budget_spinbox.setSpecialValueText("不限制")
+        engine_layout.addRow("单次批量 Token 预算:", self.token_budget_spinbox)
+
+        engine_hint = QLabel("异步引擎需要 aiohttp 库。" if async_engine.is_available()
+                             else "未检测到 aiohttp 库，选择异步引擎时将自动回退到线程池。")
+        engine_hint.setStyleSheet("color: gray; font-size: 11px;")
+        engine_hint.setWordWrap(True)
+        engine_layout.addRow(engine_hint)
+        perf_layout.addWidget(engine_group)
+
+        # 自适应并发区域：延迟与错误率健康时逐步加并发，遇到 429/5xx/超时时减半
+        adaptive_group = QGroupBox("自适应并发 (AIMD)")
+        adaptive_layout = QFormLayout(adaptive_group)
+        self.enable_adaptive_checkbox = QCheckBox("启用自适应并发（替代固定并发请求数）")
+        adaptive_layout.addRow(self.enable_adaptive_checkbox)
+        adaptive_hint = QLabel("并发范围在「3. AI服务设置」中按服务分别配置，固定并发请求数作为初始值。")
+        adaptive_hint.setStyleSheet("color: gray; font-size: 11px;")
+        adaptive_hint.setWordWrap(True)
+        adaptive_layout.addRow(adaptive_hint)
+        perf_layout.addWidget(adaptive_group)
+
+        # 多词打包区域：一次请求处理多条笔记，摊薄系统提示词等协议开销
+        pack_group = QGroupBox("多词打包")
+        pack_layout = QFormLayout(pack_group)
+        self.enable_pack_checkbox = QCheckBox("启用多词打包（多条笔记合并为一次请求）")
+        pack_layout.addRow(self.enable_pack_checkbox)
+
+        self.pack_size_spinbox = QSpinBox()
+        self.pack_size_spinbox.setRange(2, 50)
+        pack_layout.addRow("每次请求笔记数:", self.pack_size_spinbox)
+
+        # 单次打包请求的 Token 预算：估算超出时提前拆成新的请求
+        self.pack_budget_spinbox = QSpinBox()
+        self.pack_budget_spinbox.setRange(1000, 200000)
+        self.pack_budget_spinbox.setSingleStep(1000)
+        pack_layout.addRow("单次请求 Token 预算:", self.pack_budget_spinbox)
+        perf_layout.addWidget(pack_group)
+
+        # 提示词布局：字段指令放入固定前缀，单词和上下文放在最后，提高服务商前缀缓存命中率
+        prompt_cache_group = QGroupBox("服务商前缀缓存")
+        prompt_cache_layout = QFormLayout(prompt_cache_group)
+        self.enable_prompt_cache_layout_checkbox = QCheckBox("使用缓存友好的提示词布局（固定前缀 + 变量在后）")
+        prompt_cache_layout.addRow(self.enable_prompt_cache_layout_checkbox)
+        prompt_cache_hint = QLabel("同一笔记类型的请求共享相同的前缀，DeepSeek / OpenAI 等服务对命中缓存的输入 Token 降价并加快首字响应。")
+        prompt_cache_hint.setStyleSheet("color: gray; font-size: 11px;")
+        prompt_cache_hint.setWordWrap(True)
+        prompt_cache_layout.addRow(prompt_cache_hint)
+        perf_layout.addWidget(prompt_cache_group)
+
+        # 对冲请求：慢请求超过阈值后再发一份，取先完成的结果，削减批量末尾的长尾等待
+        hedge_group = QGroupBox("对冲请求（削减长尾延迟）")
+        hedge_layout = QFormLayout(hedge_group)
+        self.enable_hedging_checkbox = QCheckBox("启用对冲请求")
+        hedge_layout.addRow(self.enable_hedging_checkbox)
+
+        self.hedge_delay_spinbox = QDoubleSpinBox()
+        self.hedge_delay_spinbox.setRange(0.0, 120.0)
+        self.hedge_delay_spinbox.setDecimals(1)
+        self.hedge_delay_spinbox.setSuffix(" 秒")
+        self.hedge_delay_spinbox.setSpecialValueText("自动（按近期延迟分位数）")
+        hedge_layout.addRow("对冲阈值:", self.hedge_delay_spinbox)
+
+        self.hedge_percentile_spinbox = QSpinBox()
+        self.hedge_percentile_spinbox.setRange(50, 99)
+        self.hedge_percentile_spinbox.setPrefix("p")
+        hedge_layout.addRow("自动阈值分位数:", self.hedge_percentile_spinbox)
+
+        self.hedge_max_percent_spinbox = QSpinBox()
+        self.hedge_max_percent_spinbox.setRange(1, 50)
+        self.hedge_max_percent_spinbox.setSuffix(" %")
+        hedge_layout.addRow("对冲比例上限:", self.hedge_max_percent_spinbox)
+
+        self.hedge_other_provider_checkbox = QCheckBox("启用多服务路由时，对冲请求发往另一个服务")
+        hedge_layout.addRow(self.hedge_other_provider_checkbox)
+        perf_layout.addWidget(hedge_group)
+
+        # 重试策略：鉴权失败等不可恢复的错误不重试，其余按指数退避加随机抖动重试，且不越过截止时间
+        retry_group = QGroupBox("重试与截止时间")
+        retry_layout = QFormLayout(retry_group)
+        self.max_retries_spinbox = QSpinBox()
+        self.max_retries_spinbox.setRange(0, 10)
+        retry_layout.addRow("最多重试次数:", self.max_retries_spinbox)
+
+        self.bad_response_retries_spinbox = QSpinBox()
+        self.bad_response_retries_spinbox.setRange(0, 5)
+        retry_layout.addRow("无效响应（空内容/非法 JSON）重试次数:", self.bad_response_retries_spinbox)
+
+        self.retry_base_delay_spinbox = QDoubleSpinBox()
+        self.retry_base_delay_spinbox.setRange(0.1, 10.0)
+        self.retry_base_delay_spinbox.setDecimals(1)
+        self.retry_base_delay_spinbox.setSuffix(" 秒")
+        self.retry_max_delay_spinbox = QDoubleSpinBox()
+        self.retry_max_delay_spinbox.setRange(1.0, 300.0)
+        self.retry_max_delay_spinbox.setDecimals(0)
+        self.retry_max_delay_spinbox.setSuffix(" 秒")
+        retry_delay_layout = QHBoxLayout()
+        retry_delay_layout.addWidget(self.retry_base_delay_spinbox)
+        retry_delay_layout.addWidget(QLabel("~"))
+        retry_delay_layout.addWidget(self.retry_max_delay_spinbox)
+        retry_layout.addRow("退避时间（初始 ~ 上限）:", retry_delay_layout)
+
+        self.task_deadline_spinbox = QSpinBox()
+        self.task_deadline_spinbox.setRange(0, 3600)
+        self.task_deadline_spinbox.setSuffix(" 秒")
+        self.task_deadline_spinbox.setSpecialValueText("不限制")
+        retry_layout.addRow("单个任务截止时间:", self.task_deadline_spinbox)
+
+        self.batch_deadline_spinbox = QSpinBox()
+        self.batch_deadline_spinbox.setRange(0, 86400)
+        self.batch_deadline_spinbox.setSingleStep(60)
+        self.batch_deadline_spinbox.setSuffix(" 秒")
+        self.batch_deadline_spinbox.setSpecialValueText("不限制")
+        retry_layout.addRow("整批截止时间:", self.batch_deadline_spinbox)
+        retry_hint = QLabel("超过截止时间后不再发出请求：已派发的任务记为失败，整批截止后不再派发新任务。失败和未处理的任务都可通过「恢复未完成的 LexiSage 任务」继续。")
+        retry_hint.setStyleSheet("color: gray; font-size: 11px;")
+        retry_hint.setWordWrap(True)
+        retry_layout.addRow(retry_hint)
+        perf_layout.addWidget(retry_group)
+
+        # 交互式生成：流式输出时每个字段生成完毕就立即填入，无需等待全部字段
+        editor_group = QGroupBox("交互式生成（编辑器与小批量）")
+        editor_layout = QFormLayout(editor_group)
+        self.enable_streaming_checkbox = QCheckBox("启用流式输出（逐字段填入编辑器）")
+        editor_layout.addRow(self.enable_streaming_checkbox)
+
+        # 笔记类型开启“低延迟模式”后，选中笔记数不超过该值的批量任务也按字段拆分
+        self.split_batch_spinbox = QSpinBox()
+        self.split_batch_spinbox.setRange(0, 1000)
+        editor_layout.addRow("按字段拆分的批量上限:", self.split_batch_spinbox)
+        perf_layout.addWidget(editor_group)
+
+        # 日志区域：后台线程写入 JSON Lines，超过大小后自动轮转
+        log_group = QGroupBox("日志")
+        log_layout = QFormLayout(log_group)
+        self.debug_logging_checkbox = QCheckBox("调试模式（记录成功请求的完整载荷）")
+        log_layout.addRow(self.debug_logging_checkbox)
+
+        self.log_size_spinbox = QSpinBox()
+        self.log_size_spinbox.setRange(1, 500)
+        self.log_size_spinbox.setSuffix(" MB")
+        log_layout.addRow("单个日志文件上限:", self.log_size_spinbox)
+
+        # 调试模式下成功请求的采样比例，批量任务时可降低以减少日志量
+        self.log_sample_spinbox = QSpinBox()
+        self.log_sample_spinbox.setRange(1, 100)
+        self.log_sample_spinbox.setSuffix(" %")
+        log_layout.addRow("载荷采样比例:", self.log_sample_spinbox)
+
+        self.log_truncate_spinbox = QSpinBox()
+        self.log_truncate_spinbox.setRange(200, 1000000)
+        self.log_truncate_spinbox.setSingleStep(1000)
+        log_layout.addRow("单条载荷最大字符数:", self.log_truncate_spinbox)
+        perf_layout.addWidget(log_group)
+
+        perf_layout.addStretch()
+
         # --- 底部按钮区域 ---
         btn_box = QHBoxLayout()
         btn_box.addStretch()
@@ -330,6 +562,52 @@ class ConfigDialog(QDialog):
         temperature_spinbox.setValue(0.1)
         temperature_spinbox.setDecimals(1)
         
+        # 自适应并发的上下限（仅在“性能与缓存”中启用自适应并发时生效）
+        min_concurrency_spinbox = QSpinBox()
+        min_concurrency_spinbox.setRange(1, 200)
+        max_concurrency_spinbox = QSpinBox()
+        max_concurrency_spinbox.setRange(1, 200)
+        concurrency_bounds_layout = QHBoxLayout()
+        concurrency_bounds_layout.addWidget(min_concurrency_spinbox)
+        concurrency_bounds_layout.addWidget(QLabel("~"))
+        concurrency_bounds_layout.addWidget(max_concurrency_spinbox)
+
+        # 限流额度：每分钟请求数 / 每分钟 Token 数，0 表示不限制
+        rpm_spinbox = QSpinBox()
+        rpm_spinbox.setRange(0, 100000)
+        rpm_spinbox.setSpecialValueText("不限制")
+        tpm_spinbox = QSpinBox()
+        tpm_spinbox.setRange(0, 100000000)
+        tpm_spinbox.setSingleStep(10000)
+        tpm_spinbox.setSpecialValueText("不限制")
+
+        # 单价（每百万 Token，美元），用于进度面板和报告中的费用统计；0 表示不统计
+        input_price_spinbox = QDoubleSpinBox()
+        input_price_spinbox.setRange(0.0, 1000.0)
+        input_price_spinbox.setDecimals(3)
+        input_price_spinbox.setPrefix("$")
+        output_price_spinbox = QDoubleSpinBox()
+        output_price_spinbox.setRange(0.0, 1000.0)
+        output_price_spinbox.setDecimals(3)
+        output_price_spinbox.setPrefix("$")
+        cached_price_spinbox = QDoubleSpinBox()
+        cached_price_spinbox.setRange(0.0, 1000.0)
+        cached_price_spinbox.setDecimals(3)
+        cached_price_spinbox.setPrefix("$")
+        cached_price_spinbox.setSpecialValueText("同输入")
+        price_layout = QHBoxLayout()
+        price_layout.addWidget(QLabel("输入"))
+        price_layout.addWidget(input_price_spinbox)
+        price_layout.addWidget(QLabel("输出"))
+        price_layout.addWidget(output_price_spinbox)
+        price_layout.addWidget(QLabel("缓存命中"))
+        price_layout.addWidget(cached_price_spinbox)
+
+        # 多服务负载均衡时的请求分配权重，0 表示不参与
+        weight_spinbox = QSpinBox()
+        weight_spinbox.setRange(0, 100)
+        weight_spinbox.setSpecialValueText("不参与")
+
         temperature_hint_label = QLabel("数值越低越严谨(0.1)，数值越高越随机(1.0+)")
         temperature_hint_label.setStyleSheet("color: gray; font-size: 11px; margin-top: -2px;")
         temperature_hint_label.setWordWrap(True)
@@ -339,13 +617,26 @@ class ConfigDialog(QDialog):
         form_layout.addRow("Model:", model_name_input)
         form_layout.addRow("Temperature:", temperature_spinbox)
         form_layout.addRow("", temperature_hint_label)
+        form_layout.addRow("自适应并发范围:", concurrency_bounds_layout)
+        form_layout.addRow("每分钟请求数 (RPM):", rpm_spinbox)
+        form_layout.addRow("每分钟 Token 数 (TPM):", tpm_spinbox)
+        form_layout.addRow("单价 (每百万 Token):", price_layout)
+        form_layout.addRow("负载权重:", weight_spinbox)
 
         return {
             'widget': service_widget, 
             'base_url': base_url_input, 
             'api_key': api_key_input, 
             'model': model_name_input, 
-            'temp': temperature_spinbox
+            'temp': temperature_spinbox,
+            'min_concurrency': min_concurrency_spinbox,
+            'max_concurrency': max_concurrency_spinbox,
+            'rpm': rpm_spinbox,
+            'tpm': tpm_spinbox,
+            'input_price': input_price_spinbox,
+            'output_price': output_price_spinbox,
+            'cached_price': cached_price_spinbox,
+            'weight': weight_spinbox
         }
 
     # --- Logic ---
@@ -374,6 +665,7 @@ class ConfigDialog(QDialog):
             config_obj.context_field = self.context_field_combo.currentText()
             if self.context_field_combo.currentIndex() == 0: 
                 config_obj.context_field = ""
+            config_obj.split_fields = self.split_fields_checkbox.isChecked()
 
     def on_note_config_selected(self):
         if self.active_config:
@@ -404,6 +696,7 @@ class ConfigDialog(QDialog):
             if idx >= 0: self.context_field_combo.setCurrentIndex(idx)
         else:
             self.context_field_combo.setCurrentIndex(0)
+        self.split_fields_checkbox.setChecked(new_config.split_fields)
             
         self.configured_fields_list.clear()
         self.prompt_text_edit.clear()
@@ -531,6 +824,7 @@ class ConfigDialog(QDialog):
         if svc == "xai": idx = 1
         elif svc == "deepseek": idx = 2
         self.ai_service_combo.setCurrentIndex(idx)
+        self.enable_multi_provider_checkbox.setChecked(self.config.get("enableMultiProvider", False))
         
         api_conf = self.config.get("apiConfig", {})
         oa = api_conf.get("openai", {})
@@ -538,22 +832,99 @@ class ConfigDialog(QDialog):
         self.openai_widgets['api_key'].setText(oa.get("apiKey", ""))
         self.openai_widgets['model'].setText(oa.get("model", "gpt-3.5-turbo"))
         self.openai_widgets['temp'].setValue(oa.get("temperature", 0.1))
+        self.openai_widgets['min_concurrency'].setValue(oa.get("minConcurrency", DEFAULT_CONCURRENCY_BOUNDS["openai"][0]))
+        self.openai_widgets['max_concurrency'].setValue(oa.get("maxConcurrency", DEFAULT_CONCURRENCY_BOUNDS["openai"][1]))
+        self.openai_widgets['rpm'].setValue(oa.get("rpm", 0))
+        self.openai_widgets['tpm'].setValue(oa.get("tpm", 0))
+        self.openai_widgets['input_price'].setValue(oa.get("inputPricePerMTokens", 0.0))
+        self.openai_widgets['output_price'].setValue(oa.get("outputPricePerMTokens", 0.0))
+        self.openai_widgets['cached_price'].setValue(oa.get("cachedInputPricePerMTokens", 0.0))
+        self.openai_widgets['weight'].setValue(oa.get("weight", 1 if svc == "openai" else 0))
         
         xa = api_conf.get("xai", {})
         self.xai_widgets['base_url'].setText(xa.get("baseUrl", "https://api.x.ai/v1/chat/completions"))
         self.xai_widgets['api_key'].setText(xa.get("apiKey", ""))
         self.xai_widgets['model'].setText(xa.get("model", "grok-2-latest"))
         self.xai_widgets['temp'].setValue(xa.get("temperature", 0.1))
+        self.xai_widgets['min_concurrency'].setValue(xa.get("minConcurrency", DEFAULT_CONCURRENCY_BOUNDS["xai"][0]))
+        self.xai_widgets['max_concurrency'].setValue(xa.get("maxConcurrency", DEFAULT_CONCURRENCY_BOUNDS["xai"][1]))
+        self.xai_widgets['rpm'].setValue(xa.get("rpm", 0))
+        self.xai_widgets['tpm'].setValue(xa.get("tpm", 0))
+        self.xai_widgets['input_price'].setValue(xa.get("inputPricePerMTokens", 0.0))
+        self.xai_widgets['output_price'].setValue(xa.get("outputPricePerMTokens", 0.0))
+        self.xai_widgets['cached_price'].setValue(xa.get("cachedInputPricePerMTokens", 0.0))
+        self.xai_widgets['weight'].setValue(xa.get("weight", 1 if svc == "xai" else 0))
         
         ds = api_conf.get("deepseek", {})
         self.deepseek_widgets['base_url'].setText(ds.get("baseUrl", "https://api.deepseek.com/chat/completions"))
         self.deepseek_widgets['api_key'].setText(ds.get("apiKey", ""))
         self.deepseek_widgets['model'].setText(ds.get("model", "deepseek-chat"))
         self.deepseek_widgets['temp'].setValue(ds.get("temperature", 0.1))
+        self.deepseek_widgets['min_concurrency'].setValue(ds.get("minConcurrency", DEFAULT_CONCURRENCY_BOUNDS["deepseek"][0]))
+        self.deepseek_widgets['max_concurrency'].setValue(ds.get("maxConcurrency", DEFAULT_CONCURRENCY_BOUNDS["deepseek"][1]))
+        self.deepseek_widgets['rpm'].setValue(ds.get("rpm", 0))
+        self.deepseek_widgets['tpm'].setValue(ds.get("tpm", 0))
+        self.deepseek_widgets['input_price'].setValue(ds.get("inputPricePerMTokens", 0.0))
+        self.deepseek_widgets['output_price'].setValue(ds.get("outputPricePerMTokens", 0.0))
+        self.deepseek_widgets['cached_price'].setValue(ds.get("cachedInputPricePerMTokens", 0.0))
+        self.deepseek_widgets['weight'].setValue(ds.get("weight", 1 if svc == "deepseek" else 0))
         
         self.enable_multithreading_checkbox.setChecked(self.config.get("enableMultiThreading", True))
         self.max_concurrent_spinbox.setValue(self.config.get("maxConcurrentRequests", 3))
 
+        self.enable_cache_checkbox.setChecked(self.config.get("enableResponseCache", True))
+        self.cache_size_spinbox.setValue(self.config.get("cacheMaxSizeMB", 200))
+        self.cache_age_spinbox.setValue(self.config.get("cacheMaxAgeDays", 30))
+        self.refresh_cache_stats()
+
+        engine_idx = self.engine_combo.findData(self.config.get("generationEngine", "thread"))
+        self.engine_combo.setCurrentIndex(max(0, engine_idx))
+        self.async_in_flight_spinbox.setValue(self.config.get("asyncMaxInFlight", 50))
+        self.cancel_grace_spinbox.setValue(self.config.get("cancelGraceSeconds", 5))
+        self.token_budget_spinbox.setValue(self.config.get("tokenBudget", 0))
+        self.enable_adaptive_checkbox.setChecked(self.config.get("enableAdaptiveConcurrency", False))
+        self.enable_pack_checkbox.setChecked(self.config.get("enablePackedRequests", False))
+        self.pack_size_spinbox.setValue(self.config.get("packSize", 5))
+        self.pack_budget_spinbox.setValue(self.config.get("packTokenBudget", 6000))
+        self.enable_prompt_cache_layout_checkbox.setChecked(self.config.get("enablePromptCacheLayout", False))
+        self.enable_hedging_checkbox.setChecked(self.config.get("enableHedging", False))
+        self.hedge_delay_spinbox.setValue(self.config.get("hedgeDelaySeconds", 0.0))
+        self.hedge_percentile_spinbox.setValue(self.config.get("hedgePercentile", 95))
+        self.hedge_max_percent_spinbox.setValue(self.config.get("hedgeMaxPercent", 5))
+        self.hedge_other_provider_checkbox.setChecked(self.config.get("hedgeToOtherProvider", True))
+        self.max_retries_spinbox.setValue(self.config.get("maxRetries", 2))
+        self.bad_response_retries_spinbox.setValue(self.config.get("badResponseRetries", 1))
+        self.retry_base_delay_spinbox.setValue(self.config.get("retryBaseDelaySeconds", 0.5))
+        self.retry_max_delay_spinbox.setValue(self.config.get("retryMaxDelaySeconds", 30.0))
+        self.task_deadline_spinbox.setValue(self.config.get("taskDeadlineSeconds", 0))
+        self.batch_deadline_spinbox.setValue(self.config.get("batchDeadlineSeconds", 0))
+        self.enable_streaming_checkbox.setChecked(self.config.get("enableStreaming", False))
+        self.split_batch_spinbox.setValue(self.config.get("splitMaxBatchSize", 20))
+        self.debug_logging_checkbox.setChecked(self.config.get("debugLogging", False))
+        self.log_size_spinbox.setValue(self.config.get("logMaxSizeMB", 5))
+        self.log_sample_spinbox.setValue(int(round(self.config.get("logPayloadSampleRate", 1.0) * 100)))
+        self.log_truncate_spinbox.setValue(self.config.get("logMaxPayloadChars", 4000))
+
+    def refresh_cache_stats(self):
+        try:
+            cache = get_response_cache({**self.config, "enableResponseCache": True})
+            stats = cache.stats()
+        except Exception as e:
+            self.cache_stats_label.setText(f"无法读取缓存: {e}")
+            return
+        size_mb = stats["size_bytes"] / (1024 * 1024)
+        self.cache_stats_label.setText(
+            f"{stats['entries']} 条 / {size_mb:.1f} MB（本次启动命中 {stats['hits']}，未命中 {stats['misses']}）"
+        )
+
+    def clear_response_cache(self):
+        try:
+            get_response_cache({**self.config, "enableResponseCache": True}).clear()
+            tooltip("缓存已清空")
+        except Exception as e:
+            showInfo(f"清空缓存失败: {e}")
+        self.refresh_cache_stats()
+
     def on_service_changed(self, index):
         self.service_stack.setCurrentIndex(index)
 
@@ -577,7 +948,8 @@ class ConfigDialog(QDialog):
             new_note_configs[config_obj.note_type] = {
                 "fieldToExplain": config_obj.field_to_explain,
                 "contextField": config_obj.context_field,
-                "fieldPrompts": config_obj.field_prompts
+                "fieldPrompts": config_obj.field_prompts,
+                "splitFields": config_obj.split_fields
             }
 
         self.config["noteTypeConfigs"] = new_note_configs
@@ -587,35 +959,90 @@ class ConfigDialog(QDialog):
         
         svcs = ["openai", "xai", "deepseek"]
         self.config["aiService"] = svcs[svc_idx]
+        self.config["enableMultiProvider"] = self.enable_multi_provider_checkbox.isChecked()
         self.config["apiConfig"] = {
             "openai": {
                 "baseUrl": self.openai_widgets['base_url'].text(),
                 "apiKey": self.openai_widgets['api_key'].text(),
                 "model": self.openai_widgets['model'].text(),
-                "temperature": self.openai_widgets['temp'].value()
+                "temperature": self.openai_widgets['temp'].value(),
+                "minConcurrency": self.openai_widgets['min_concurrency'].value(),
+                "maxConcurrency": max(self.openai_widgets['min_concurrency'].value(), self.openai_widgets['max_concurrency'].value()),
+                "rpm": self.openai_widgets['rpm'].value(),
+                "tpm": self.openai_widgets['tpm'].value(),
+                "inputPricePerMTokens": self.openai_widgets['input_price'].value(),
+                "outputPricePerMTokens": self.openai_widgets['output_price'].value(),
+                "cachedInputPricePerMTokens": self.openai_widgets['cached_price'].value(),
+                "weight": self.openai_widgets['weight'].value()
             },
             "xai": {
                 "baseUrl": self.xai_widgets['base_url'].text(),
                 "apiKey": self.xai_widgets['api_key'].text(),
                 "model": self.xai_widgets['model'].text(),
-                "temperature": self.xai_widgets['temp'].value()
+                "temperature": self.xai_widgets['temp'].value(),
+                "minConcurrency": self.xai_widgets['min_concurrency'].value(),
+                "maxConcurrency": max(self.xai_widgets['min_concurrency'].value(), self.xai_widgets['max_concurrency'].value()),
+                "rpm": self.xai_widgets['rpm'].value(),
+                "tpm": self.xai_widgets['tpm'].value(),
+                "inputPricePerMTokens": self.xai_widgets['input_price'].value(),
+                "outputPricePerMTokens": self.xai_widgets['output_price'].value(),
+                "cachedInputPricePerMTokens": self.xai_widgets['cached_price'].value(),
+                "weight": self.xai_widgets['weight'].value()
             },
             "deepseek": {
                 "baseUrl": self.deepseek_widgets['base_url'].text(),
                 "apiKey": self.deepseek_widgets['api_key'].text(),
                 "model": self.deepseek_widgets['model'].text(),
-                "temperature": self.deepseek_widgets['temp'].value()
+                "temperature": self.deepseek_widgets['temp'].value(),
+                "minConcurrency": self.deepseek_widgets['min_concurrency'].value(),
+                "maxConcurrency": max(self.deepseek_widgets['min_concurrency'].value(), self.deepseek_widgets['max_concurrency'].value()),
+                "rpm": self.deepseek_widgets['rpm'].value(),
+                "tpm": self.deepseek_widgets['tpm'].value(),
+                "inputPricePerMTokens": self.deepseek_widgets['input_price'].value(),
+                "outputPricePerMTokens": self.deepseek_widgets['output_price'].value(),
+                "cachedInputPricePerMTokens": self.deepseek_widgets['cached_price'].value(),
+                "weight": self.deepseek_widgets['weight'].value()
             }
         }
         self.enable_multithreading_checkbox.setChecked(self.config.get("enableMultiThreading", True)) # Wait, this line is wrong order in original too but logic is fine, fix below
         self.config["enableMultiThreading"] = self.enable_multithreading_checkbox.isChecked()
         self.config["maxConcurrentRequests"] = self.max_concurrent_spinbox.value()
+        self.config["enableResponseCache"] = self.enable_cache_checkbox.isChecked()
+        self.config["cacheMaxSizeMB"] = self.cache_size_spinbox.value()
+        self.config["cacheMaxAgeDays"] = self.cache_age_spinbox.value()
+        self.config["generationEngine"] = self.engine_combo.currentData()
+        self.config["asyncMaxInFlight"] = self.async_in_flight_spinbox.value()
+        self.config["cancelGraceSeconds"] = self.cancel_grace_spinbox.value()
+        self.config["tokenBudget"] = self.token_budget_spinbox.value()
+        self.config["enableAdaptiveConcurrency"] = self.enable_adaptive_checkbox.isChecked()
+        self.config["enablePackedRequests"] = self.enable_pack_checkbox.isChecked()
+        self.config["packSize"] = self.pack_size_spinbox.value()
+        self.config["packTokenBudget"] = self.pack_budget_spinbox.value()
+        self.config["enablePromptCacheLayout"] = self.enable_prompt_cache_layout_checkbox.isChecked()
+        self.config["enableHedging"] = self.enable_hedging_checkbox.isChecked()
+        self.config["hedgeDelaySeconds"] = self.hedge_delay_spinbox.value()
+        self.config["hedgePercentile"] = self.hedge_percentile_spinbox.value()
+        self.config["hedgeMaxPercent"] = self.hedge_max_percent_spinbox.value()
+        self.config["hedgeToOtherProvider"] = self.hedge_other_provider_checkbox.isChecked()
+        self.config["maxRetries"] = self.max_retries_spinbox.value()
+        self.config["badResponseRetries"] = self.bad_response_retries_spinbox.value()
+        self.config["retryBaseDelaySeconds"] = self.retry_base_delay_spinbox.value()
+        self.config["retryMaxDelaySeconds"] = max(self.retry_base_delay_spinbox.value(), self.retry_max_delay_spinbox.value())
+        self.config["taskDeadlineSeconds"] = self.task_deadline_spinbox.value()
+        self.config["batchDeadlineSeconds"] = self.batch_deadline_spinbox.value()
+        self.config["enableStreaming"] = self.enable_streaming_checkbox.isChecked()
+        self.config["splitMaxBatchSize"] = self.split_batch_spinbox.value()
+        self.config["debugLogging"] = self.debug_logging_checkbox.isChecked()
+        self.config["logMaxSizeMB"] = self.log_size_spinbox.value()
+        self.config["logPayloadSampleRate"] = self.log_sample_spinbox.value() / 100.0
+        self.config["logMaxPayloadChars"] = self.log_truncate_spinbox.value()
 
         for key in ["selectedNoteType", "destinationField", "fieldToExplain", "contextField", 
                     "noContextSystemPrompt", "withContextSystemPrompt", "systemPrompt"]:
             if key in self.config: del self.config[key]
 
         if self.save_config_to_disk():
+            configure_logging(self.config)
             tooltip("配置已保存")
 
     def preview_final_payload(self):
@@ -667,11 +1094,9 @@ class ConfigDialog(QDialog):
         self.show_preview_dialog("AI 发送载荷预览 (Payload Preview)", display_text)
 
     def open_log_file(self):
-        log_path = os.path.join(self.addon_dir, "lexisage.log")
-        if not os.path.exists(log_path):
-            with open(log_path, 'w', encoding='utf-8') as f:
-                f.write("=== LexiSage Log Created ===\n")
-        url = QUrl.fromLocalFile(log_path)
+        if not os.path.exists(LOG_PATH):
+            open(LOG_PATH, 'a', encoding='utf-8').close()
+        url = QUrl.fromLocalFile(LOG_PATH)
         QDesktopServices.openUrl(url)
 
     def show_preview_dialog(self, window_title, text_content):
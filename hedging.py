@@ -0,0 +1,90 @@
+import math
+from collections import deque
+from threading import Lock
+
+# --- 对冲请求：请求耗时超过近期延迟分位数时再发一份相同请求，取先完成的结果，削减长尾 ---
+
+# 每个服务保留最近多少次成功请求的耗时，用于学习对冲阈值
+HEDGE_SAMPLE_WINDOW = 200
+# 样本不足时不学习阈值（未配置固定阈值则暂不对冲），避免冷启动阶段按噪声触发
+HEDGE_MIN_SAMPLES = 20
+# 对冲比例按最近多少次请求统计
+HEDGE_RATE_WINDOW = 200
+# 学习到的阈值下限：过低的阈值会让正常请求也被对冲
+MIN_HEDGE_DELAY_SECONDS = 1.0
+# 同时在途的对冲请求上限（含已落败、仍在等待响应的请求）：服务整体变慢时额外请求数有固定上限
+HEDGE_MAX_IN_FLIGHT = 4
+
+
+class HedgePolicy:
+    """
+    决定何时对冲：阈值为固定的 hedgeDelaySeconds，为 0 时取该服务最近成功请求耗时的 hedgePercentile 分位数；
+    最近 HEDGE_RATE_WINDOW 次请求中被对冲的比例不超过 hedgeMaxPercent，且同时在途的对冲请求不超过
+    HEDGE_MAX_IN_FLIGHT，防止服务整体变慢时请求量翻倍。
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.samples = {}  # 服务 -> deque(耗时)
+        self.recent = deque(maxlen=HEDGE_RATE_WINDOW)  # 最近请求是否被对冲
+        self.hedged_recent = 0
+        self.in_flight = 0
+        self.fixed_delay = 0.0
+        self.percentile = 95
+        self.max_rate = 0.05
+        self.other_provider = True
+
+    def configure(self, config):
+        with self.lock:
+            self.fixed_delay = config.get("hedgeDelaySeconds", 0.0)
+            self.percentile = config.get("hedgePercentile", 95)
+            self.max_rate = config.get("hedgeMaxPercent", 5) / 100
+            self.other_provider = config.get("hedgeToOtherProvider", True)
+
+    def delay(self, service):
+        """返回该服务的对冲阈值（秒）；无法确定阈值时返回 None，不对冲"""
+        with self.lock:
+            if self.fixed_delay > 0: return self.fixed_delay
+            samples = self.samples.get(service)
+            if not samples or len(samples) < HEDGE_MIN_SAMPLES: return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(math.ceil(self.percentile / 100 * len(ordered))) - 1)
+        return max(MIN_HEDGE_DELAY_SECONDS, ordered[index])
+
+    def observe(self, service, seconds):
+        with self.lock:
+            samples = self.samples.get(service)
+            if samples is None:
+                samples = self.samples[service] = deque(maxlen=HEDGE_SAMPLE_WINDOW)
+            samples.append(seconds)
+
+    def try_start(self):
+        """超过阈值时调用：在对冲比例和在途数量上限内占用一个名额并返回 True；对冲请求结束后调用 finish()"""
+        with self.lock:
+            if self.in_flight >= HEDGE_MAX_IN_FLIGHT: return False
+            if self.hedged_recent >= self.max_rate * max(len(self.recent), HEDGE_MIN_SAMPLES): return False
+            self.in_flight += 1
+            return True
+
+    def finish(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def record(self, hedged):
+        """每次请求结束后记录是否对冲，用于比例上限的滑动窗口"""
+        with self.lock:
+            if len(self.recent) == self.recent.maxlen and self.recent[0]:
+                self.hedged_recent -= 1
+            self.recent.append(hedged)
+            if hedged: self.hedged_recent += 1
+
+
+_policy = HedgePolicy()
+
+
+def get_hedge_policy(config):
+    """返回共享的对冲策略；未启用对冲时返回 None"""
+    if not config.get("enableHedging", False):
+        return None
+    _policy.configure(config)
+    return _policy
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+from threading import Lock
+
+from .paths import user_files_dir
+from .ai_service import ExplanationTask
+
+# --- 任务日志：批量任务的追加式持久化记录，崩溃或取消后可以从断点恢复 ---
+
+JOBS_DIRNAME = "jobs"
+JOURNAL_SUFFIX = ".jsonl"
+# 每写入多少条结果强制落盘一次；每条记录都会 flush，进程崩溃时不会丢失
+FSYNC_EVERY_N_RECORDS = 50
+
+
+def _jobs_dir():
+    path = os.path.join(user_files_dir(), JOBS_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _task_spec(task):
+    return {
+        "nid": task.note_id,
+        "dup": list(task.duplicate_note_ids),
+        "word": task.word,
+        "context": task.context,
+        "fields": task.field_prompts_map,
+        "use_cache": task.use_cache,
+        "split": task.split_fields,
+    }
+
+
+class JobJournal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.records_since_sync = 0
+        self.file = open(path, "a", encoding="utf-8")
+
+    @classmethod
+    def create(cls, tasks=(), description=""):
+        """
+        为一批任务新建日志，首行写入已知的任务描述，用于恢复时重建未完成的任务。
+        边扫描边生成的任务随后通过 record_task / record_duplicate 追加。
+        """
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        journal = cls(os.path.join(_jobs_dir(), job_id + JOURNAL_SUFFIX))
+        journal._append({
+            "type": "header",
+            "job_id": job_id,
+            "created": time.time(),
+            "description": description,
+            "tasks": [_task_spec(task) for task in tasks],
+        }, sync=True)
+        return journal
+
+    @property
+    def job_id(self):
+        return os.path.basename(self.path)[:-len(JOURNAL_SUFFIX)]
+
+    def _append(self, record, sync=False):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            if self.file is None: return
+            self.file.write(line)
+            self.file.flush()
+            self.records_since_sync += 1
+            if sync or self.records_since_sync >= FSYNC_EVERY_N_RECORDS:
+                os.fsync(self.file.fileno())
+                self.records_since_sync = 0
+
+    def record_task(self, task):
+        """追加一个在建日志之后才生成的任务"""
+        self._append({"type": "task", **_task_spec(task)})
+
+    def record_duplicate(self, note_id, duplicate_note_id):
+        """追加一条去重关系：duplicate_note_id 共享 note_id 任务的结果"""
+        self._append({"type": "dup", "nid": note_id, "dup": duplicate_note_id})
+
+    def record_result(self, task):
+        """每完成一个任务追加一条记录（含结果和 Token），已付费的结果不会因崩溃丢失"""
+        self._append({
+            "type": "result",
+            "nid": task.note_id,
+            "success": task.success,
+            "results": task.results_map,
+            "tokens": task.tokens,
+            "cache_hit": task.cache_hit,
+            "source": task.source,
+            "error": task.error,
+        })
+
+    def mark_saved(self, note_ids):
+        """记录已写入集合的任务（按主笔记 ID），恢复时这些任务不再处理"""
+        if not note_ids: return
+        self._append({"type": "saved", "nids": list(note_ids)}, sync=True)
+
+    def close(self):
+        with self.lock:
+            if self.file is None: return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+    def complete(self):
+        """结果已全部写入集合后删除日志"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def load_job(path):
+    """
+    读取日志，返回 (header, 已完成结果 nid -> record, 已写入集合的 nid 集合)。
+    追加的任务与去重记录会合并进 header["tasks"]；文件末尾写了一半的记录会被忽略。
+    """
+    header = None
+    finished = {}
+    saved = set()
+    specs = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("type") == "header":
+                header = record
+                specs = {spec["nid"]: spec for spec in header["tasks"]}
+            elif header is None:
+                continue
+            elif record.get("type") == "task":
+                spec = {key: value for key, value in record.items() if key != "type"}
+                header["tasks"].append(spec)
+                specs[spec["nid"]] = spec
+            elif record.get("type") == "dup" and record.get("nid") in specs:
+                specs[record["nid"]]["dup"].append(record["dup"])
+            elif record.get("type") == "result" and record.get("success") and record.get("results"):
+                # 失败或没有任何结果的记录不算完成，恢复时重新请求
+                finished[record["nid"]] = record
+            elif record.get("type") == "saved":
+                saved.update(record.get("nids", []))
+    return header, finished, saved
+
+
+def restore_tasks(path):
+    """
+    从日志重建任务，返回 (已完成待写入的任务, 需要重新请求的任务)；已写入集合的任务跳过。
+    """
+    header, finished, saved = load_job(path)
+    pending_tasks, finished_tasks = [], []
+    if header is None: return finished_tasks, pending_tasks
+    for spec in header["tasks"]:
+        if spec["nid"] in saved: continue
+        task = ExplanationTask(
+            note_id=spec["nid"],
+            word=spec["word"],
+            context=spec["context"],
+            field_prompts_map=spec["fields"],
+            use_cache=spec.get("use_cache", True),
+            split_fields=spec.get("split", False)
+        )
+        task.duplicate_note_ids = list(spec.get("dup", []))
+        record = finished.get(spec["nid"])
+        if record:
+            task.results_map = record["results"]
+            task.tokens = record.get("tokens", 0)
+            task.cache_hit = record.get("cache_hit", False)
+            task.source = record.get("source")
+            task.success = True
+            finished_tasks.append(task)
+        else:
+            pending_tasks.append(task)
+    return finished_tasks, pending_tasks
+
+
+def list_unfinished_jobs():
+    """返回所有未完成任务：[(path, header, 已完成数)]，按创建时间从新到旧排列"""
+    jobs = []
+    for name in os.listdir(_jobs_dir()):
+        if not name.endswith(JOURNAL_SUFFIX): continue
+        path = os.path.join(_jobs_dir(), name)
+        try:
+            header, finished, _ = load_job(path)
+        except OSError:
+            continue
+        if header is None: continue
+        jobs.append((path, header, len(finished)))
+    jobs.sort(key=lambda job: job[1].get("created", 0), reverse=True)
+    return jobs
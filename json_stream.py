@@ -0,0 +1,61 @@
+import json
+
+# --- 增量 JSON 解析：流式响应中每个顶层字段的值一完整就立即返回，不必等待整个对象 ---
+
+
+class IncrementalJsonParser:
+    """
+    逐块喂入 AI 流式返回的文本，feed() 返回本次新完成的顶层字段 [(key, value), ...]。
+    对象开始之前的内容（如 ```json 代码块标记）会被忽略；对象结束后的内容不再解析。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0             # 下次从这里继续扫描，已扫描的内容不再重复处理
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.member_start = None # 当前顶层成员（"key": value）在 buffer 中的起始位置
+        self.done = False
+
+    def feed(self, text):
+        self.buffer += text
+        fields = []
+        buffer = self.buffer
+        i = self.pos
+        while i < len(buffer) and not self.done:
+            ch = buffer[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif self.depth == 0:
+                if ch == "{": self.depth = 1
+            elif ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self.member_start is None:
+                    self.member_start = i
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._emit(i, fields)
+                    self.done = True
+            elif ch == "," and self.depth == 1:
+                self._emit(i, fields)
+            i += 1
+        self.pos = i
+        return fields
+
+    def _emit(self, end, fields):
+        if self.member_start is None: return
+        try:
+            member = json.loads("{" + self.buffer[self.member_start:end] + "}")
+        except json.JSONDecodeError:
+            member = {}
+        self.member_start = None
+        fields.extend(member.items())
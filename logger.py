@@ -0,0 +1,119 @@
+import os
+import json
+import atexit
+import random
+import logging
+import datetime
+from queue import SimpleQueue
+from threading import Lock
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# --- 后台日志：请求线程只把记录放入队列，由独立线程写成 JSON Lines 并按大小轮转 ---
+
+LOG_FILENAME = "lexisage.log"
+LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), LOG_FILENAME)
+
+_logger = logging.getLogger("lexisage")
+_logger.propagate = False
+
+_state_lock = Lock()
+_state = {
+    "listener": None,
+    "max_bytes": None,
+    "backup_count": None,
+    "sample_rate": 1.0,
+    "max_payload_chars": 4000,
+}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """在日志线程中完成序列化与截断，请求线程不承担这部分开销"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            "level": record.levelname,
+            "event": record.getMessage(),
+        }
+        max_chars = _state["max_payload_chars"]
+        for key, value in getattr(record, "fields", {}).items():
+            if key in ("payload", "response") and value is not None:
+                text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+                if max_chars and len(text) > max_chars:
+                    text = text[:max_chars] + f"...(truncated {len(text) - max_chars} chars)"
+                value = text
+            entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(config):
+    """按配置（调试开关、轮转大小、采样率、截断长度）启动或调整后台日志线程"""
+    max_bytes = int(config.get("logMaxSizeMB", 5) * 1024 * 1024)
+    backup_count = config.get("logBackupCount", 3)
+    with _state_lock:
+        _logger.setLevel(logging.DEBUG if config.get("debugLogging", False) else logging.INFO)
+        _state["sample_rate"] = config.get("logPayloadSampleRate", 1.0)
+        _state["max_payload_chars"] = config.get("logMaxPayloadChars", 4000)
+        if _state["listener"] and (_state["max_bytes"], _state["backup_count"]) == (max_bytes, backup_count):
+            return
+        _stop_listener()
+        file_handler = RotatingFileHandler(LOG_PATH, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        file_handler.setFormatter(JsonLinesFormatter())
+        queue = SimpleQueue()
+        _logger.addHandler(QueueHandler(queue))
+        listener = QueueListener(queue, file_handler, respect_handler_level=False)
+        listener.start()
+        _state.update(listener=listener, max_bytes=max_bytes, backup_count=backup_count)
+
+
+def _stop_listener():
+    listener = _state["listener"]
+    for handler in list(_logger.handlers):
+        _logger.removeHandler(handler)
+    if listener:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    _state["listener"] = None
+
+
+def shutdown_logging():
+    with _state_lock:
+        _stop_listener()
+
+
+atexit.register(shutdown_logging)
+
+
+def _ensure_started():
+    if _state["listener"] is None:
+        configure_logging({})
+
+
+def debug_enabled():
+    """调用方可在构造大块日志内容前先判断，避免在请求路径上做无用功"""
+    _ensure_started()
+    return _logger.isEnabledFor(logging.DEBUG)
+
+
+def log_event(level, event, **fields):
+    """记录一条结构化事件；level 为 logging.DEBUG / INFO / WARNING / ERROR"""
+    _ensure_started()
+    if not _logger.isEnabledFor(level): return
+    _logger.log(level, event, extra={"fields": fields})
+
+
+def log_request(service_name, url, request_payload, response_content=None, error_msg=None):
+    """
+    记录一次 API 请求。
+    失败请求总是以 WARNING 记录完整上下文；成功请求只在调试模式下按采样率记录载荷。
+    """
+    _ensure_started()
+    if error_msg:
+        log_event(logging.WARNING, "request_failed", service=service_name, url=url,
+                  error=error_msg, payload=request_payload, response=response_content)
+        return
+    if not _logger.isEnabledFor(logging.DEBUG): return
+    if random.random() >= _state["sample_rate"]: return
+    log_event(logging.DEBUG, "request_ok", service=service_name, url=url,
+              payload=request_payload, response=response_content)
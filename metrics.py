@@ -0,0 +1,234 @@
+import os
+import json
+import math
+import time
+import datetime
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+from .paths import user_files_dir
+from .retry_policy import ERROR_LABELS
+
+# --- 运行指标：按阶段和服务商统计耗时、重试与吞吐，用于批量报告和并发调优 ---
+
+METRICS_DIRNAME = "metrics"
+
+# 当前运行的指标对象；未激活时所有记录调用直接返回，编辑器单卡生成等场景没有额外开销。
+# 线程池提交任务时需用 contextvars.copy_context().run 传递到工作线程，asyncio 任务会自动继承。
+_current = ContextVar("lexisage_metrics", default=None)
+
+
+class LatencyHistogram:
+    """对数分桶直方图：内存占用固定，不随样本数增长，百分位误差约 5%"""
+    MIN_SECONDS = 0.0005
+    GROWTH = 1.1
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds <= self.MIN_SECONDS:
+            index = 0
+        else:
+            index = int(math.log(seconds / self.MIN_SECONDS, self.GROWTH)) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        if not self.count: return 0.0
+        target = q * self.count
+        running = 0
+        for index in sorted(self.buckets):
+            running += self.buckets[index]
+            if running >= target:
+                return min(self.MIN_SECONDS * self.GROWTH ** index, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class RunMetrics:
+    """一次批量运行的指标；多个线程共享同一对象，所有修改在锁内完成"""
+
+    def __init__(self, description=""):
+        self.description = description
+        self.created = time.time()
+        self.lock = Lock()
+        self.phases = {}      # 阶段 -> LatencyHistogram
+        self.providers = {}   # 服务商 -> {"latency": LatencyHistogram, 计数器...}
+        self.counters = {}
+        self.run_started = None
+        self.run_finished = None
+
+    def mark_started(self):
+        """生成开始的时刻（用于吞吐计算，不包含确认弹窗的等待时间）"""
+        with self.lock:
+            if self.run_started is None: self.run_started = time.monotonic()
+
+    def mark_finished(self):
+        with self.lock:
+            self.run_finished = time.monotonic()
+
+    def observe(self, phase, seconds, provider=None):
+        with self.lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = LatencyHistogram()
+            histogram.add(seconds)
+            if provider is not None:
+                self._provider(provider)["latency"].add(seconds)
+
+    def incr(self, name, amount=1, provider=None):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            if provider is not None:
+                stats = self._provider(provider)
+                stats[name] = stats.get(name, 0) + amount
+
+    def _provider(self, provider):
+        stats = self.providers.get(provider)
+        if stats is None:
+            stats = self.providers[provider] = {"latency": LatencyHistogram()}
+        return stats
+
+    def elapsed(self):
+        if self.run_started is None: return 0.0
+        return (self.run_finished or time.monotonic()) - self.run_started
+
+    def snapshot(self):
+        """进度面板定时轮询用：只复制计数器，不计算分位数"""
+        with self.lock:
+            return self.elapsed(), dict(self.counters)
+
+    def summary(self):
+        with self.lock:
+            elapsed = self.elapsed()
+            notes = self.counters.get("notes", 0)
+            tokens = self.counters.get("tokens", 0)
+            return {
+                "description": self.description,
+                "created": datetime.datetime.fromtimestamp(self.created).isoformat(timespec="seconds"),
+                "elapsed_seconds": elapsed,
+                "notes": notes,
+                "tokens": tokens,
+                "notes_per_second": notes / elapsed if elapsed else 0.0,
+                "tokens_per_second": tokens / elapsed if elapsed else 0.0,
+                "counters": dict(self.counters),
+                "phases": {name: histogram.summary() for name, histogram in self.phases.items()},
+                "providers": {
+                    name: {key: (value.summary() if key == "latency" else value) for key, value in stats.items()}
+                    for name, stats in self.providers.items()
+                },
+            }
+
+    def export(self, name):
+        """把指标写入 user_files/metrics/<name>.json，返回文件路径"""
+        path = os.path.join(user_files_dir(), METRICS_DIRNAME)
+        os.makedirs(path, exist_ok=True)
+        path = os.path.join(path, name + ".json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        return path
+
+
+def activate(metrics):
+    """在当前线程（或协程）中激活指标对象，返回用于 deactivate 的令牌"""
+    return _current.set(metrics)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def current_metrics():
+    return _current.get()
+
+
+def observe(phase, seconds, provider=None):
+    metrics = _current.get()
+    if metrics is not None: metrics.observe(phase, seconds, provider)
+
+
+def incr(name, amount=1, provider=None):
+    metrics = _current.get()
+    if metrics is not None: metrics.incr(name, amount, provider)
+
+
+@contextmanager
+def timed(phase, provider=None):
+    """统计一段代码的耗时；未激活指标时只多一次 ContextVar 读取"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(phase, time.perf_counter() - started, provider)
+
+
+PHASE_LABELS = {
+    "prescan": "预扫描（每块）",
+    "queue_wait": "排队等待",
+    "throttle_wait": "限流/并发等待",
+    "prompt_build": "构建提示词",
+    "network": "网络请求",
+    "parse": "JSON 解析",
+    "db_write": "写入集合（每批）",
+}
+
+
+def format_report_html(summary):
+    """把 summary() 的结果整理成批量报告中的 HTML 片段"""
+    def ms(seconds):
+        return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+    lines = [
+        f"<li>耗时: {summary['elapsed_seconds']:.1f}s，吞吐: {summary['notes_per_second']:.2f} 笔记/秒，"
+        f"{summary['tokens_per_second']:.0f} Tokens/秒</li>"
+    ]
+    prompt_tokens = summary["counters"].get("prompt_tokens", 0)
+    cached_tokens = summary["counters"].get("cached_tokens", 0)
+    if cached_tokens:
+        lines.append(f"<li>前缀缓存命中: {cached_tokens} / {prompt_tokens} 输入 Tokens（{cached_tokens / prompt_tokens:.0%}）</li>")
+    cost = summary["counters"].get("cost", 0)
+    if cost:
+        lines.append(f"<li>费用: ${cost:.4f}（输入 {summary['counters'].get('prompt_tokens', 0)} / 输出 {summary['counters'].get('completion_tokens', 0)} Tokens）</li>")
+    counters = summary["counters"]
+    error_items = [
+        f"{label} {counters[f'errors_{category}']}（重试 {counters.get(f'retries_{category}', 0)}）"
+        for category, label in ERROR_LABELS.items() if counters.get(f"errors_{category}")
+    ]
+    if error_items:
+        lines.append(f"<li>错误分类: {'，'.join(error_items)}</li>")
+    if counters.get("deadline_exceeded"):
+        lines.append(f"<li>因截止时间未发出的请求: {counters['deadline_exceeded']}</li>")
+    hedges = summary["counters"].get("hedges", 0)
+    if hedges:
+        lines.append(f"<li>对冲请求: {hedges} 次，其中 {summary['counters'].get('hedge_wins', 0)} 次先于原请求完成</li>")
+    for name, stats in summary["providers"].items():
+        latency = stats["latency"]
+        lines.append(
+            f"<li>{name} 请求延迟 p50/p95/p99: {ms(latency['p50'])} / {ms(latency['p95'])} / {ms(latency['p99'])}"
+            f"（请求 {latency['count']}，重试 {stats.get('retries', 0)}，失败 {stats.get('errors', 0)}"
+            + (f"，切换到其他服务 {stats['failovers']} 次" if stats.get("failovers") else "") + "）</li>"
+        )
+    for name, stats in summary["phases"].items():
+        lines.append(f"<li>{PHASE_LABELS.get(name, name)}: p50 {ms(stats['p50'])}，p95 {ms(stats['p95'])}（{stats['count']} 次）</li>")
+    return "<ul>" + "".join(lines) + "</ul>"
+
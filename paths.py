@@ -0,0 +1,11 @@
+import os
+
+# --- 数据目录：缓存、任务日志和运行指标共用的 user_files 目录 ---
+
+# Anki 升级插件时会保留 user_files 目录，放在这里的数据不会因更新而丢失
+USER_FILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_files")
+
+
+def user_files_dir():
+    os.makedirs(USER_FILES_PATH, exist_ok=True)
+    return USER_FILES_PATH
@@ -0,0 +1,104 @@
+import re
+
+# --- 批量预扫描：用分块 SQL 直接读取笔记字段，替代逐条 get_note 的预检查 ---
+
+# Anki 在 notes.flds 中用 0x1f 分隔各字段
+FIELD_SEPARATOR = "\x1f"
+DEFAULT_CHUNK_SIZE = 1000
+
+# 一次匹配判断“视觉上为空”：只包含 HTML 标签、&nbsp; 和空白字符
+_VISUALLY_EMPTY_RE = re.compile(r"(?:<[^>]+>|&nbsp;|\s)*")
+
+
+def is_field_visually_empty(text):
+    """检测字段是否视觉上为空（忽略HTML标签和空格）"""
+    if not text: return True
+    return _VISUALLY_EMPTY_RE.fullmatch(text) is not None
+
+
+def new_scan_stats(total_notes):
+    return {
+        "total_notes": total_notes,
+        "scanned_notes": 0,           # 已扫描笔记数（后台扫描时用于显示进度）
+        "total_configured_fields": 0, # 总共涉及的配置字段数 (Update + Skip)
+        "ready_to_update": 0,         # 当前为空，准备写入
+        "skipped_not_empty": 0,       # 当前非空，默认跳过
+        "skipped_not_configured": 0   # 笔记类型未配置
+    }
+
+
+def _build_scan_plan(model, note_type_configs):
+    """每个笔记类型只解析一次：把配置的字段名换算成 flds 中的下标；未配置时返回 None"""
+    if not model or model["name"] not in note_type_configs:
+        return None
+    conf = note_type_configs[model["name"]]
+    field_index = {f["name"]: f["ord"] for f in model["flds"]}
+    src = conf.get("fieldToExplain")
+    ctx_field = conf.get("contextField")
+    return {
+        "split": conf.get("splitFields", False),
+        "src": field_index.get(src) if src else None,
+        "ctx": field_index.get(ctx_field) if ctx_field else None,
+        "targets": [
+            (field, field_index[field], prompt)
+            for field, prompt in conf.get("fieldPrompts", {}).items()
+            if field in field_index
+        ],
+    }
+
+
+def chunk_note_ids(items, size=DEFAULT_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def scan_notes_chunk(col, nids, note_type_configs, plans, stats):
+    """
+    扫描一块笔记：一次 SQL 读出 id/mid/flds，并在同一轮循环中完成空/非空分类。
+    plans 为跨块复用的笔记类型缓存（mid -> plan），stats 原地累加；返回本块的预扫描条目。
+    """
+    ids_sql = "(" + ",".join(str(int(nid)) for nid in nids) + ")"
+    rows = {nid: (mid, flds) for nid, mid, flds in col.db.all(f"select id, mid, flds from notes where id in {ids_sql}")}
+
+    pre_scan_data = []
+    stats["scanned_notes"] += len(nids)
+    for nid in nids:
+        row = rows.get(nid)
+        if row is None: continue
+        mid, flds = row
+        if mid not in plans:
+            plans[mid] = _build_scan_plan(col.models.get(mid), note_type_configs)
+        plan = plans[mid]
+        if plan is None:
+            stats["skipped_not_configured"] += 1
+            continue
+
+        values = flds.split(FIELD_SEPARATOR)
+        # 检查源字段
+        if plan["src"] is None or is_field_visually_empty(values[plan["src"]]):
+            continue
+
+        # 分类目标字段
+        empty_fields_map = {}      # 准备更新 (空)
+        non_empty_fields_map = {}  # 准备跳过 (非空)
+        for target_field, index, prompt_tmpl in plan["targets"]:
+            stats["total_configured_fields"] += 1
+            if is_field_visually_empty(values[index]):
+                empty_fields_map[target_field] = prompt_tmpl
+                stats["ready_to_update"] += 1
+            else:
+                non_empty_fields_map[target_field] = prompt_tmpl
+                stats["skipped_not_empty"] += 1
+
+        # 只有当该笔记至少有一个配置的目标字段（无论空或非空）时，才记录
+        if empty_fields_map or non_empty_fields_map:
+            pre_scan_data.append({
+                "nid": nid,
+                "word": values[plan["src"]],
+                "context": values[plan["ctx"]] if plan["ctx"] is not None else "",
+                "empty_map": empty_fields_map,
+                "non_empty_map": non_empty_fields_map,
+                "split": plan["split"]
+            })
+    return pre_scan_data
+
@@ -0,0 +1,135 @@
+from collections import deque
+
+from aqt.qt import *
+
+from .token_estimator import token_prices
+
+# --- 批量进度面板：定时轮询 Worker 与运行指标，显示吞吐、费用、错误率、并发和预计剩余时间 ---
+
+# 刷新间隔：进度不再逐任务通过信号推送到主线程，界面更新次数与任务数无关
+REFRESH_INTERVAL_MS = 500
+# 速率按最近一段时间的滑动窗口计算，反映当前速度而不是整体平均
+RATE_WINDOW_SECONDS = 10
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60: return f"{seconds}s"
+    if seconds < 3600: return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+class BatchProgressDialog(QDialog):
+    """
+    批量生成的进度面板。数据全部来自 Worker.progress 和 RunMetrics.snapshot()，
+    由 QTimer 在主线程轮询，工作线程不需要为界面做任何事情。
+    """
+    canceled = pyqtSignal()
+
+    def __init__(self, worker, metrics, config, parent=None):
+        super().__init__(parent)
+        self.worker = worker
+        self.metrics = metrics
+        self.has_pricing = any(token_prices(config["apiConfig"].get(config.get("aiService", "openai"), {})))
+        self.samples = deque()  # (elapsed, requests, tokens, notes)
+        self.done = False
+
+        self.setWindowTitle("LexiSage 执行中")
+        self.setMinimumWidth(420)
+        layout = QVBoxLayout(self)
+
+        self.status_label = QLabel("启动引擎...")
+        self.status_label.setWordWrap(True)
+        layout.addWidget(self.status_label)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        layout.addWidget(self.progress_bar)
+
+        form_layout = QFormLayout()
+        self.value_labels = {}
+        for key, title in (
+            ("eta", "预计剩余:"),
+            ("rps", "请求速率:"),
+            ("tps", "Token 速率:"),
+            ("cost", "已用 Token / 费用:"),
+            ("errors", "错误率 / 重试率:"),
+            ("concurrency", "当前并发:"),
+        ):
+            label = QLabel("-")
+            form_layout.addRow(title, label)
+            self.value_labels[key] = label
+        layout.addLayout(form_layout)
+
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        self.cancel_button = QPushButton("取消")
+        self.cancel_button.clicked.connect(self.on_cancel)
+        button_layout.addWidget(self.cancel_button)
+        layout.addLayout(button_layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(REFRESH_INTERVAL_MS)
+
+    def rates(self, elapsed, requests, tokens, notes):
+        """返回滑动窗口内的 (请求/秒, Token/秒, 笔记/秒)"""
+        self.samples.append((elapsed, requests, tokens, notes))
+        while len(self.samples) > 2 and elapsed - self.samples[1][0] >= RATE_WINDOW_SECONDS:
+            self.samples.popleft()
+        start = self.samples[0]
+        span = elapsed - start[0]
+        if span <= 0: return 0.0, 0.0, 0.0
+        return (requests - start[1]) / span, (tokens - start[2]) / span, (notes - start[3]) / span
+
+    def refresh(self):
+        completed, total, word, total_known = self.worker.progress_snapshot()
+        elapsed, counters = self.metrics.snapshot()
+        requests = counters.get("requests", 0)
+        tokens = counters.get("prompt_tokens", 0) + counters.get("completion_tokens", 0)
+        rps, tps, nps = self.rates(elapsed, requests, tokens, completed)
+
+        if total:
+            self.progress_bar.setRange(0, total)
+            self.progress_bar.setValue(completed)
+        total_text = str(total) if total_known else f"{total}+（仍在扫描）"
+        self.status_label.setText(f"处理中 ({completed}/{total_text}): {word}" if word else f"已提交 {total_text} 条任务，等待首个结果...")
+
+        labels = self.value_labels
+        if total_known and nps > 0:
+            labels["eta"].setText(format_duration((total - completed) / nps))
+        else:
+            labels["eta"].setText("-")
+        labels["rps"].setText(f"{rps:.2f} 次/秒（共 {requests} 次）")
+        labels["tps"].setText(f"{tps:.0f} Tokens/秒")
+        cost_text = f"${counters.get('cost', 0):.4f}" if self.has_pricing else "未配置单价"
+        cached_tokens = counters.get("cached_tokens", 0)
+        if cached_tokens:
+            cost_text += f"，缓存命中 {cached_tokens / max(1, counters.get('prompt_tokens', 0)):.0%}"
+        labels["cost"].setText(f"{tokens}（{cost_text}）")
+        if requests:
+            error_rate = counters.get("errors", 0) / requests
+            retry_rate = counters.get("retries", 0) / requests
+            labels["errors"].setText(f"{error_rate:.1%} / {retry_rate:.1%}")
+        in_flight = counters.get("in_flight", 0)
+        limit = self.worker.current_concurrency()
+        labels["concurrency"].setText(f"{in_flight} 个请求进行中" + (f"（自适应上限 {limit}）" if limit is not None else ""))
+
+    def on_cancel(self):
+        self.cancel_button.setEnabled(False)
+        self.canceled.emit()
+
+    def finish(self):
+        """Worker 结束后由调用方关闭面板；之后关闭窗口不再视为取消"""
+        self.done = True
+        self.timer.stop()
+        self.close()
+
+    def closeEvent(self, event):
+        # 运行中关闭窗口等同于取消，避免后台任务在没有进度界面时继续运行
+        if not self.done and self.cancel_button.isEnabled():
+            self.on_cancel()
+        super().closeEvent(event)
+
+    def reject(self):
+        # Esc 键同样走取消流程
+        self.close()
@@ -60,7 +60,47 @@ DEFAULT_FIELD_PROMPT_TEMPLATE = """【通用字段释义指令】
 """
 
 # -------------------------------------------------------------------------
-# 3. BATCH_INSTRUCTION_TEMPLATE
+# 3. PACKED_PROTOCOL_ADDENDUM
+#    【打包协议扩展】
+#    发送位置：开启“多词打包”时追加在系统提示词末尾。
+#    作用：让 AI 在一次请求中处理多条笔记，并按笔记 ID 分组返回结果。
+# -------------------------------------------------------------------------
+PACKED_PROTOCOL_ADDENDUM = """
+
+【扩展指令：多词打包协议】
+本次 User Content 可能一次包含多条笔记，格式如下：
+{
+    "notes": {
+        "笔记ID1": {"word": "...", "context": "...", "requirements": {"字段名1": "..."}},
+        "笔记ID2": {"word": "...", "context": "...", "requirements": {"字段名1": "..."}}
+    }
+}
+此时请对每条笔记**独立**完成生成，并返回以笔记 ID 为 Key 的 JSON 对象：
+{
+    "笔记ID1": {"字段名1": "内容..."},
+    "笔记ID2": {"字段名1": "内容..."}
+}
+**必须**为 notes 中的每一个笔记 ID 都返回结果，笔记 ID 与字段名都必须与输入严格一致，其余格式规则不变。
+"""
+
+# -------------------------------------------------------------------------
+# 4. PROMPT_CACHE_LAYOUT_ADDENDUM
+#    【前缀缓存布局扩展】
+#    发送位置：开启“缓存友好的提示词布局”时追加在系统提示词末尾，其后紧跟未代入变量的字段指令 JSON。
+#    作用：同一组字段的所有请求共享逐字节相同的前缀（系统提示词 + 字段指令），
+#          便于服务商的上下文/前缀缓存命中；每条笔记变化的 word 和 context 放在最后的 User Content 中。
+# -------------------------------------------------------------------------
+PROMPT_CACHE_LAYOUT_ADDENDUM = """
+
+【扩展指令：固定字段指令】
+本次 User Content 只包含 "word" 和 "context"（多词打包时 notes 中的每条笔记同样只包含这两项），不再包含 requirements。
+请把下面给出的字段指令当作每条笔记的 requirements：指令中的 {word} 和 {context} 指代该笔记的 word 和 context。
+返回的 JSON Key 必须与下面的字段名严格一致，其余格式规则不变。
+字段指令：
+"""
+
+# -------------------------------------------------------------------------
+# 5. BATCH_INSTRUCTION_TEMPLATE
 #    【UI 预览层】
 #    作用：仅用于在 Anki 的预览/确认窗口向用户展示“我们将如何处理这个单词”。
 #    注意：此字符串**不会**作为 Prompt 发送给 AI。
@@ -0,0 +1,157 @@
+import re
+import time
+import email.utils
+from threading import Lock
+
+# --- 限流器：按服务共享的令牌桶，同时约束每分钟请求数（RPM）和每分钟 Token 数（TPM） ---
+
+# 单次等待的上限，防止异常的 Retry-After 让任务长时间挂起
+MAX_PENALTY_SECONDS = 120.0
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds=10.0):
+        self.rate = per_minute / 60.0
+        # 桶容量只允许短时间突发，避免整分钟的额度被一次性打满后长时间空等
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """预扣 amount，允许余额为负；返回需要等待多久余额才能回到非负"""
+        self._refill(now)
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    def __init__(self, rpm=0, tpm=0):
+        self.lock = Lock()
+        self.blocked_until = 0.0
+        self.configure(rpm, tpm)
+
+    def configure(self, rpm, tpm):
+        with self.lock:
+            if getattr(self, "rpm", None) != rpm:
+                self.request_bucket = TokenBucket(rpm) if rpm else None
+            if getattr(self, "tpm", None) != tpm:
+                self.token_bucket = TokenBucket(tpm) if tpm else None
+            self.rpm, self.tpm = rpm, tpm
+
+    def reserve(self, estimated_tokens):
+        """为一次请求预约额度，返回调用方应等待的秒数（线程中 sleep，协程中 await asyncio.sleep）"""
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.request_bucket:
+                wait = max(wait, self.request_bucket.reserve(1, now))
+            if self.token_bucket:
+                wait = max(wait, self.token_bucket.reserve(estimated_tokens, now))
+            return wait
+
+    def acquire(self, estimated_tokens, cancel_event=None):
+        """线程中等待额度；cancel_event 被设置时提前结束等待，由调用方检查并放弃请求"""
+        wait = self.reserve(estimated_tokens)
+        if wait <= 0: return
+        if cancel_event is not None:
+            cancel_event.wait(wait)
+        else:
+            time.sleep(wait)
+
+    def correct(self, estimated_tokens, actual_tokens):
+        """用响应中的 usage 修正预扣的 Token 数"""
+        if not self.token_bucket or not actual_tokens: return
+        with self.lock:
+            self.token_bucket.refund(estimated_tokens - actual_tokens)
+
+    def penalize(self, delay):
+        """服务端要求退避时（429 / 额度耗尽），所有共享该限流器的请求一起暂停"""
+        delay = min(max(0.0, delay), MAX_PENALTY_SECONDS)
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+    def penalty_remaining(self):
+        """距离服务端要求的退避结束还有多少秒；多服务路由据此暂时避开被限流的服务"""
+        with self.lock:
+            return max(0.0, self.blocked_until - time.monotonic())
+
+    def update_from_headers(self, headers):
+        """读取 x-ratelimit-remaining-* / x-ratelimit-reset-*，额度耗尽时提前暂停"""
+        if not headers: return
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None: continue
+            try:
+                if int(float(remaining)) > 0: continue
+            except ValueError:
+                continue
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if reset: self.penalize(reset)
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def parse_duration(value):
+    """解析 OpenAI 风格的时长（如 "1s"、"6m0s"、"20ms"）或纯秒数"""
+    if not value: return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts: return None
+    scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def retry_after_seconds(headers):
+    """解析 retry-after-ms 或 Retry-After（秒数或 HTTP 日期）；没有相关头时返回 None"""
+    if not headers: return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000.0)
+        except ValueError:
+            pass
+    value = headers.get("Retry-After")
+    if not value: return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_limiters = {}
+_limiters_lock = Lock()
+
+
+def get_rate_limiter(service, config):
+    """
+    返回该服务共享的限流器。
+    apiConfig 中 rpm/tpm 为 0 表示不限制，但限流器仍会在所有请求间共享 Retry-After 退避。
+    """
+    api_config = config.get("apiConfig", {}).get(service, {})
+    rpm = int(api_config.get("rpm", 0) or 0)
+    tpm = int(api_config.get("tpm", 0) or 0)
+    with _limiters_lock:
+        limiter = _limiters.get(service)
+        if limiter is None:
+            limiter = RateLimiter(rpm, tpm)
+            _limiters[service] = limiter
+        else:
+            limiter.configure(rpm, tpm)
+        return limiter
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from threading import Lock
+
+from .paths import user_files_dir
+
+# --- 响应缓存：将 AI 返回结果持久化到 SQLite，重复任务无需再次请求网络 ---
+
+CACHE_FILENAME = "lexisage_cache.db"
+# 每写入多少条记录执行一次淘汰检查，避免每次写入都扫描全表
+EVICT_EVERY_N_PUTS = 200
+
+
+def normalize_word(word):
+    """统一单词的空白字符，避免因首尾空格或多余空格导致缓存未命中"""
+    return " ".join((word or "").split())
+
+
+def build_cache_key(word, context, field_prompts_map, system_prompt, service, model, temperature):
+    """
+    根据所有会影响 AI 输出的参数计算缓存键。
+    只要单词、上下文、字段提示词、系统提示词、服务、模型或温度任一发生变化，键就会不同。
+    """
+    system_hash = hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()
+    key_material = {
+        "word": normalize_word(word),
+        "context": context or "",
+        "fields": sorted((field, prompt or "") for field, prompt in field_prompts_map.items()),
+        "system": system_hash,
+        "service": service,
+        "model": model,
+        "temperature": temperature,
+    }
+    raw = json.dumps(key_material, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, db_path, max_size_mb=200, max_age_days=30):
+        self.db_path = db_path
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_days * 86400
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.puts_since_evict = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, results TEXT NOT NULL, tokens INTEGER NOT NULL, "
+                "size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+            self.conn.commit()
+        self.evict()
+
+    def configure(self, max_size_mb, max_age_days):
+        with self.lock:
+            self.max_bytes = int(max_size_mb * 1024 * 1024)
+            self.max_age_seconds = max_age_days * 86400
+
+    def get(self, key):
+        """命中时返回 (results, tokens)，未命中返回 None"""
+        with self.lock:
+            row = self.conn.execute("SELECT results, tokens, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if self.max_age_seconds and now - row[2] > self.max_age_seconds:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, results, tokens):
+        payload = json.dumps(results, ensure_ascii=False)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, results, tokens, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, payload, int(tokens or 0), len(payload.encode("utf-8")), now, now)
+            )
+            self.conn.commit()
+            self.puts_since_evict += 1
+            should_evict = self.puts_since_evict >= EVICT_EVERY_N_PUTS
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """先删除过期记录，再按最近访问时间（LRU）删除，直到总大小低于上限"""
+        with self.lock:
+            self.puts_since_evict = 0
+            if self.max_age_seconds:
+                self.conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age_seconds,))
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if self.max_bytes and total > self.max_bytes:
+                excess = total - self.max_bytes
+                freed = 0
+                stale_keys = []
+                for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC"):
+                    stale_keys.append((key,))
+                    freed += size
+                    if freed >= excess: break
+                self.conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            count, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {"entries": count, "size_bytes": total, "hits": self.hits, "misses": self.misses}
+
+
+_cache_instance = None
+_cache_instance_lock = Lock()
+
+
+def get_response_cache(config):
+    """按配置返回进程内共享的缓存实例；缓存被禁用时返回 None"""
+    global _cache_instance
+    if not config.get("enableResponseCache", True):
+        return None
+    max_size_mb = config.get("cacheMaxSizeMB", 200)
+    max_age_days = config.get("cacheMaxAgeDays", 30)
+    with _cache_instance_lock:
+        if _cache_instance is None:
+            db_path = os.path.join(user_files_dir(), CACHE_FILENAME)
+            _cache_instance = ResponseCache(db_path, max_size_mb, max_age_days)
+        else:
+            _cache_instance.configure(max_size_mb, max_age_days)
+        return _cache_instance
@@ -0,0 +1,144 @@
+import time
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# --- 重试策略：按错误类型决定是否重试，指数退避加随机抖动，并遵守任务与批量的截止时间 ---
+
+# 错误类型：限流、服务端错误、超时、连接错误、鉴权失败、其他客户端错误、响应内容无效（空内容或非法 JSON）
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_SERVER = "server"
+ERROR_TIMEOUT = "timeout"
+ERROR_NETWORK = "network"
+ERROR_AUTH = "auth"
+ERROR_CLIENT = "client"
+ERROR_BAD_RESPONSE = "bad_response"
+ERROR_OTHER = "other"
+
+ERROR_LABELS = {
+    ERROR_RATE_LIMIT: "限流 (429)",
+    ERROR_SERVER: "服务端错误 (5xx)",
+    ERROR_TIMEOUT: "超时",
+    ERROR_NETWORK: "连接错误",
+    ERROR_AUTH: "鉴权失败",
+    ERROR_CLIENT: "请求错误 (4xx)",
+    ERROR_BAD_RESPONSE: "无效响应",
+    ERROR_OTHER: "其他错误",
+}
+
+# 鉴权失败和请求本身有误时重试只会得到同样的结果
+NON_RETRYABLE = frozenset((ERROR_AUTH, ERROR_CLIENT))
+
+# 单次 HTTP 请求的超时上限；剩余截止时间更短时按剩余时间
+REQUEST_TIMEOUT_SECONDS = 60
+
+
+def status_category(status):
+    if status == 429: return ERROR_RATE_LIMIT
+    if status in (401, 403): return ERROR_AUTH
+    if status == 408 or status >= 500: return ERROR_SERVER
+    if status >= 400: return ERROR_CLIENT
+    return ERROR_OTHER
+
+
+def error_category(error):
+    """
+    对 requests 与 aiohttp 的异常分类；按类名匹配，本模块不依赖任何 HTTP 库。
+    两者的 HTTP 错误分别在 response.status_code 和 status 上携带状态码。
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int): return status_category(status)
+    names = [cls.__name__ for cls in type(error).__mro__]
+    if isinstance(error, TimeoutError) or any("Timeout" in name for name in names): return ERROR_TIMEOUT
+    if isinstance(error, ConnectionError) or any("Connection" in name for name in names): return ERROR_NETWORK
+    # 响应正文不是合法 JSON（json.JSONDecodeError 是 ValueError 的子类）
+    if isinstance(error, ValueError): return ERROR_BAD_RESPONSE
+    return ERROR_OTHER
+
+
+# --- 截止时间：以 ContextVar 传递，线程池任务和 asyncio 任务随上下文继承，嵌套时取较早的截止时间 ---
+
+_deadline = ContextVar("lexisage_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """截止时间已过，请求未发出；任务记为失败，任务日志保留失败的任务，恢复任务时会重新处理"""
+    def __init__(self):
+        super().__init__("已超过截止时间，请求未发出")
+
+
+def set_deadline(seconds):
+    """设置截止时间（seconds 为 0 时不限制），返回用于 reset_deadline 的 token"""
+    current = _deadline.get()
+    if seconds and seconds > 0:
+        at = time.monotonic() + seconds
+        current = at if current is None else min(current, at)
+    return _deadline.set(current)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+@contextmanager
+def deadline_scope(seconds):
+    token = set_deadline(seconds)
+    try:
+        yield
+    finally:
+        reset_deadline(token)
+
+
+def deadline_remaining():
+    """距离截止时间的秒数；未设置截止时间时返回 None"""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def deadline_expired():
+    remaining = deadline_remaining()
+    return remaining is not None and remaining <= 0
+
+
+def request_timeout():
+    """本次 HTTP 请求的超时：不超过剩余截止时间"""
+    remaining = deadline_remaining()
+    return REQUEST_TIMEOUT_SECONDS if remaining is None else min(REQUEST_TIMEOUT_SECONDS, remaining)
+
+
+class RetryPolicy:
+    """
+    max_retries 为每次调用最多的重试次数，无效响应另受 bad_response_retries 限制。
+    退避时间为 [0, min(max_delay, base_delay * 2^attempt)] 内的随机值（full jitter），
+    并发请求同时失败时不会在同一时刻一起重试；服务端给出 Retry-After 时至少等待该时间。
+    """
+
+    def __init__(self, max_retries=2, base_delay=0.5, max_delay=30.0, bad_response_retries=1, rng=random):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bad_response_retries = bad_response_retries
+        self.random = rng
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_retries=config.get("maxRetries", 2),
+            base_delay=config.get("retryBaseDelaySeconds", 0.5),
+            max_delay=config.get("retryMaxDelaySeconds", 30.0),
+            bad_response_retries=config.get("badResponseRetries", 1),
+        )
+
+    def next_delay(self, category, attempt, retries_by_category, retry_after=None):
+        """
+        attempt 为已重试次数，retries_by_category 为本次调用中各类型的已重试次数。
+        返回下次重试前的等待秒数；不应重试（类型不可重试、次数用尽或等待后将超过截止时间）时返回 None。
+        """
+        if category in NON_RETRYABLE or attempt >= self.max_retries: return None
+        if category == ERROR_BAD_RESPONSE and retries_by_category.get(category, 0) >= self.bad_response_retries: return None
+        delay = self.random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        remaining = deadline_remaining()
+        if remaining is not None and delay >= remaining: return None
+        return delay
@@ -0,0 +1,125 @@
+import time
+from threading import Lock
+
+# --- 多服务路由：按权重把请求分配给已配置的多个服务，失败时切换到其他服务，持续出错的服务被暂时熔断 ---
+
+# 连续失败达到该次数后熔断，冷却期内不再分配新请求
+CIRCUIT_FAILURE_THRESHOLD = 3
+# 熔断冷却时间；冷却结束后先放行一个试探请求（半开），成功即恢复
+CIRCUIT_COOLDOWN_SECONDS = 30.0
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def available(self, now):
+        if self.opened_at is None: return True
+        if now - self.opened_at < CIRCUIT_COOLDOWN_SECONDS: return False
+        # 半开：同一时间只放行一个试探请求
+        return not self.probing
+
+    def on_dispatch(self):
+        if self.opened_at is not None: self.probing = True
+
+    def on_abandon(self):
+        self.probing = False
+
+    def record(self, success, now):
+        self.probing = False
+        if success:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self.opened_at = now
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+class ProviderRouter:
+    """
+    平滑加权轮询（与 nginx 相同的算法）：在可用的服务之间按权重交替分配，短时间内的分布也接近权重比例。
+    被熔断的服务跳过；正在被限流（Retry-After 退避中）的服务只在没有其他可用服务时使用。
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.weights = {}
+        self.current = {}
+        self.breakers = {}
+
+    def configure(self, weights):
+        with self.lock:
+            if weights == self.weights: return
+            self.weights = dict(weights)
+            self.current = {service: self.current.get(service, 0) for service in weights}
+            for service in weights:
+                self.breakers.setdefault(service, CircuitBreaker())
+
+    def choose(self, exclude=(), throttled=()):
+        """返回下一个请求使用的服务；所有服务都已尝试过时返回 None"""
+        with self.lock:
+            now = time.monotonic()
+            candidates = [service for service in self.weights if service not in exclude]
+            if not candidates: return None
+            healthy = [service for service in candidates if self.breakers[service].available(now)]
+            preferred = [service for service in healthy if service not in throttled] or healthy
+            if not preferred:
+                # 全部熔断时不让整批任务直接失败：选择最早熔断、最接近恢复的服务
+                preferred = [min(candidates, key=lambda service: self.breakers[service].opened_at)]
+            total = sum(self.weights[service] for service in preferred)
+            for service in preferred:
+                self.current[service] += self.weights[service]
+            chosen = max(preferred, key=lambda service: self.current[service])
+            self.current[chosen] -= total
+            self.breakers[chosen].on_dispatch()
+            return chosen
+
+    def record(self, service, success):
+        with self.lock:
+            breaker = self.breakers.get(service)
+            if breaker: breaker.record(success, time.monotonic())
+
+    def release(self, service):
+        """已派发的请求被放弃（取消、截止或对方先完成）：结束半开试探，不计入成败"""
+        with self.lock:
+            breaker = self.breakers.get(service)
+            if breaker: breaker.on_abandon()
+
+    def open_circuits(self):
+        with self.lock:
+            return [service for service, breaker in self.breakers.items() if breaker.is_open]
+
+
+def provider_weights(config):
+    """
+    参与路由的服务及其权重：已填写 API Key 且 weight > 0 的服务。
+    未设置 weight 时，当前选择的服务权重为 1，其他服务为 0（不参与）。
+    """
+    primary = config.get("aiService", "openai")
+    weights = {}
+    for service, api_config in config.get("apiConfig", {}).items():
+        if not api_config.get("apiKey"): continue
+        weight = api_config.get("weight", 1 if service == primary else 0)
+        if weight > 0: weights[service] = weight
+    return weights
+
+
+_router = ProviderRouter()
+
+
+def get_router(config):
+    """返回共享的路由器；未启用多服务或只有一个可用服务时返回 None，请求直接发往当前服务"""
+    if not config.get("enableMultiProvider", False):
+        return None
+    weights = provider_weights(config)
+    if len(weights) < 2:
+        return None
+    _router.configure(weights)
+    return _router
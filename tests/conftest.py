@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+import types
+import importlib
+
+import pytest
+
+# 插件目录本身就是包（依赖 Anki 的 __init__.py 无法在 Anki 之外导入）：
+# 注册一个同名的空包指向仓库根目录，测试只导入不依赖 aqt 的模块
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if "lexisage" not in sys.modules:
+    package = types.ModuleType("lexisage")
+    package.__path__ = [ROOT]
+    sys.modules["lexisage"] = package
+    sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+# 模拟服务在 bench 目录中，需在加入 sys.path 后导入
+from mock_server import MockSettings
+
+
+class AddonRootDirectory:
+    """仓库根目录的 __init__.py 依赖 aqt：收集测试时把根目录当作普通目录，不导入插件入口"""
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collect_directory(self, path, parent):
+        if str(path) == ROOT:
+            return pytest.Dir.from_parent(parent, path=path)
+
+
+def pytest_configure(config):
+    config.pluginmanager.register(AddonRootDirectory(), "lexisage-addon-root")
+
+
+def load(name):
+    return importlib.import_module(f"lexisage.{name}")
+
+
+@pytest.fixture(autouse=True)
+def user_files(tmp_path, monkeypatch):
+    """任务日志、缓存、指标和日志文件都写到临时目录"""
+    monkeypatch.setattr(load("paths"), "USER_FILES_PATH", str(tmp_path / "user_files"))
+    monkeypatch.setattr(load("logger"), "LOG_PATH", str(tmp_path / "lexisage.log"))
+    return tmp_path / "user_files"
+
+
+@pytest.fixture
+def mock_server():
+    """启动本地模拟服务，返回工厂函数：mock_server(settings=None, **MockSettings 参数) -> MockServer"""
+    from mock_server import MockServer
+    servers = []
+
+    def start(settings=None, **options):
+        server = MockServer(settings or MockSettings(**options)).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_config(url, **overrides):
+    config = {
+        "aiService": "openai",
+        "apiConfig": {"openai": {"baseUrl": url, "apiKey": "test-key", "model": "test-model", "temperature": 0.1}},
+        "enableResponseCache": False,
+        "maxRetries": 0,
+        "badResponseRetries": 0,
+    }
+    config.update(overrides)
+    return config
+
+
+class FirstRequestSlow(MockSettings):
+    """只有第一个请求是长尾请求，之后的请求（如对冲请求）正常返回"""
+
+    def __init__(self, tail_latency):
+        super().__init__(latency="fixed:0.05", tail_latency=tail_latency)
+        self.tail_rolls = 0
+
+    def roll(self, rate):
+        if rate is not self.tail_rate: return super().roll(rate)
+        with self.lock:
+            self.tail_rolls += 1
+            return self.tail_rolls == 1
+
+
+ENGINES = ["thread", "asyncio"]
+
+
+def make_tasks(count, fields=None):
+    ai_service = load("ai_service")
+    return [ai_service.ExplanationTask(nid, f"word{nid}", "", dict(fields or {"Meaning": "释义"}))
+            for nid in range(1, count + 1)]
+
+
+class BatchRun:
+    """run_batch 的结果：交给回调的任务、运行指标、耗时，以及提前停止时的 BatchStopped 异常"""
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.reported = []
+        self.metrics = load("metrics").RunMetrics()
+        self.stopped = None
+        self.elapsed = 0.0
+
+    @property
+    def counters(self):
+        return self.metrics.counters
+
+    def on_result(self, task):
+        self.reported.append(task)
+        if self.journal is not None: self.journal.record_result(task)
+
+    def restore(self):
+        """从任务日志恢复：返回 (已完成的任务, 待处理的任务)"""
+        return load("job_journal").restore_tasks(self.journal.path)
+
+
+def run_batch(engine, tasks, config, workers=2, journal=None, cancel_event=None):
+    """
+    用指定引擎运行一次批量（asyncio 引擎在 aiohttp 不可用时跳过测试），结果交给回调并写入 journal（如提供）。
+    达到预算或截止时间提前停止时不抛出，异常记录在 BatchRun.stopped；结束后关闭 journal。
+    """
+    ai_service, async_engine, metrics = load("ai_service"), load("async_engine"), load("metrics")
+    if engine == "asyncio" and not async_engine.is_available(): pytest.skip("aiohttp 不可用")
+    run = BatchRun(journal)
+    token = metrics.activate(run.metrics)
+    started = time.monotonic()
+    try:
+        if engine == "asyncio":
+            async_engine.generate_explanations_batch_async(tasks, config, workers, result_callback=run.on_result, cancel_event=cancel_event)
+        else:
+            ai_service.generate_explanations_batch(tasks, config, workers, result_callback=run.on_result, cancel_event=cancel_event)
+    except ai_service.BatchStopped as e:
+        run.stopped = e
+    finally:
+        run.elapsed = time.monotonic() - started
+        metrics.deactivate(token)
+        if journal is not None: journal.close()
+    return run
@@ -0,0 +1,66 @@
+import pytest
+
+from conftest import ENGINES, load, make_config, make_tasks, run_batch
+
+ai_service = load("ai_service")
+job_journal = load("job_journal")
+
+
+def test_token_budget():
+    unlimited = ai_service.TokenBudget(0)
+    unlimited.charge(10**9)
+    assert not unlimited.exhausted
+    unlimited.check()
+
+    budget = ai_service.TokenBudget(100)
+    budget.charge(60)
+    assert not budget.exhausted
+    budget.charge(40)
+    assert budget.exhausted
+    budget.check()  # 所有任务都已派发时不算提前停止
+    budget.stopped = True
+    with pytest.raises(ai_service.BudgetExhausted) as info:
+        budget.check()
+    assert (info.value.spent, info.value.limit) == (100, 100)
+    assert isinstance(info.value, ai_service.BatchStopped)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_budget_stops_dispatch_and_keeps_rest_resumable(engine, mock_server):
+    server = mock_server(latency="fixed:0.05")
+    tasks = make_tasks(20)
+    run = run_batch(engine, tasks, make_config(server.url, tokenBudget=1),
+                    journal=job_journal.JobJournal.create(tasks, "test"))
+
+    # 已派发的任务照常完成，超出预算后不再派发
+    assert isinstance(run.stopped, ai_service.BudgetExhausted)
+    assert run.reported and all(task.success for task in run.reported)
+    assert len(run.reported) < len(tasks)
+    assert run.stopped.spent >= run.stopped.limit
+
+    finished, pending = run.restore()
+    reported = {task.note_id for task in run.reported}
+    assert {task.note_id for task in finished} == reported
+    assert {task.note_id for task in pending} == {task.note_id for task in tasks} - reported
+
+
+def test_budget_not_reached_finishes_normally(mock_server):
+    server = mock_server()
+    tasks = make_tasks(5)
+    run = run_batch("thread", tasks, make_config(server.url, tokenBudget=10**9))
+    assert run.stopped is None and len(run.reported) == len(tasks)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_budget_counts_every_billed_response(engine, mock_server):
+    """重试和无效响应同样按 usage 计费，全部计入预算"""
+    server = mock_server(latency="fixed:0", malformed_rate=1.0)
+    config = make_config(server.url, tokenBudget=1, maxRetries=2, badResponseRetries=2, retryBaseDelaySeconds=0)
+    run = run_batch(engine, make_tasks(3), config, workers=1)
+
+    assert isinstance(run.stopped, ai_service.BudgetExhausted)
+    # 已派发任务的三次请求都返回了无效内容，任务失败但 Token 照常计费；预算用尽后不再派发
+    requests_sent = server.settings.stats["requests"]
+    assert requests_sent % 3 == 0 and requests_sent < 9
+    billed = run.counters["prompt_tokens"] + run.counters["completion_tokens"]
+    assert billed > 0 and run.stopped.spent == billed
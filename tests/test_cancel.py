@@ -0,0 +1,50 @@
+import time
+from threading import Event, Thread
+
+import pytest
+
+from conftest import ENGINES, load, make_config, make_tasks, run_batch
+
+job_journal = load("job_journal")
+
+
+def cancel_when_received(server, count):
+    """模拟服务收到 count 个请求后设置取消，此时这些请求都在途"""
+    cancel_event = Event()
+
+    def watch():
+        while server.settings.stats["requests"] < count:
+            time.sleep(0.01)
+        cancel_event.set()
+
+    Thread(target=watch, daemon=True).start()
+    return cancel_event
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_in_flight_results_are_kept_within_grace(engine, mock_server):
+    server = mock_server(latency="fixed:0.5")
+    tasks = make_tasks(6)
+    run = run_batch(engine, tasks, make_config(server.url, cancelGraceSeconds=5), workers=2,
+                    journal=job_journal.JobJournal.create(tasks, "test"), cancel_event=cancel_when_received(server, 2))
+
+    # 取消时在途的两个请求在宽限期内完成，结果照常交给回调；尚未开始的任务不再发出请求
+    assert sorted(task.note_id for task in run.reported) == [1, 2]
+    assert all(task.success and task.results_map for task in run.reported)
+    assert server.settings.stats["requests"] == 2
+    assert run.elapsed < 1.5
+    finished, pending = run.restore()
+    assert sorted(task.note_id for task in finished) == [1, 2]
+    assert sorted(task.note_id for task in pending) == [3, 4, 5, 6]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_requests_beyond_grace_are_abandoned(engine, mock_server):
+    server = mock_server(latency="fixed:2")
+    tasks = make_tasks(4)
+    run = run_batch(engine, tasks, make_config(server.url, cancelGraceSeconds=0.2), workers=2,
+                    cancel_event=cancel_when_received(server, 2))
+
+    # 宽限期结束仍未返回的请求被放弃，不等待其完成，也不交给回调（恢复任务时重新处理）
+    assert run.reported == []
+    assert run.elapsed < 1.5
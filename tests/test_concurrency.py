@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+
+from conftest import load
+
+concurrency = load("concurrency")
+
+
+def test_async_waiter_wakes_on_release_from_thread():
+    controller = concurrency.AdaptiveConcurrencyController(1, 1, 1)
+    assert controller.try_acquire()
+
+    async def main():
+        threading.Timer(0.1, controller.release).start()
+        started = time.monotonic()
+        await asyncio.wait_for(controller.acquire_async(), 2)
+        return time.monotonic() - started
+
+    waited = asyncio.run(main())
+    assert 0.05 < waited < 1
+    assert controller.in_flight == 1
+    assert controller.async_waiters == []
+
+
+def test_async_waiter_wakes_on_configure():
+    controller = concurrency.AdaptiveConcurrencyController(1, 1, 1)
+    assert controller.try_acquire()
+
+    async def main():
+        waiter = asyncio.ensure_future(controller.acquire_async())
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        controller.limit = 2.0
+        controller.configure(1, 2)
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(main())
+    assert controller.in_flight == 2
+
+
+def test_cancelled_async_waiter_is_unregistered():
+    controller = concurrency.AdaptiveConcurrencyController(1, 1, 1)
+    assert controller.try_acquire()
+
+    async def main():
+        waiter = asyncio.ensure_future(controller.acquire_async())
+        await asyncio.sleep(0.05)
+        assert len(controller.async_waiters) == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    asyncio.run(main())
+    assert controller.async_waiters == []
+    controller.release()
+    assert controller.in_flight == 0
+
+
+def test_only_one_waiter_gets_a_released_slot():
+    controller = concurrency.AdaptiveConcurrencyController(1, 1, 1)
+    assert controller.try_acquire()
+
+    async def main():
+        waiters = [asyncio.ensure_future(controller.acquire_async()) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        controller.release()
+        await asyncio.sleep(0.1)
+        done = [w for w in waiters if w.done()]
+        for w in waiters: w.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return len(done)
+
+    assert asyncio.run(main()) == 1
+    assert controller.in_flight == 1
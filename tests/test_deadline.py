@@ -0,0 +1,25 @@
+import pytest
+
+from conftest import ENGINES, load, make_config, make_tasks, run_batch
+
+ai_service = load("ai_service")
+job_journal = load("job_journal")
+retry_policy = load("retry_policy")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_batch_deadline_reports_dispatched_units_as_failed(engine, mock_server):
+    server = mock_server(latency="fixed:0.4")
+    tasks = make_tasks(20)
+    run = run_batch(engine, tasks, make_config(server.url, batchDeadlineSeconds=1),
+                    journal=job_journal.JobJournal.create(tasks, "test"))
+
+    assert isinstance(run.stopped, ai_service.BatchDeadlineExceeded)
+    failed = [task for task in run.reported if not task.success]
+    # 截止时间到达时已取出的单元照常交给回调，记为失败而不是被丢弃
+    assert any(str(retry_policy.DeadlineExceeded()) in task.error for task in failed)
+    assert len(run.reported) < len(tasks)
+
+    finished, pending = run.restore()
+    assert {task.note_id for task in finished} == {task.note_id for task in run.reported if task.success}
+    assert {task.note_id for task in failed} <= {task.note_id for task in pending}
@@ -0,0 +1,73 @@
+import pytest
+
+from conftest import ENGINES, load, make_config, run_batch
+
+ai_service = load("ai_service")
+job_journal = load("job_journal")
+
+FIELDS = {"Meaning": "释义", "Example": "例句"}
+
+
+def task(nid, word, context="", fields=None):
+    return ai_service.ExplanationTask(nid, word, context, dict(fields or FIELDS))
+
+
+def fan_out(tasks):
+    """与 ResultWriter 相同的写入方式：去重任务的结果写入 [note_id] + duplicate_note_ids 的每条笔记"""
+    written = {}
+    for done in tasks:
+        for nid in [done.note_id] + done.duplicate_note_ids:
+            written[nid] = dict(done.results_map)
+    return written
+
+
+def test_key_ignores_whitespace_and_field_order():
+    key = ai_service.task_dedup_key("ice cream", "", {"Meaning": "释义", "Example": "例句"})
+    assert ai_service.task_dedup_key("  ice \t cream ", None, {"Example": "例句", "Meaning": "释义"}) == key
+    assert len(key) == 16
+    # 与响应缓存一致区分大小写（Polish / polish 含义不同）
+    assert ai_service.task_dedup_key("Ice cream", "", FIELDS) != key
+    # 上下文、字段或提示词不同的笔记需要各自请求
+    assert ai_service.task_dedup_key("ice cream", "I want ice cream.", FIELDS) != key
+    assert ai_service.task_dedup_key("ice cream", "", {"Meaning": "释义"}) != key
+    assert ai_service.task_dedup_key("ice cream", "", {"Meaning": "释义", "Example": "两个例句"}) != key
+
+
+def test_coalesce_keeps_first_task_and_collects_duplicates():
+    tasks = [task(1, "apple"), task(2, "pear"), task(3, " apple "), task(4, "apple", "I ate an apple."), task(5, "apple")]
+    merged = task(6, "pear")
+    merged.duplicate_note_ids = [7, 8]  # 已合并过的任务再次合并时，携带的重复笔记一并转移
+    unique = ai_service.coalesce_tasks(tasks + [merged])
+
+    assert [t.note_id for t in unique] == [1, 2, 4]
+    assert unique[0].duplicate_note_ids == [3, 5]
+    assert unique[1].duplicate_note_ids == [6, 7, 8]
+    assert unique[2].duplicate_note_ids == []
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_duplicates_share_one_request_and_fan_out(engine, mock_server):
+    server = mock_server(latency="fixed:0")
+    tasks = [task(nid, word) for nid, word in [(1, "apple"), (2, "pear"), (3, "apple"), (4, " apple "), (5, "pear")]]
+    unique = ai_service.coalesce_tasks(tasks)
+    run = run_batch(engine, unique, make_config(server.url))
+
+    assert server.settings.stats["requests"] == 2
+    assert sorted(t.note_id for t in run.reported) == [1, 2]
+    written = fan_out(run.reported)
+    assert sorted(written) == [1, 2, 3, 4, 5]
+    assert all(set(results) == set(FIELDS) for results in written.values())
+    assert written[3] == written[4] == written[1]
+    assert written[5] == written[2]
+
+
+def test_journal_restores_duplicates():
+    tasks = ai_service.coalesce_tasks([task(1, "apple"), task(2, "apple")])
+    journal = job_journal.JobJournal.create(tasks, "test")
+    # 边扫描边生成时，后到的重复笔记以单独的记录追加
+    journal.record_duplicate(1, 3)
+    journal.close()
+
+    finished, pending = job_journal.restore_tasks(journal.path)
+    assert finished == []
+    assert [(t.note_id, t.duplicate_note_ids) for t in pending] == [(1, [2, 3])]
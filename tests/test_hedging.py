@@ -0,0 +1,151 @@
+import time
+import asyncio
+
+import pytest
+
+from conftest import ENGINES, FirstRequestSlow, load, make_config, make_tasks, run_batch
+
+hedging = load("hedging")
+ai_service = load("ai_service")
+async_engine = load("async_engine")
+
+
+def make_policy(**config):
+    policy = hedging.HedgePolicy()
+    policy.configure(config)
+    return policy
+
+
+def test_fixed_delay_is_used_without_samples():
+    assert make_policy(hedgeDelaySeconds=2.5).delay("openai") == 2.5
+
+
+def test_learned_delay_needs_min_samples():
+    policy = make_policy(hedgePercentile=50)
+    for _ in range(hedging.HEDGE_MIN_SAMPLES - 1):
+        policy.observe("openai", 3.0)
+    assert policy.delay("openai") is None
+    policy.observe("openai", 3.0)
+    assert policy.delay("openai") == 3.0
+
+
+def test_learned_delay_uses_percentile_with_floor():
+    policy = make_policy(hedgePercentile=90)
+    for index in range(1, 101):
+        policy.observe("openai", index / 10)
+    assert policy.delay("openai") == pytest.approx(9.0)
+    fast = make_policy()
+    for _ in range(hedging.HEDGE_MIN_SAMPLES):
+        fast.observe("openai", 0.1)
+    assert fast.delay("openai") == hedging.MIN_HEDGE_DELAY_SECONDS
+
+
+def test_hedge_rate_is_capped():
+    policy = make_policy(hedgeMaxPercent=5)
+    # 窗口 200 次请求中已有 10 次对冲，达到 5% 上限
+    for hedged in [True] * 10 + [False] * (hedging.HEDGE_RATE_WINDOW - 10):
+        policy.record(hedged)
+    assert not policy.try_start()
+    # 最早的一次对冲移出窗口后恢复
+    policy.record(False)
+    assert policy.try_start()
+
+
+def test_cold_start_rate_uses_min_samples():
+    policy = make_policy(hedgeMaxPercent=5)
+    # 请求数不足 HEDGE_MIN_SAMPLES 时按 HEDGE_MIN_SAMPLES 计算上限，冷启动阶段最多对冲 1 次
+    assert policy.try_start()
+    policy.finish()
+    policy.record(True)
+    assert not policy.try_start()
+
+
+def test_hedges_in_flight_are_capped():
+    policy = make_policy(hedgeMaxPercent=100)
+    assert all(policy.try_start() for _ in range(hedging.HEDGE_MAX_IN_FLIGHT))
+    assert not policy.try_start()
+    policy.finish()
+    assert policy.try_start()
+
+
+def test_rate_window_slides():
+    policy = make_policy(hedgeMaxPercent=5)
+    for _ in range(hedging.HEDGE_RATE_WINDOW):
+        policy.record(True)
+    assert policy.hedged_recent == hedging.HEDGE_RATE_WINDOW
+    for _ in range(hedging.HEDGE_RATE_WINDOW):
+        policy.record(False)
+    assert policy.hedged_recent == 0
+    assert policy.try_start()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_hedge_wins_against_slow_request(engine, mock_server):
+    server = mock_server(FirstRequestSlow(tail_latency=1.5))
+    config = make_config(server.url, enableHedging=True, hedgeDelaySeconds=0.3, hedgeMaxPercent=100)
+    tasks = make_tasks(1)
+    run = run_batch(engine, tasks, config)
+
+    assert tasks[0].success and tasks[0].results_map["Meaning"]
+    assert run.counters.get("hedges") == 1
+    assert run.counters.get("hedge_wins") == 1
+    assert server.settings.stats["requests"] == 2
+    # 对冲胜出后直接返回，不等待长尾请求（线程池引擎中落败的请求在后台继续，异步引擎中被直接取消）
+    assert run.elapsed < 1.2
+
+
+retry_policy = load("retry_policy")
+
+
+def test_deadline_in_hedged_call_is_raised(monkeypatch):
+    def expired(*args, **kwargs):
+        raise retry_policy.DeadlineExceeded()
+
+    monkeypatch.setattr(ai_service, "_call_service", expired)
+    policy = make_policy(hedgeDelaySeconds=5)
+    with pytest.raises(retry_policy.DeadlineExceeded):
+        ai_service._call_service_hedged("openai", policy, None, "{}", {}, "system")
+    assert policy.in_flight == 0
+
+
+def test_deadline_in_hedged_async_call_is_raised(monkeypatch):
+    if not async_engine.is_available(): pytest.skip("aiohttp 不可用")
+
+    async def expired(*args, **kwargs):
+        raise retry_policy.DeadlineExceeded()
+
+    monkeypatch.setattr(async_engine, "_call_service_async", expired)
+    policy = make_policy(hedgeDelaySeconds=5)
+    with pytest.raises(retry_policy.DeadlineExceeded):
+        asyncio.run(async_engine._call_service_hedged_async(None, "openai", policy, None, "{}", {}, "system"))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_hedge_deadline_is_raised_when_primary_fails(engine, monkeypatch):
+    """原请求失败、对冲请求因截止时间未发出时，任务按截止处理而不是记为请求失败"""
+    if engine == "asyncio" and not async_engine.is_available(): pytest.skip("aiohttp 不可用")
+    calls = []
+
+    def attempt(service, *args, **kwargs):
+        calls.append(service)
+        if len(calls) == 1:
+            time.sleep(0.3)
+            return None, 0, None
+        raise retry_policy.DeadlineExceeded()
+
+    async def attempt_async(session, service, *args, **kwargs):
+        calls.append(service)
+        if len(calls) == 1:
+            await asyncio.sleep(0.3)
+            return None, 0, None
+        raise retry_policy.DeadlineExceeded()
+
+    policy = make_policy(hedgeDelaySeconds=0.1, hedgeMaxPercent=100, hedgeToOtherProvider=False)
+    with pytest.raises(retry_policy.DeadlineExceeded):
+        if engine == "asyncio":
+            monkeypatch.setattr(async_engine, "_call_service_async", attempt_async)
+            asyncio.run(async_engine._call_service_hedged_async(None, "openai", policy, None, "{}", {}, "system"))
+        else:
+            monkeypatch.setattr(ai_service, "_call_service", attempt)
+            ai_service._call_service_hedged("openai", policy, None, "{}", {}, "system")
+    assert calls == ["openai", "openai"]
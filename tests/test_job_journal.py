@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import ENGINES, load, make_config, make_tasks, run_batch
+
+job_journal = load("job_journal")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_failed_call_is_retried_on_resume(engine, mock_server):
+    failing = mock_server(latency="fixed:0", rate_5xx=1.0)
+    tasks = make_tasks(2)
+    run = run_batch(engine, tasks, make_config(failing.url), journal=job_journal.JobJournal.create(tasks, "test"))
+
+    assert not any(task.success for task in tasks)
+    assert all(task.error for task in tasks)
+    finished, pending = run.restore()
+    assert finished == []
+    assert sorted(task.note_id for task in pending) == [1, 2]
+
+    healthy = mock_server(latency="fixed:0")
+    run = run_batch(engine, pending, make_config(healthy.url), journal=job_journal.JobJournal(run.journal.path))
+
+    finished, pending = run.restore()
+    assert pending == []
+    assert sorted(task.note_id for task in finished) == [1, 2]
+    assert all(task.results_map.get("Meaning") for task in finished)
+
+
+def test_empty_result_record_is_not_finished():
+    task = make_tasks(1)[0]
+    journal = job_journal.JobJournal.create([task], "test")
+    task.success, task.results_map = True, {}
+    journal.record_result(task)
+    journal.close()
+
+    _, finished, _ = job_journal.load_job(journal.path)
+    assert finished == {}
+
+
+def test_saved_tasks_are_skipped():
+    tasks = make_tasks(2)
+    journal = job_journal.JobJournal.create(tasks, "test")
+    journal.mark_saved([1])
+    journal.close()
+
+    finished, pending = job_journal.restore_tasks(journal.path)
+    assert finished == []
+    assert [task.note_id for task in pending] == [2]
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from conftest import load
+
+json_stream = load("json_stream")
+
+PAYLOAD = {
+    "Meaning": "a \"quoted\" word, with {braces} and [brackets]",
+    "Examples": ["one, two", {"nested": "}"}],
+    "Extra": {"level": {"deep": [1, 2, {"x": "\\\\"}]}},
+    "Count": 3,
+    "Empty": None,
+    "中文": "释义\n第二行",
+}
+
+
+def feed_chunks(text, size):
+    parser = json_stream.IncrementalJsonParser()
+    completed = []
+    for start in range(0, len(text), size):
+        completed.append(parser.feed(text[start:start + size]))
+    return parser, completed
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 10_000])
+def test_any_chunking_yields_every_field_once(size):
+    text = json.dumps(PAYLOAD, ensure_ascii=False, indent=2)
+    parser, completed = feed_chunks(text, size)
+    fields = [field for chunk in completed for field in chunk]
+    assert fields == list(PAYLOAD.items())
+    assert parser.done
+
+
+def test_fields_are_emitted_as_soon_as_they_complete():
+    parser = json_stream.IncrementalJsonParser()
+    assert parser.feed('{"A": "first"') == []
+    assert parser.feed(', "B": ') == [("A", "first")]
+    assert parser.feed('[1, 2') == []
+    assert parser.feed(']}') == [("B", [1, 2])]
+
+
+def test_code_fence_and_trailing_text_are_ignored():
+    parser, completed = feed_chunks('```json\n{"A": 1}\n```\n{"B": 2}', 5)
+    assert [field for chunk in completed for field in chunk] == [("A", 1)]
+    assert parser.feed('{"C": 3}') == []
+
+
+def test_invalid_member_is_skipped():
+    parser = json_stream.IncrementalJsonParser()
+    assert parser.feed('{"A": oops, "B": "ok"}') == [("B", "ok")]
+
+
+def test_empty_object():
+    parser = json_stream.IncrementalJsonParser()
+    assert parser.feed("{ }") == []
+    assert parser.done
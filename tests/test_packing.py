@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from conftest import ENGINES, load, make_tasks, run_batch
+
+ai_service = load("ai_service")
+async_engine = load("async_engine")
+token_estimator = load("token_estimator")
+
+CONFIG = {"aiService": "openai", "apiConfig": {"openai": {"apiKey": "k", "model": "m", "baseUrl": "http://unused"}},
+          "enableResponseCache": False, "enablePackedRequests": True, "packSize": 5}
+
+
+class FakeService:
+    """代替 call_ai_service：打包响应中遗漏 missing、把 malformed 的结果写成非对象，单条请求正常返回"""
+
+    def __init__(self, missing=(), malformed=()):
+        self.missing = {str(nid) for nid in missing}
+        self.malformed = {str(nid) for nid in malformed}
+        self.packed_calls = []
+        self.single_words = []
+
+    def __call__(self, user_content, config, system_content, cancel_event=None, on_field=None):
+        payload = json.loads(user_content)
+        if "notes" not in payload:
+            self.single_words.append(payload["word"])
+            return json.dumps({"Meaning": f"single {payload['word']}"}), 7, "OpenAI/m"
+        self.packed_calls.append(sorted(payload["notes"]))
+        answer = {}
+        for nid, note in payload["notes"].items():
+            if nid in self.missing: continue
+            answer[nid] = "not an object" if nid in self.malformed else {"Meaning": f"packed {note['word']}"}
+        return json.dumps(answer), 100, "OpenAI/m"
+
+    async def call_async(self, session, user_content, config, system_content, cancel_event=None):
+        return self(user_content, config, system_content, cancel_event)
+
+
+def test_unpacked_tasks_are_single_units():
+    tasks = make_tasks(3)
+    assert list(ai_service.plan_work_units(tasks, dict(CONFIG, enablePackedRequests=False))) == [[task] for task in tasks]
+
+
+def test_pack_size_and_split_tasks():
+    tasks = make_tasks(7)
+    tasks[3].split_fields = True
+    units = list(ai_service.plan_work_units(tasks, dict(CONFIG, packSize=2)))
+    assert [[task.note_id for task in unit] for unit in units] == [[1, 2], [4], [3, 5], [6, 7]]
+
+
+def test_pack_respects_token_budget():
+    tasks = make_tasks(6)
+    per_task = token_estimator.estimate_task_tokens(
+        ai_service.build_user_content(tasks[0].word, "", tasks[0].field_prompts_map), 1)
+    units = list(ai_service.plan_work_units(tasks, dict(CONFIG, packSize=10, packTokenBudget=per_task * 2 + 1)))
+    assert [len(unit) for unit in units] == [2, 2, 2]
+    # 单条任务超过预算时仍单独成组，不会被丢弃
+    units = list(ai_service.plan_work_units(tasks, dict(CONFIG, packTokenBudget=1)))
+    assert [len(unit) for unit in units] == [1] * 6
+
+
+def test_same_note_is_never_packed_twice():
+    tasks = make_tasks(2) + make_tasks(1)
+    units = list(ai_service.plan_work_units(tasks, CONFIG))
+    assert [[task.note_id for task in unit] for unit in units] == [[1, 2], [1]]
+
+
+def test_apply_pack_response_returns_only_broken_notes():
+    tasks = make_tasks(4)
+    raw = json.dumps({"1": {"Meaning": "a"}, "2": "oops", "4": {"Meaning": "d"}, "9": {"Meaning": "x"}})
+    fallback = ai_service.apply_pack_response(tasks, raw, 101, {task: None for task in tasks}, "OpenAI/m")
+    assert [task.note_id for task in fallback] == [2, 3]
+    answered = [tasks[0], tasks[3]]
+    assert all(task.success and task.source == "OpenAI/m" for task in answered)
+    # 整个请求的 Token 平摊到拆分出结果的任务
+    assert [task.tokens for task in answered] == [51, 50]
+    assert not tasks[1].success and not tasks[2].success
+
+
+def test_unparseable_pack_falls_back_entirely():
+    tasks = make_tasks(3)
+    slots = {task: None for task in tasks}
+    assert ai_service.apply_pack_response(tasks, "{not json", 50, slots) == tasks
+    assert ai_service.apply_pack_response(tasks, None, 0, slots) == tasks
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_broken_pack_entries_fall_back_to_single_requests(engine, monkeypatch):
+    service = FakeService(missing=[2], malformed=[4])
+    monkeypatch.setattr(ai_service, "call_ai_service", service)
+    monkeypatch.setattr(async_engine, "_call_ai_service_async", service.call_async)
+    tasks = make_tasks(5)
+    run = run_batch(engine, tasks, CONFIG)
+
+    assert service.packed_calls == [["1", "2", "3", "4", "5"]]
+    # 只有被遗漏和格式不对的笔记单独重新请求
+    assert sorted(service.single_words) == ["word2", "word4"]
+    assert len(run.reported) == len(tasks) and all(task.success for task in tasks)
+    assert {task.note_id: task.results_map["Meaning"] for task in tasks} == {
+        1: "packed word1", 2: "single word2", 3: "packed word3", 4: "single word4", 5: "packed word5"}
@@ -0,0 +1,141 @@
+import re
+import random
+
+import pytest
+
+from conftest import load
+
+prescan = load("prescan")
+
+
+def baseline_is_empty(text):
+    """原逐条预检查使用的判断：去掉 &nbsp; 和 HTML 标签后是否只剩空白"""
+    if not text: return True
+    text = text.replace("&nbsp;", " ")
+    text = re.sub(r'<[^>]+>', '', text)
+    return not bool(text.strip())
+
+
+class FakeNote:
+    def __init__(self, model, values):
+        self.model = model
+        self.fields = dict(zip([f["name"] for f in model["flds"]], values))
+
+    def note_type(self):
+        return self.model
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+
+class FakeCol:
+    """只实现预扫描用到的接口：db.all 读取 id/mid/flds，models.get 返回笔记类型，get_note 供原逐条预检查使用"""
+
+    def __init__(self, models, notes):
+        self.model_map = {model["id"]: model for model in models}
+        self.notes = notes  # nid -> (mid, [字段值])
+        self.queries = 0
+        self.db = self
+        self.models = self
+
+    def all(self, sql):
+        self.queries += 1
+        ids = [int(nid) for nid in re.search(r"in \(([\d,]+)\)", sql).group(1).split(",")]
+        return [(nid, self.notes[nid][0], prescan.FIELD_SEPARATOR.join(self.notes[nid][1])) for nid in ids if nid in self.notes]
+
+    def get(self, mid):
+        return self.model_map.get(mid)
+
+    def get_note(self, nid):
+        mid, values = self.notes[nid]
+        return FakeNote(self.model_map[mid], values)
+
+
+def baseline_prescan(col, nids, configs):
+    """user-011 之前的逐条 get_note 预检查（照原实现保留），作为分类结果的基准"""
+    data, stats = [], prescan.new_scan_stats(len(nids))
+    for nid in nids:
+        note = col.get_note(nid)
+        name = note.note_type()["name"]
+        if name not in configs:
+            stats["skipped_not_configured"] += 1
+            continue
+        conf = configs[name]
+        src, ctx_field = conf.get("fieldToExplain"), conf.get("contextField")
+        if not src or src not in note or baseline_is_empty(note[src]): continue
+        empty_map, non_empty_map = {}, {}
+        for target, prompt in conf.get("fieldPrompts", {}).items():
+            if target not in note: continue
+            stats["total_configured_fields"] += 1
+            if baseline_is_empty(note[target]):
+                empty_map[target] = prompt
+                stats["ready_to_update"] += 1
+            else:
+                non_empty_map[target] = prompt
+                stats["skipped_not_empty"] += 1
+        if empty_map or non_empty_map:
+            context = note[ctx_field] if ctx_field and ctx_field in note else ""
+            data.append({"nid": nid, "word": note[src], "context": context,
+                         "empty_map": empty_map, "non_empty_map": non_empty_map})
+    return data, stats
+
+
+def model(mid, name, fields):
+    return {"id": mid, "name": name, "flds": [{"name": field, "ord": index} for index, field in enumerate(fields)]}
+
+
+MODELS = [
+    model(1, "Vocab", ["Word", "Sentence", "Meaning", "Example"]),
+    model(2, "Reversed", ["Meaning", "Word"]),           # 字段顺序不同
+    model(3, "Cloze", ["Text", "Extra"]),                # 未配置
+    model(4, "NoSource", ["Front", "Back"]),             # 源字段不存在
+]
+CONFIGS = {
+    "Vocab": {"fieldToExplain": "Word", "contextField": "Sentence",
+              "fieldPrompts": {"Meaning": "释义 {word}", "Example": "", "Missing": "不在笔记类型中"}},
+    "Reversed": {"fieldToExplain": "Word", "fieldPrompts": {"Meaning": ""}, "splitFields": True},
+    "NoSource": {"fieldToExplain": "Word", "fieldPrompts": {"Back": ""}},
+}
+FRAGMENTS = ["", " ", "&nbsp;", "<br>", "<div></div>", "<b> </b>", " ", "\n", "apple", "<i>x</i>", "&amp;", "&nbsp;y",
+             "<a title=\">\">", "<", "&NBSP;"]
+
+
+def random_value(rng):
+    return "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 3)))
+
+
+@pytest.mark.parametrize("fragment", FRAGMENTS)
+def test_emptiness_matches_baseline(fragment):
+    for text in (fragment, fragment * 2, " " + fragment + "<br>"):
+        assert prescan.is_field_visually_empty(text) == baseline_is_empty(text)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_chunked_scan_matches_per_note_baseline(seed):
+    rng = random.Random(seed)
+    notes = {}
+    for nid in range(1, 301):
+        mid = rng.choice(MODELS)["id"]
+        notes[nid] = (mid, [random_value(rng) for _ in col_fields(mid)])
+    col = FakeCol(MODELS, notes)
+    nids = list(notes) + [9999]  # 已删除的笔记：两种扫描都跳过
+    notes_for_baseline = [nid for nid in nids if nid in notes]
+
+    expected, expected_stats = baseline_prescan(col, notes_for_baseline, CONFIGS)
+    plans, stats, scanned = {}, prescan.new_scan_stats(len(nids)), []
+    for chunk in prescan.chunk_note_ids(nids, size=64):
+        scanned.extend(prescan.scan_notes_chunk(col, chunk, CONFIGS, plans, stats))
+
+    assert col.queries == 5  # 每块一次查询，不逐条读取笔记
+    assert [{key: value for key, value in item.items() if key != "split"} for item in scanned] == expected
+    assert all(item["split"] == (notes[item["nid"]][0] == 2) for item in scanned)
+    for key in ("total_configured_fields", "ready_to_update", "skipped_not_empty", "skipped_not_configured"):
+        assert stats[key] == expected_stats[key]
+    assert stats["scanned_notes"] == len(nids)
+
+
+def col_fields(mid):
+    return next(m for m in MODELS if m["id"] == mid)["flds"]
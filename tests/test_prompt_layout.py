@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from conftest import ENGINES, load, make_config, make_tasks, run_batch
+from mock_server import PREFIX_FIELDS_MARKER
+
+ai_service = load("ai_service")
+
+SYSTEM_PROMPT = "你是词汇助手。"
+FIELDS = {"Meaning": "解释 {word} 在 {context} 中的含义", "Example": ""}
+LAYOUT = {"enablePromptCacheLayout": True}
+
+
+def test_static_prefix_is_byte_stable_across_notes():
+    first_system, first_user = ai_service.build_prompt("apple", "I ate an apple.", FIELDS, SYSTEM_PROMPT, LAYOUT)
+    second_system, second_user = ai_service.build_prompt("ice cream", "", dict(FIELDS), SYSTEM_PROMPT, LAYOUT)
+
+    assert first_system.encode("utf-8") == second_system.encode("utf-8")
+    assert first_system.startswith(SYSTEM_PROMPT)
+    # 前缀中的字段指令不代入变量，空提示词替换为默认模板
+    templates = json.loads(first_system.rpartition(PREFIX_FIELDS_MARKER)[2])
+    assert templates == {"Meaning": FIELDS["Meaning"], "Example": ai_service.DEFAULT_FIELD_PROMPT_TEMPLATE}
+    # 每条笔记变化的部分只出现在 User Content 中
+    assert json.loads(first_user) == {"word": "apple", "context": "I ate an apple."}
+    assert json.loads(second_user) == {"word": "ice cream", "context": ""}
+    assert "apple" not in first_system
+
+
+def test_prefix_changes_only_with_field_instructions():
+    prefix, _ = ai_service.build_prompt("apple", "", FIELDS, SYSTEM_PROMPT, LAYOUT)
+    assert ai_service.build_prompt("apple", "", {"Meaning": FIELDS["Meaning"]}, SYSTEM_PROMPT, LAYOUT)[0] != prefix
+    assert ai_service.build_prompt("apple", "", FIELDS, "另一个系统提示词", LAYOUT)[0] != prefix
+
+
+def test_layout_off_keeps_requirements_in_user_content():
+    system_content, user_content = ai_service.build_prompt("apple", "I ate an apple.", FIELDS, SYSTEM_PROMPT, {})
+    assert system_content == SYSTEM_PROMPT
+    assert json.loads(user_content)["requirements"]["Meaning"] == "解释 apple 在 I ate an apple. 中的含义"
+
+
+def test_packed_prefix_is_shared_between_packs():
+    config = {"enableResponseCache": False, "enablePackedRequests": True, **LAYOUT}
+    first = ai_service.prepare_pack(make_tasks(3, FIELDS), config)
+    second = ai_service.prepare_pack(make_tasks(6, FIELDS)[3:], config)
+    assert first[2] == second[2]
+    assert json.loads(second[1])["notes"]["4"] == {"word": "word4", "context": ""}
+    # 包内字段不一致时退回逐条携带 requirements
+    mixed = make_tasks(2, FIELDS) + make_tasks(1)
+    _, user_content, system_content, _ = ai_service.prepare_pack(mixed, config)
+    assert PREFIX_FIELDS_MARKER not in system_content
+    assert all("requirements" in note for note in json.loads(user_content)["notes"].values())
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_cache_layout_raises_provider_prefix_hits(engine, mock_server):
+    cached = {}
+    for layout in (False, True):
+        server = mock_server(latency="fixed:0")
+        tasks = make_tasks(4, FIELDS)
+        run = run_batch(engine, tasks, make_config(server.url, enablePromptCacheLayout=layout), workers=1)
+        assert all(task.success and set(task.results_map) == set(FIELDS) for task in tasks)
+        cached[layout] = run.counters.get("cached_tokens", 0)
+    # 字段指令进入固定前缀后，可被服务商缓存的输入更多
+    assert cached[True] > cached[False] > 0
@@ -0,0 +1,116 @@
+import email.utils
+import time
+
+import pytest
+
+from conftest import load
+
+rate_limiter = load("rate_limiter")
+
+
+def test_bucket_starts_full_and_allows_burst():
+    bucket = rate_limiter.TokenBucket(60, burst_seconds=10)  # 1/s，容量 10
+    assert bucket.capacity == 10
+    now = bucket.updated
+    for _ in range(10):
+        assert bucket.reserve(1, now) == 0.0
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+    assert bucket.reserve(1, now) == pytest.approx(2.0)
+
+
+def test_bucket_refills_at_rate_up_to_capacity():
+    bucket = rate_limiter.TokenBucket(120, burst_seconds=5)  # 2/s，容量 10
+    now = bucket.updated
+    assert bucket.reserve(10, now) == 0.0
+    assert bucket.reserve(4, now + 1.0) == pytest.approx(1.0)  # 1 秒补充 2 个后余额为 -2，需要等 1 秒
+    assert bucket.level == pytest.approx(-2.0)
+    assert bucket.reserve(0, now + 2.0) == 0.0
+    assert bucket.level == pytest.approx(0.0)
+    bucket.reserve(0, now + 1000.0)
+    assert bucket.level == pytest.approx(bucket.capacity)
+
+
+def test_bucket_wait_time_and_refund():
+    bucket = rate_limiter.TokenBucket(60, burst_seconds=1)  # 1/s，容量 1
+    now = bucket.updated
+    assert bucket.reserve(4, now) == pytest.approx(3.0)
+    bucket.refund(2)
+    assert bucket.level == pytest.approx(-1.0)
+    bucket.refund(100)
+    assert bucket.level == bucket.capacity
+
+
+def test_small_rate_keeps_capacity_of_one():
+    assert rate_limiter.TokenBucket(1).capacity == 1.0
+
+
+def test_limiter_reserves_both_buckets():
+    limiter = rate_limiter.RateLimiter(rpm=6000, tpm=600)  # 请求 100/s，Token 10/s（容量 100）
+    assert limiter.reserve(100) == 0.0
+    assert limiter.reserve(50) == pytest.approx(5.0, rel=0.05)
+    # 用实际 usage 修正预扣后，等待时间随之缩短
+    limiter.correct(50, 10)
+    assert limiter.reserve(0) == pytest.approx(1.0, rel=0.05)
+
+
+def test_limiter_without_limits_never_waits():
+    limiter = rate_limiter.RateLimiter()
+    assert all(limiter.reserve(10**6) == 0.0 for _ in range(100))
+
+
+def test_penalize_blocks_shared_requests():
+    limiter = rate_limiter.RateLimiter()
+    limiter.penalize(2.0)
+    assert 1.5 < limiter.reserve(1) <= 2.0
+    assert 1.5 < limiter.penalty_remaining() <= 2.0
+    limiter.penalize(10**6)
+    assert limiter.penalty_remaining() <= rate_limiter.MAX_PENALTY_SECONDS
+
+
+def test_acquire_returns_early_on_cancel():
+    limiter = rate_limiter.RateLimiter()
+    limiter.penalize(5.0)
+
+    class Cancelled:
+        def wait(self, timeout):
+            self.timeout = timeout
+
+    cancel = Cancelled()
+    limiter.acquire(1, cancel)
+    assert 4 < cancel.timeout <= 5
+
+
+def test_update_from_headers():
+    limiter = rate_limiter.RateLimiter()
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "5", "x-ratelimit-reset-requests": "30s"})
+    assert limiter.penalty_remaining() == 0.0
+    limiter.update_from_headers({"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "1m30s"})
+    assert 89 < limiter.penalty_remaining() <= 90
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("20ms", 0.02), ("1s", 1.0), ("6m0s", 360.0), ("1h2m3.5s", 3723.5), ("2.5", 2.5), ("", None), ("soon", None),
+])
+def test_parse_duration(value, seconds):
+    assert rate_limiter.parse_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
+
+
+def test_retry_after_seconds():
+    assert rate_limiter.retry_after_seconds(None) is None
+    assert rate_limiter.retry_after_seconds({}) is None
+    assert rate_limiter.retry_after_seconds({"retry-after-ms": "1500", "Retry-After": "9"}) == 1.5
+    assert rate_limiter.retry_after_seconds({"Retry-After": "7"}) == 7.0
+    assert rate_limiter.retry_after_seconds({"Retry-After": "-3"}) == 0.0
+    http_date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 < rate_limiter.retry_after_seconds({"Retry-After": http_date}) <= 30
+    assert rate_limiter.retry_after_seconds({"Retry-After": "not a date"}) is None
+
+
+def test_get_rate_limiter_is_shared_and_reconfigured(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    config = {"apiConfig": {"openai": {"rpm": 60}}}
+    limiter = rate_limiter.get_rate_limiter("openai", config)
+    assert limiter is rate_limiter.get_rate_limiter("openai", config)
+    assert limiter.request_bucket is not None and limiter.token_bucket is None
+    rate_limiter.get_rate_limiter("openai", {"apiConfig": {"openai": {"tpm": 1000}}})
+    assert limiter.request_bucket is None and limiter.token_bucket is not None
@@ -0,0 +1,120 @@
+import pytest
+
+from conftest import load
+
+response_cache = load("response_cache")
+ai_service = load("ai_service")
+prompts = load("prompts")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.db"), max_size_mb=200, max_age_days=30)
+    yield cache
+    cache.conn.close()
+
+
+def test_get_put_and_stats(cache):
+    assert cache.get("k") is None
+    cache.put("k", {"Meaning": "释义"}, 42)
+    assert cache.get("k") == ({"Meaning": "释义"}, 42)
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_entries_expire_after_max_age(cache, clock):
+    cache.put("old", {"a": "1"}, 1)
+    clock.now += 29 * 86400
+    cache.put("new", {"b": "2"}, 1)
+    assert cache.get("old") is not None
+    clock.now += 2 * 86400
+    # 读取时按创建时间判断过期，访问过也不会延长寿命
+    assert cache.get("old") is None
+    assert cache.get("new") is not None
+    clock.now += 29 * 86400
+    cache.evict()
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction_at_size_cap(cache, clock):
+    value = {"Meaning": "x" * 100}
+    for key in "abcd":
+        clock.now += 1
+        cache.put(key, value, 1)
+    entry_size = cache.stats()["size_bytes"] // 4
+    cache.max_bytes = entry_size * 3
+    # 最近读取过的 a 比 b 更晚被访问，超出上限时先淘汰最久未访问的 b
+    clock.now += 1
+    assert cache.get("a") is not None
+    cache.evict()
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+    assert cache.stats()["size_bytes"] <= cache.max_bytes
+
+
+def test_eviction_runs_every_n_puts(cache, clock, monkeypatch):
+    monkeypatch.setattr(response_cache, "EVICT_EVERY_N_PUTS", 3)
+    cache.max_bytes = 1
+    cache.put("a", {"v": "1"}, 1)
+    cache.put("b", {"v": "2"}, 1)
+    assert cache.stats()["entries"] == 2
+    cache.put("c", {"v": "3"}, 1)
+    assert cache.stats()["entries"] == 0
+
+
+CONFIG = {
+    "aiService": "openai",
+    "apiConfig": {
+        "openai": {"apiKey": "k", "model": "gpt", "temperature": 0.1},
+        "deepseek": {"apiKey": "k", "model": "ds", "temperature": 0.1},
+        "xai": {"model": "grok"},
+    },
+}
+
+
+def key(fields=None, service="openai", config=CONFIG, word="apple", context="", system="system"):
+    return ai_service._cache_key(word, context, config, fields or {"Meaning": "释义"}, system, service)
+
+
+def test_cache_key_differs_per_prompt():
+    base = key()
+    assert key(word=" apple ") == base
+    assert key(fields={"Meaning": "词源"}) != base
+    assert key(fields={"Example": "释义"}) != base
+    assert key(context="fruit") != base
+    assert key(system="other system") != base
+    # 未填写提示词的字段按默认提示词计算，与显式填写默认提示词的结果共享缓存
+    assert key(fields={"Meaning": ""}) == key(fields={"Meaning": prompts.DEFAULT_FIELD_PROMPT_TEMPLATE})
+
+
+def test_cache_key_differs_per_provider_and_model():
+    assert key(service="deepseek") != key(service="openai")
+    other_model = {**CONFIG, "apiConfig": {**CONFIG["apiConfig"], "openai": {**CONFIG["apiConfig"]["openai"], "model": "gpt-mini"}}}
+    assert key(config=other_model) != key()
+    # 未配置 API Key 的服务不参与缓存
+    assert key(service="xai") is None
+
+
+def test_cache_slot_writes_under_the_serving_provider(cache):
+    keys = {"openai": key(), "deepseek": key(service="deepseek")}
+    slot = ai_service.CacheSlot(cache, keys)
+    slot.put("DeepSeek/ds", {"Meaning": "x"}, 5)
+    assert cache.get(keys["deepseek"]) == ({"Meaning": "x"}, 5)
+    assert cache.get(keys["openai"]) is None
+    slot.put("未知来源", {"Meaning": "y"}, 5)
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,123 @@
+import json
+import random
+import socket
+import time
+
+import pytest
+import requests
+
+from conftest import load
+
+retry_policy = load("retry_policy")
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class StatusError(Exception):
+    """模拟 aiohttp.ClientResponseError：状态码在 status 上"""
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class MaxRng:
+    """uniform 总是返回上界，用于检查退避上限"""
+    def uniform(self, low, high):
+        return high
+
+
+@pytest.mark.parametrize("status, category", [
+    (429, retry_policy.ERROR_RATE_LIMIT),
+    (401, retry_policy.ERROR_AUTH),
+    (403, retry_policy.ERROR_AUTH),
+    (408, retry_policy.ERROR_SERVER),
+    (500, retry_policy.ERROR_SERVER),
+    (503, retry_policy.ERROR_SERVER),
+    (400, retry_policy.ERROR_CLIENT),
+    (404, retry_policy.ERROR_CLIENT),
+    (200, retry_policy.ERROR_OTHER),
+])
+def test_status_category(status, category):
+    assert retry_policy.status_category(status) == category
+    assert retry_policy.error_category(requests.HTTPError(response=FakeResponse(status))) == category
+    assert retry_policy.error_category(StatusError(status)) == category
+
+
+@pytest.mark.parametrize("error, category", [
+    (requests.Timeout(), retry_policy.ERROR_TIMEOUT),
+    (requests.ConnectTimeout(), retry_policy.ERROR_TIMEOUT),
+    (socket.timeout(), retry_policy.ERROR_TIMEOUT),
+    (requests.ConnectionError(), retry_policy.ERROR_NETWORK),
+    (ConnectionResetError(), retry_policy.ERROR_NETWORK),
+    (json.JSONDecodeError("bad", "", 0), retry_policy.ERROR_BAD_RESPONSE),
+    (RuntimeError(), retry_policy.ERROR_OTHER),
+])
+def test_error_category(error, category):
+    assert retry_policy.error_category(error) == category
+
+
+@pytest.mark.parametrize("category", sorted(retry_policy.NON_RETRYABLE))
+def test_non_retryable(category):
+    assert retry_policy.RetryPolicy(max_retries=5).next_delay(category, 0, {}) is None
+
+
+def test_backoff_bounds():
+    policy = retry_policy.RetryPolicy(max_retries=10, base_delay=0.5, max_delay=4.0, rng=MaxRng())
+    delays = [policy.next_delay(retry_policy.ERROR_SERVER, attempt, {}) for attempt in range(6)]
+    assert delays == [0.5, 1.0, 2.0, 4.0, 4.0, 4.0]
+
+    policy = retry_policy.RetryPolicy(max_retries=10, base_delay=0.5, max_delay=4.0, rng=random.Random(1))
+    for attempt in range(8):
+        for _ in range(50):
+            delay = policy.next_delay(retry_policy.ERROR_TIMEOUT, attempt, {})
+            assert 0 <= delay <= min(4.0, 0.5 * 2 ** attempt)
+
+
+def test_max_retries():
+    policy = retry_policy.RetryPolicy(max_retries=2)
+    assert policy.next_delay(retry_policy.ERROR_SERVER, 1, {}) is not None
+    assert policy.next_delay(retry_policy.ERROR_SERVER, 2, {}) is None
+
+
+def test_bad_response_limit():
+    policy = retry_policy.RetryPolicy(max_retries=5, bad_response_retries=1)
+    category = retry_policy.ERROR_BAD_RESPONSE
+    assert policy.next_delay(category, 0, {}) is not None
+    assert policy.next_delay(category, 1, {category: 1}) is None
+    # 其他类型的重试不占用无效响应的次数
+    assert policy.next_delay(category, 2, {retry_policy.ERROR_SERVER: 2}) is not None
+
+
+def test_retry_after_is_a_floor():
+    policy = retry_policy.RetryPolicy(max_retries=3, base_delay=0.5, max_delay=1.0)
+    assert policy.next_delay(retry_policy.ERROR_RATE_LIMIT, 0, {}, retry_after=7.5) == 7.5
+
+
+def test_deadline_caps_retries():
+    policy = retry_policy.RetryPolicy(max_retries=3, base_delay=0.5, max_delay=1.0, rng=MaxRng())
+    with retry_policy.deadline_scope(5):
+        assert policy.next_delay(retry_policy.ERROR_SERVER, 0, {}) == 0.5
+        # 等待 Retry-After 后已超过截止时间，不再重试
+        assert policy.next_delay(retry_policy.ERROR_RATE_LIMIT, 0, {}, retry_after=10) is None
+    assert policy.next_delay(retry_policy.ERROR_RATE_LIMIT, 0, {}, retry_after=10) == 10
+
+
+def test_deadline_scope_nests_to_earliest():
+    assert retry_policy.deadline_remaining() is None
+    assert retry_policy.request_timeout() == retry_policy.REQUEST_TIMEOUT_SECONDS
+    with retry_policy.deadline_scope(10):
+        with retry_policy.deadline_scope(100):
+            assert retry_policy.deadline_remaining() <= 10
+        with retry_policy.deadline_scope(2):
+            assert retry_policy.request_timeout() <= 2
+        with retry_policy.deadline_scope(0):
+            assert 0 < retry_policy.deadline_remaining() <= 10
+    assert retry_policy.deadline_remaining() is None
+    with retry_policy.deadline_scope(-1):
+        assert not retry_policy.deadline_expired()
+    with retry_policy.deadline_scope(0.01):
+        time.sleep(0.02)
+        assert retry_policy.deadline_expired()
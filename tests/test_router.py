@@ -0,0 +1,193 @@
+import pytest
+
+from conftest import ENGINES, FirstRequestSlow, load, make_config, make_tasks, run_batch
+
+router = load("router")
+ai_service = load("ai_service")
+
+
+@pytest.fixture(autouse=True)
+def fresh_router(monkeypatch):
+    """共享路由器的熔断状态不跨测试保留"""
+    monkeypatch.setattr(router, "_router", router.ProviderRouter())
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_router(weights):
+    provider_router = router.ProviderRouter()
+    provider_router.configure(weights)
+    return provider_router
+
+
+def test_weighted_round_robin_is_smooth():
+    provider_router = make_router({"a": 3, "b": 1})
+    picks = [provider_router.choose() for _ in range(8)]
+    assert picks.count("a") == 6 and picks.count("b") == 2
+    # 平滑加权：权重小的服务均匀穿插，而不是集中在一轮的末尾
+    assert picks[:4].count("b") == 1 and picks[4:].count("b") == 1
+
+
+def test_choose_skips_excluded_and_prefers_unthrottled():
+    provider_router = make_router({"a": 1, "b": 1})
+    assert provider_router.choose(exclude={"a"}) == "b"
+    assert provider_router.choose(exclude={"a", "b"}) is None
+    assert all(provider_router.choose(throttled={"a"}) == "b" for _ in range(4))
+    # 所有服务都在限流时仍然分配
+    assert provider_router.choose(throttled={"a", "b"}) in {"a", "b"}
+
+
+def test_circuit_opens_then_half_opens_after_cooldown(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(router.time, "monotonic", clock)
+    provider_router = make_router({"a": 1, "b": 1})
+    for _ in range(router.CIRCUIT_FAILURE_THRESHOLD):
+        provider_router.record("a", False)
+    assert provider_router.open_circuits() == ["a"]
+    assert all(provider_router.choose() == "b" for _ in range(4))
+
+    clock.now += router.CIRCUIT_COOLDOWN_SECONDS
+    picks = [provider_router.choose() for _ in range(4)]
+    # 半开：冷却结束后只放行一个试探请求
+    assert picks.count("a") == 1
+    provider_router.record("a", True)
+    assert provider_router.open_circuits() == []
+
+
+def test_failed_probe_reopens_circuit(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(router.time, "monotonic", clock)
+    provider_router = make_router({"a": 1, "b": 1})
+    for _ in range(router.CIRCUIT_FAILURE_THRESHOLD):
+        provider_router.record("a", False)
+    clock.now += router.CIRCUIT_COOLDOWN_SECONDS
+    assert "a" in [provider_router.choose() for _ in range(2)]
+    provider_router.record("a", False)
+    assert all(provider_router.choose() == "b" for _ in range(4))
+
+
+def test_all_open_falls_back_to_earliest_opened(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(router.time, "monotonic", clock)
+    provider_router = make_router({"a": 1, "b": 1})
+    for service in ("b", "a"):
+        for _ in range(router.CIRCUIT_FAILURE_THRESHOLD):
+            provider_router.record(service, False)
+        clock.now += 1
+    assert provider_router.choose() == "b"
+
+
+def test_provider_weights_and_get_router():
+    config = {
+        "aiService": "openai",
+        "apiConfig": {
+            "openai": {"apiKey": "k"},
+            "deepseek": {"apiKey": "k"},
+            "xai": {"apiKey": "", "weight": 5},
+        },
+    }
+    # 未设置 weight 时只有当前服务参与
+    assert router.provider_weights(config) == {"openai": 1}
+    assert router.get_router({**config, "enableMultiProvider": True}) is None
+    config["apiConfig"]["deepseek"]["weight"] = 2
+    assert router.provider_weights(config) == {"openai": 1, "deepseek": 2}
+    assert router.get_router(config) is None
+    assert router.get_router({**config, "enableMultiProvider": True}) is not None
+
+
+def multi_provider_config(failing, healthy, **overrides):
+    config = make_config(failing.url, enableMultiProvider=True, **overrides)
+    config["apiConfig"]["deepseek"] = {"baseUrl": healthy.url, "apiKey": "test-key", "model": "ds-model", "weight": 1}
+    return config
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_failover_to_healthy_provider(engine, mock_server):
+    failing = mock_server(latency="fixed:0", rate_5xx=1.0)
+    healthy = mock_server(latency="fixed:0")
+    tasks = make_tasks(10)
+    run = run_batch(engine, tasks, multi_provider_config(failing, healthy), workers=4 if engine == "asyncio" else 2)
+
+    assert all(task.success for task in tasks)
+    assert {task.source for task in tasks} == {"DeepSeek/ds-model"}
+    assert run.counters.get("failovers", 0) >= 1
+    assert "openai" in router._router.open_circuits()
+    # 熔断后不再把请求发往失败的服务（熔断前已在途的请求除外）
+    assert failing.settings.stats["requests"] < len(tasks)
+
+
+def test_routed_results_are_cached_under_the_serving_provider(mock_server):
+    failing = mock_server(latency="fixed:0", rate_5xx=1.0)
+    healthy = mock_server(latency="fixed:0")
+    config = multi_provider_config(failing, healthy, enableResponseCache=True)
+    system_prompt = ai_service.resolve_system_prompt(config)
+    fields = {"Meaning": "释义"}
+
+    for _ in range(router.CIRCUIT_FAILURE_THRESHOLD + 1):
+        results, _, cache_hit, source = ai_service.generate_batch_explanation("apple", "", config, fields, use_cache=False)
+    assert results and not cache_hit and source == "DeepSeek/ds-model"
+
+    cache = load("response_cache").get_response_cache(config)
+    assert cache.get(ai_service._cache_key("apple", "", config, fields, system_prompt, "deepseek")) is not None
+    assert cache.get(ai_service._cache_key("apple", "", config, fields, system_prompt, "openai")) is None
+
+    requests_before = healthy.settings.stats["requests"]
+    results, tokens, cache_hit, source = ai_service.generate_batch_explanation("apple", "", config, fields)
+    assert cache_hit and source == ai_service.CACHE_SOURCE and tokens == 0
+    assert healthy.settings.stats["requests"] == requests_before
+
+
+def half_open(service):
+    """把服务的熔断器置为冷却已结束的半开状态，下一次派发即为试探请求"""
+    breaker = router._router.breakers[service]
+    breaker.failures = router.CIRCUIT_FAILURE_THRESHOLD
+    breaker.opened_at = router.time.monotonic() - router.CIRCUIT_COOLDOWN_SECONDS - 1
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("hedge_ok", [True, False])
+def test_hedge_to_half_open_provider_settles_probe(engine, hedge_ok, mock_server):
+    primary = mock_server(FirstRequestSlow(tail_latency=1.0))
+    alternative = mock_server(latency="fixed:0", rate_5xx=0.0 if hedge_ok else 1.0)
+    config = multi_provider_config(primary, alternative, enableHedging=True, hedgeDelaySeconds=0.2, hedgeMaxPercent=100)
+    # 原服务权重远大于备用服务，原请求总是发往原服务，对冲请求由路由器选择备用服务
+    config["apiConfig"]["openai"]["weight"] = 100
+    router.get_router(config)
+    half_open("deepseek")
+
+    tasks = make_tasks(1)
+    run = run_batch(engine, tasks, config)
+    task = tasks[0]
+
+    assert task.success
+    assert run.counters.get("hedges") == 1
+    assert alternative.settings.stats["requests"] == 1
+    breaker = router._router.breakers["deepseek"]
+    assert not breaker.probing
+    if hedge_ok:
+        # 试探成功：熔断器关闭，备用服务重新参与路由
+        assert task.source == "DeepSeek/ds-model"
+        assert not breaker.is_open
+        assert "deepseek" in {router._router.choose({"openai"}) for _ in range(3)}
+    else:
+        # 试探失败：重新熔断，原请求的结果照常返回
+        assert task.source == "OpenAI/test-model"
+        assert breaker.is_open and breaker.failures == router.CIRCUIT_FAILURE_THRESHOLD + 1
+
+
+def test_abandoned_hedge_releases_probe():
+    provider_router = make_router({"a": 1, "b": 1})
+    provider_router.breakers["b"].opened_at = router.time.monotonic() - router.CIRCUIT_COOLDOWN_SECONDS - 1
+    assert provider_router.choose({"a"}) == "b" and provider_router.breakers["b"].probing
+    ai_service.settle_hedge_target(provider_router, "a", "b", False, True)
+    breaker = provider_router.breakers["b"]
+    assert not breaker.probing and breaker.is_open and breaker.failures == 0
+    # 同一服务的对冲不经过路由器派发，不影响熔断器
+    ai_service.settle_hedge_target(provider_router, "a", "a", False, False)
+    assert provider_router.breakers["a"].failures == 0
@@ -0,0 +1,53 @@
+import time
+
+from conftest import load
+
+ai_service = load("ai_service")
+
+
+def wait_for(condition, timeout=3.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end: return False
+        time.sleep(0.02)
+    return True
+
+
+def idle_connections(session, url):
+    pools = session.get_adapter(url).poolmanager.pools
+    return sum(1 for key in pools.keys() for conn in list(pools.get(key).pool.queue) if conn is not None and conn.is_connected)
+
+
+def test_preconnect_warms_pool_with_head_requests(mock_server):
+    server = mock_server(latency="fixed:0")
+    pool = ai_service.SessionPool()
+    pool.preconnect("openai", server.url, pool_size=4, count=3)
+    session = pool.get_session("openai", 4)
+    assert wait_for(lambda: server.settings.stats["head"] == 3 and idle_connections(session, server.url) > 0)
+    # 预连接只发送 HEAD 请求，不会产生计费的 POST
+    assert server.settings.stats["requests"] == 0
+    opened = pool.connection_stats("openai", server.url)["connections_opened"]
+    assert 1 <= opened <= 3
+
+    session.post(server.url, json={"model": "m", "messages": [{"role": "user", "content": "{}"}]}, timeout=5).close()
+    # 正式请求复用预建的连接
+    assert pool.connection_stats("openai", server.url)["connections_opened"] == opened
+
+
+def test_pool_size_covers_hedges_and_split_fields():
+    # 并发请求 6 + 在途对冲请求上限 + 字段拆分线程 6
+    hedging = load("hedging")
+    assert ai_service._pool_size_for({"maxConcurrentRequests": 6}) == 12 + hedging.HEDGE_MAX_IN_FLIGHT
+    assert ai_service._pool_size_for({"enableMultiThreading": False}) == 2 + hedging.HEDGE_MAX_IN_FLIGHT
+
+
+def test_growing_pool_keeps_old_session_usable(mock_server):
+    server = mock_server(latency="fixed:0")
+    pool = ai_service.SessionPool()
+    small = pool.get_session("openai", 1)
+    large = pool.get_session("openai", 8)
+    assert large is not small
+    assert pool.get_session("openai", 4) is large
+    # 换用更大的 Session 后，仍持有旧 Session 的请求照常完成
+    response = small.post(server.url, json={"model": "m", "messages": [{"role": "user", "content": "{}"}]}, timeout=5)
+    assert response.status_code == 200
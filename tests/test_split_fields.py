@@ -0,0 +1,101 @@
+import json
+from threading import Lock
+
+import pytest
+
+from conftest import ENGINES, load, make_tasks, run_batch
+
+ai_service = load("ai_service")
+async_engine = load("async_engine")
+
+CONFIG = {"aiService": "openai", "apiConfig": {"openai": {"apiKey": "k", "model": "m", "baseUrl": "http://unused"}},
+          "enableResponseCache": False, "maxRetries": 0, "badResponseRetries": 0}
+FIELDS = {"Meaning": "释义", "Example": "例句", "Synonyms": "近义词"}
+
+
+class FakeService:
+    """代替 call_ai_service：每个字段单独计 10 个 Token，broken 中的字段返回无法解析的内容、failing 中的字段请求失败"""
+
+    def __init__(self, broken=(), failing=()):
+        self.broken = set(broken)
+        self.failing = set(failing)
+        self.lock = Lock()
+        self.requested = []
+
+    def __call__(self, user_content, config, system_content, cancel_event=None, on_field=None):
+        fields = list(json.loads(user_content)["requirements"])
+        with self.lock:
+            self.requested.append(fields)
+        if self.failing.intersection(fields): return None, 0, None
+        if self.broken.intersection(fields): return "{not json", 10, "OpenAI/m"
+        return json.dumps({field: f"{field} 内容" for field in fields}, ensure_ascii=False), 10, "OpenAI/m"
+
+    async def call_async(self, session, user_content, config, system_content, cancel_event=None):
+        return self(user_content, config, system_content, cancel_event)
+
+
+def test_merge_keeps_successful_fields():
+    merged = ai_service.merge_field_results([
+        ({"Meaning": "a"}, 10, True, "OpenAI/m"),
+        (None, 5, False, None),
+        ({"Example": "b"}, 10, False, "DeepSeek/ds"),
+    ])
+    # 部分字段失败时保留成功的字段，Token 按全部请求累计，任一字段未命中缓存即不算缓存命中
+    assert merged == ({"Meaning": "a", "Example": "b"}, 25, False, "OpenAI/m, DeepSeek/ds")
+    assert ai_service.merge_field_results([({"Meaning": "a"}, 0, True, "缓存"), ({"Example": "b"}, 0, True, "缓存")]) == (
+        {"Meaning": "a", "Example": "b"}, 0, True, "缓存")
+
+
+def test_merge_all_failed_follows_single_request_convention():
+    # 任一字段解析失败时整体按解析失败（None）处理，否则为请求失败（{}）
+    assert ai_service.merge_field_results([(None, 10, False, None), ({}, 0, False, None)]) == (None, 10, False, None)
+    assert ai_service.merge_field_results([({}, 0, False, None), ({}, 0, False, None)]) == ({}, 0, False, None)
+
+
+def split_tasks(count):
+    tasks = make_tasks(count, FIELDS)
+    for task in tasks: task.split_fields = True
+    return tasks
+
+
+def patch_service(monkeypatch, service):
+    monkeypatch.setattr(ai_service, "call_ai_service", service)
+    monkeypatch.setattr(async_engine, "_call_ai_service_async", service.call_async)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_split_task_requests_each_field(engine, monkeypatch):
+    service = FakeService()
+    patch_service(monkeypatch, service)
+    tasks = split_tasks(2)
+    run_batch(engine, tasks, CONFIG)
+
+    assert sorted(map(tuple, service.requested)) == sorted([(field,) for field in FIELDS] * 2)
+    for task in tasks:
+        assert task.success and task.tokens == 30
+        # 结果按配置中的字段顺序合并
+        assert list(task.results_map) == list(FIELDS)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_split_task_partial_failure(engine, monkeypatch):
+    patch_service(monkeypatch, FakeService(broken={"Example"}, failing={"Synonyms"}))
+    tasks = split_tasks(1)
+    run_batch(engine, tasks, CONFIG)
+    task = tasks[0]
+
+    assert task.success and task.results_map == {"Meaning": "Meaning 内容"}
+    # 解析失败的字段同样已付费
+    assert task.tokens == 20
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_split_task_all_fields_failed(engine, monkeypatch):
+    patch_service(monkeypatch, FakeService(broken={"Meaning"}, failing={"Example", "Synonyms"}))
+    tasks = split_tasks(1)
+    run = run_batch(engine, tasks, CONFIG)
+    task = tasks[0]
+
+    assert run.reported == [task]
+    assert not task.success and task.error == ai_service.PARSE_FAILED_ERROR
+    assert task.tokens == 10
@@ -0,0 +1,59 @@
+import pytest
+
+from conftest import load
+
+token_estimator = load("token_estimator")
+
+
+@pytest.mark.parametrize("text, tokens", [
+    ("", 0), (None, 0), ("abcd", 1), ("abcde", 2), ("单词", 2), ("ab单词", 3),
+])
+def test_estimate_text_tokens(text, tokens):
+    assert token_estimator.estimate_text_tokens(text) == tokens
+
+
+def test_estimate_request_tokens():
+    data = {"messages": [{"role": "system", "content": "a" * 40}, {"role": "user", "content": "解释"}]}
+    input_tokens = 2 * token_estimator.TOKENS_PER_MESSAGE + 10 + 2
+    assert token_estimator.estimate_request_tokens(data) == input_tokens + token_estimator.DEFAULT_OUTPUT_TOKENS
+    assert token_estimator.estimate_request_tokens(dict(data, max_tokens=50)) == input_tokens + 50
+    assert token_estimator.estimate_request_tokens(data, output_tokens=0) == input_tokens
+
+
+def test_estimate_task_tokens():
+    assert token_estimator.estimate_task_tokens("abcdefgh", 2) == 2 + 2 * token_estimator.DEFAULT_OUTPUT_TOKENS_PER_FIELD
+
+
+def test_token_cost_uses_cached_price():
+    pricing = token_estimator.token_prices({"inputPricePerMTokens": 2.0, "outputPricePerMTokens": 8.0,
+                                            "cachedInputPricePerMTokens": 0.5})
+    assert pricing == (2.0, 8.0, 0.5)
+    assert token_estimator.token_cost(pricing, 1_000_000, 500_000, cached_tokens=400_000) == pytest.approx(1.2 + 0.2 + 4.0)
+    # 未配置缓存单价时按普通输入单价
+    assert token_estimator.token_prices({"inputPricePerMTokens": 2.0}) == (2.0, 0.0, 2.0)
+    assert token_estimator.token_cost(token_estimator.token_prices({}), 10**6, 10**6) == 0
+
+
+def test_run_estimate_matches_rendered_prompt():
+    system_prompt = "x" * 400
+    template = "Explain {word} in {context}"
+    estimate = token_estimator.RunEstimate(system_prompt)
+    estimate.add("word", "some context", {"Meaning": template})
+
+    rendered = template.replace("{word}", "word").replace("{context}", "some context")
+    expected = (2 * token_estimator.TOKENS_PER_MESSAGE + 100 + token_estimator.USER_PAYLOAD_OVERHEAD_TOKENS
+                + 1 + 3 + token_estimator.estimate_text_tokens("Meaning") + token_estimator.estimate_text_tokens(rendered))
+    # 模板中的占位符本身也按文本估算，因此略高于代入后的提示词
+    assert expected <= estimate.input_tokens <= expected * 1.05
+    assert estimate.output_tokens == token_estimator.DEFAULT_OUTPUT_TOKENS_PER_FIELD
+    assert estimate.total_tokens == estimate.input_tokens + estimate.output_tokens
+
+
+def test_run_estimate_spreads_system_prompt_over_pack():
+    single = token_estimator.RunEstimate("x" * 4000)
+    packed = token_estimator.RunEstimate("x" * 4000, notes_per_request=10)
+    for estimate in (single, packed):
+        for _ in range(10):
+            estimate.add("w", "", {"F": "{word}"})
+    assert single.input_tokens - packed.input_tokens == pytest.approx(10 * 0.9 * 1008, abs=20)
+    assert packed.cost({"inputPricePerMTokens": 1.0}) == pytest.approx(packed.input_tokens / 1e6)
@@ -0,0 +1,96 @@
+import math
+
+# --- Token 估算：不依赖任何分词库的离线近似，用于限流预扣和成本预估 ---
+
+# 英文等 ASCII 文本约 4 个字符 1 个 Token，中日韩等非 ASCII 字符约 1 个字符 1 个 Token
+ASCII_CHARS_PER_TOKEN = 4.0
+NON_ASCII_TOKENS_PER_CHAR = 1.0
+# 每条 message 的协议开销（role、分隔符等）
+TOKENS_PER_MESSAGE = 4
+# 无法从请求中得知输出长度时，预估的单次回复 Token 数
+DEFAULT_OUTPUT_TOKENS = 400
+# 每个目标字段预估的输出 Token 数
+DEFAULT_OUTPUT_TOKENS_PER_FIELD = 250
+# 每条笔记在 User Content 中的 JSON 结构开销（键名、引号、括号等）
+USER_PAYLOAD_OVERHEAD_TOKENS = 12
+
+
+def estimate_text_tokens(text):
+    if not text: return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    non_ascii_chars = len(text) - ascii_chars
+    return int(math.ceil(ascii_chars / ASCII_CHARS_PER_TOKEN + non_ascii_chars * NON_ASCII_TOKENS_PER_CHAR))
+
+
+def estimate_request_tokens(data, output_tokens=None):
+    """估算一次 Chat Completions 请求的总 Token（输入 + 预期输出）"""
+    input_tokens = sum(
+        TOKENS_PER_MESSAGE + estimate_text_tokens(message.get("content", ""))
+        for message in data.get("messages", [])
+    )
+    if output_tokens is None:
+        output_tokens = data.get("max_tokens") or DEFAULT_OUTPUT_TOKENS
+    return input_tokens + output_tokens
+
+
+def estimate_task_tokens(user_content, field_count):
+    """估算单条笔记在请求中占用的 Token（User Content + 各字段的预期输出）"""
+    return estimate_text_tokens(user_content) + field_count * DEFAULT_OUTPUT_TOKENS_PER_FIELD
+
+
+def token_prices(api_config):
+    """
+    服务商单价 (输入, 输出, 缓存命中的输入)，单位为每百万 Token；未配置时为 0，不计算费用。
+    未单独配置缓存命中单价时按普通输入单价计算。
+    """
+    input_price = api_config.get("inputPricePerMTokens", 0.0)
+    cached_price = api_config.get("cachedInputPricePerMTokens", 0.0) or input_price
+    return input_price, api_config.get("outputPricePerMTokens", 0.0), cached_price
+
+
+def token_cost(pricing, prompt_tokens, completion_tokens, cached_tokens=0):
+    """prompt_tokens 包含 cached_tokens，其中缓存命中部分按缓存单价计费"""
+    input_price, output_price, cached_price = pricing
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1_000_000
+
+
+class RunEstimate:
+    """
+    批量运行前的离线预估：逐条累计（去重后）请求的输入/输出 Token。
+    系统提示词和各字段提示词模板只估算一次，每条笔记只需估算单词和上下文。
+    """
+
+    def __init__(self, system_prompt, notes_per_request=1):
+        # 打包时系统提示词由一次请求中的多条笔记分摊
+        self.request_overhead = 2 * TOKENS_PER_MESSAGE + estimate_text_tokens(system_prompt)
+        self.notes_per_request = max(1, notes_per_request)
+        self.templates = {}
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def _template(self, template):
+        cached = self.templates.get(template)
+        if cached is None:
+            cached = self.templates[template] = (
+                estimate_text_tokens(template), template.count("{word}"), template.count("{context}")
+            )
+        return cached
+
+    def add(self, word, context, field_templates):
+        """field_templates 为 {字段名: 提示词模板}（未代入 {word}/{context}）"""
+        word_tokens = estimate_text_tokens(word)
+        context_tokens = estimate_text_tokens(context)
+        tokens = self.request_overhead / self.notes_per_request + USER_PAYLOAD_OVERHEAD_TOKENS + word_tokens + context_tokens
+        for field, template in field_templates.items():
+            template_tokens, word_refs, context_refs = self._template(template)
+            tokens += estimate_text_tokens(field) + template_tokens + word_refs * word_tokens + context_refs * context_tokens
+        self.input_tokens += int(math.ceil(tokens))
+        self.output_tokens += len(field_templates) * DEFAULT_OUTPUT_TOKENS_PER_FIELD
+
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens
+
+    def cost(self, api_config):
+        return token_cost(token_prices(api_config), self.input_tokens, self.output_tokens)